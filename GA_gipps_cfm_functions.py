@@ -8,6 +8,7 @@ import numpy as np
 from operator import itemgetter
 from copy import deepcopy
 from functions import import_cf_data
+from classes import CF_PIPELINE_COLUMNS, append_to_file
 
 
 """
@@ -539,12 +540,17 @@ def main():
     # ----------------------------------------------------------------------------------------
     # input_filename = 'wzdata_fw1_PC-hw-c_2017-06-12.csv'
     # input_source = 'fhwa_irv'
+    # input_filename = 'Event_ID_152218624_processed.bin'  # Binary export (see ProcessedData.binary_export)
+    # input_source = 'processed_data'
     input_filename = 'Event_ID_152218624.csv'
     input_path = r'C:\Users\britton.hammit\Dropbox\00-Education\research\03-NDS_and_RID\WY_SHRP2_NDS\Python_Analysis\02-NDS_Timeseries_Files'
     input_path = r'C:\Users\Britton\Dropbox\00-Education\Research\03-NDS_and_RID\WY_SHRP2_NDS\Python_Analysis\02-NDS_Timeseries_Files'
     input_source = 'wy_nds_stac'
     stac_filename = '5228273_7_data_partition_edit.csv'
     stac_path = input_path
+    # Folder for the cache of parsed input files - repeated runs on the same files skip parsing (None: no cache)
+    # cache_path = os.path.join(input_path, 'parsed_cache')
+    cache_path = None
 
     # Identify save paths:
     # ----------------------------------------------------------------------------------------
@@ -563,20 +569,19 @@ def main():
 
     # Initialize summary file:
     # ----------------------------------------------------------------------------------------
-    summary_file = open(os.path.join(summary_file_path, summary_filename), 'a')
+    # Appended under a lock file, so that runs in parallel processes can share the summary file (see AppendFile)
     # Indicate fitness function logic in the summary file
-    summary_file.write(
+    append_to_file(os.path.join(summary_file_path, summary_filename),
         'Test Number,Population Size,%Retain,%Random,%Mutate,Degrage,Restart,Computation Time,Number of Generations,'
         'Population Ave Score,Best Individual Score,Number of Unique Individuals, Best: T_rxn,'
-        'Best: V_des, Best: a_des, Best: d_des, Best: d_lead, Best: g_min')
-    summary_file.write('\n')
-    summary_file.close()
+        'Best: V_des, Best: a_des, Best: d_des, Best: d_lead, Best: g_min\n')
 
     # Generate vehicle data
     # ----------------------------------------------------------------------------------------
     timestamp = int(time.time())  # Unique identifier for logging test
     vehicle_data = import_cf_data(input_source=input_source, input_filename=input_filename, input_path=input_path,
-            log_path=log_path, timestamp=timestamp, stac_filename=stac_filename, stac_path=stac_path)
+            log_path=log_path, timestamp=timestamp, stac_filename=stac_filename, stac_path=stac_path,
+            cache_path=cache_path, columns=CF_PIPELINE_COLUMNS)
 
     # Perform the desired test runs:
     no_tests = len(pop_size) * len(degrade) * len(random_mutate) * len(p_retain) * len(restart) * no_runs
@@ -643,8 +648,8 @@ def main():
                                 best_individual_score = get_individual_score(individual=best_individual,
                                                                              vehicle_data=vehicle_data)
                                 # Record information to the summary file
-                                summary_file = open(os.path.join(log_path, summary_filename), 'a')
-                                summary_file.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},'
+                                append_to_file(os.path.join(log_path, summary_filename),
+                                               '{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},\n'
                                                    .format(test_number, pop_size_this, p_retain_this,
                                                                   random_select_this,
                                                                   random_mutate_this, degrade_this, restart_this,
@@ -654,8 +659,6 @@ def main():
                                                                   best_individual[0], best_individual[1],
                                                                   best_individual[2], best_individual[3],
                                                                   best_individual[4], best_individual[5]))
-                                summary_file.write('\n')
-                                summary_file.close()
                                 log_file.close()
 
                                 test_number += 1
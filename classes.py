@@ -1,10 +1,15 @@
 from statsmodels import robust
 import os
+import errno
+import json
+import time
 import numpy as np
 import warnings
 import scipy.stats as sps
+from scipy.signal import lfilter
 import matplotlib.pyplot as plt
-from copy import deepcopy
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 """
 /*******************************************************************
@@ -19,6 +24,712 @@ E-mail: bhammit1@gmail.com
 ********************************************************************/
 """
 
+# NDS Time Series Column Names - in file order, mirroring the indices used in DataPoint.__init__
+NDS_COLUMN_NAMES = ['system_time_stamp', 'vtti_time_stamp', 'vtti_file_id', 'vtti_speed_network', 'vtti_speed_gps',
+                    'vtti_accel_x', 'vtti_accel_y', 'vtti_pedal_brake_state', 'vtti_pedal_gas_position', 'vtti_abs',
+                    'vtti_traction_control_state', 'vtti_esc', 'vtti_lane_distance_off_center',
+                    'vtti_left_line_right_distance', 'vtti_right_line_left_distance', 'vtti_left_marker_probability',
+                    'vtti_right_marker_probability', 'vtti_light_level', 'vtti_gyro_z', 'vtti_wiper', 'vtti_latitude',
+                    'vtti_longitude', 'vtti_steering_angle', 'vtti_steering_wheel_position', 'vtti_turn_signal',
+                    'vtti_head_confidence', 'vtti_head_position_x', 'vtti_head_position_x_baseline',
+                    'vtti_head_position_y', 'vtti_head_position_y_baseline', 'vtti_head_position_z',
+                    'vtti_head_position_z_baseline', 'vtti_head_rotation_x', 'vtti_head_rotation_x_baseline',
+                    'vtti_head_rotation_y', 'vtti_head_rotation_y_baseline', 'vtti_head_rotation_z',
+                    'vtti_head_rotation_z_baseline', 'computed_time_bin', 'computed_day_of_month', 'vtti_month_gps',
+                    'vtti_year_gps', 'vtti_eye_glance_location', 'vtti_alcohol_interior', 'vtti_airbag_driver',
+                    'vtti_engine_rpm_instant', 'vtti_odometer', 'vtti_prndl', 'vtti_seatbelt_driver',
+                    'vtti_temperature_interior', 'vtti_heading_gps', 'vtti_headlight', 'vtti_lane_width'] + \
+                   ['vtti_object_id_t{}'.format(i) for i in range(8)] + \
+                   ['vtti_range_rate_x_t{}'.format(i) for i in range(8)] + \
+                   ['vtti_range_rate_y_t{}'.format(i) for i in range(8)] + \
+                   ['vtti_range_x_t{}'.format(i) for i in range(8)] + \
+                   ['vtti_range_y_t{}'.format(i) for i in range(8)] + \
+                   ['vtti_headway_to_lead_vehicle', 'vtti_video_frame'] + \
+                   ['track{}_target_travel_direction'.format(i) for i in range(1,9)] + \
+                   ['track{}_x_acc_estimated'.format(i) for i in range(1,9)] + \
+                   ['track{}_headway'.format(i) for i in range(1,9)] + \
+                   ['track{}_lane'.format(i) for i in range(1,9)] + \
+                   ['track{}_is_lead_vehicle'.format(i) for i in range(1,9)] + \
+                   ['track{}_x_pos_processed'.format(i) for i in range(1,9)] + \
+                   ['track{}_y_pos_processed'.format(i) for i in range(1,9)] + \
+                   ['track{}_target_id'.format(i) for i in range(1,9)]
+NDS_COLUMN_INDEX = dict((name, i) for i, name in enumerate(NDS_COLUMN_NAMES))
+
+# Columns added from the corresponding STAC data (not part of the NDS file)
+STAC_COLUMN_NAMES = ['track{}_x_vel_processed'.format(i) for i in range(1,9)]
+
+# NDS columns used by the car following pipeline (the variables assigned in DataPoint.__init__)
+CF_PIPELINE_COLUMNS = ['vtti_time_stamp', 'vtti_speed_network', 'vtti_accel_x', 'vtti_wiper'] + \
+                      ['track{}_x_acc_estimated'.format(i) for i in range(1,9)] + \
+                      ['track{}_headway'.format(i) for i in range(1,9)] + \
+                      ['track{}_is_lead_vehicle'.format(i) for i in range(1,9)] + \
+                      ['track{}_x_pos_processed'.format(i) for i in range(1,9)] + \
+                      ['track{}_target_id'.format(i) for i in range(1,9)]
+
+
+def nds_file_columns(columns):
+    """
+    Resolves a column projection to the NDS file columns to be read
+    :param columns: List of column names (see NDS_COLUMN_NAMES), NDS file column indices, or variable preference
+    entries [name, index, values] as returned by functions.import_variable_preferences
+    :return: Sorted list of unique NDS file column indices
+    """
+    file_columns = list()
+    for column in columns:
+        if isinstance(column,(list,tuple)) is True:  # Variable preference entry
+            column = column[1]
+        if isinstance(column,str) is True:
+            if column in STAC_COLUMN_NAMES:  # Always part of the collection
+                continue
+            if column not in NDS_COLUMN_INDEX:
+                raise ValueError('Unknown NDS column: {}'.format(column))
+            column = NDS_COLUMN_INDEX[column]
+        if int(column) not in file_columns:
+            file_columns.append(int(column))
+    return sorted(file_columns)
+
+
+def nds_column_index(file_columns):
+    """
+    Column map for a columnar NDS matrix: the NDS file columns read followed by the STAC derived columns.
+    :param file_columns: NDS file column index of each matrix column (in order)
+    :return: Dictionary of column name or NDS file column index: column index within the matrix
+    """
+    column_index = dict()
+    for i in range(len(file_columns)):
+        column_index[file_columns[i]] = i
+        if file_columns[i] < len(NDS_COLUMN_NAMES):
+            column_index[NDS_COLUMN_NAMES[file_columns[i]]] = i
+    for i in range(len(STAC_COLUMN_NAMES)):
+        column_index[STAC_COLUMN_NAMES[i]] = len(file_columns) + i
+    return column_index
+
+
+# Statistics written by PointCollection.summary_statistics - in output order
+STATISTICS_NAMES = ['Mean','Max','Min','Median','Percentile85','Stdev','Variance','Coeff of Variation']
+
+
+def column_statistics(matrix):
+    """
+    Column-wise summary statistics, each computed for all columns in one call
+    :param matrix: 2D array [values x variables]
+    :return: List of arrays in STATISTICS_NAMES order, one value per column - 'nan' values are ignored except by the
+    coefficient of variation
+    """
+    matrix = np.asfortranarray(matrix)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # Warnings regarding all "nan" values ignored
+        return [np.nanmean(matrix,axis=0), np.nanmax(matrix,axis=0), np.nanmin(matrix,axis=0),
+                np.nanmedian(matrix,axis=0), np.nanpercentile(matrix,85,axis=0), np.nanstd(matrix,axis=0),
+                np.nanvar(matrix,axis=0), sps.variation(matrix,axis=0)]
+
+
+def write_statistics_table(variable_names,statistics,save_path,output_file):
+    """
+    Writes a summary statistics table - one row per statistic, one column per variable
+    :param variable_names: Variable names - column headers
+    :param statistics: List of arrays in STATISTICS_NAMES order (see column_statistics)
+    :param save_path: Output folder
+    :param output_file: Output file name
+    :return: None
+    """
+    lines = ["File: {}".format(output_file)]
+    lines.append("Variables,"+",".join(["{}".format(name) for name in variable_names]))
+    for i in range(len(STATISTICS_NAMES)):
+        lines.append(STATISTICS_NAMES[i]+","+",".join(["{}".format(value) for value in statistics[i]]))
+    target = open(os.path.join(save_path, output_file),'w')  # Output file
+    target.write("\n".join(lines)+"\n")
+    target.close()
+
+
+class FileLock:
+    """ Lock File Shared by Processes - Owned Through a Token, Stale Locks Broken by Atomic Rename """
+
+    def __init__(self,lock_path,stale_time=60):
+        """
+        :param lock_path: Lock file - exists while the lock is held and holds the owner token (process id and nonce)
+        :param stale_time: Age [s] of a lock file after which its owner is assumed dead and the lock is broken
+        """
+        self.lock_path = lock_path
+        self.stale_time = stale_time
+        self.token = None
+
+    def _read_token(self,path):
+        file = open(path,'r')
+        try:
+            return file.read()
+        finally:
+            file.close()
+
+    def acquire(self):
+        # Creates the lock file - waits while another process holds it
+        token = '{} {}'.format(os.getpid(),os.urandom(8).encode('hex'))
+        while True:
+            try:
+                descriptor = os.open(self.lock_path,os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(descriptor,token)
+                os.close(descriptor)
+                self.token = token
+                return
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+            try:
+                owner = self._read_token(self.lock_path)
+                if time.time() - os.path.getmtime(self.lock_path) > self.stale_time:
+                    self._break(owner,token)
+                    continue
+            except (IOError,OSError):  # Released in the meantime
+                continue
+            time.sleep(0.01)
+
+    def _break(self,owner,token):
+        """
+        Breaks a stale lock - the lock file is moved aside by an atomic rename, so only one waiter captures it. If the
+        captured file is not the stale lock (taken over by another waiter in the meantime) it is put back, unless a
+        lock file was created since: it is linked back (POSIX) or renamed back (Windows), neither of which replaces an
+        existing lock file.
+        :param owner: Token of the lock file found to be stale
+        :param token: Token of this waiter - names the captured file
+        """
+        captured_path = '{}.{}.stale'.format(self.lock_path,token.replace(' ','.'))
+        os.rename(self.lock_path,captured_path)  # OSError if another waiter captured it first
+        try:
+            if self._read_token(captured_path) != owner:
+                if hasattr(os,'link'):
+                    os.link(captured_path,self.lock_path)
+                else:
+                    os.rename(captured_path,self.lock_path)
+        except OSError:  # Lock file created in the meantime - it is kept
+            pass
+        finally:
+            if os.path.isfile(captured_path):
+                os.remove(captured_path)
+
+    def release(self):
+        # Removes the lock file only if it is still owned (not broken as stale and taken by another process)
+        try:
+            if self._read_token(self.lock_path) == self.token:
+                os.remove(self.lock_path)
+        except (IOError,OSError):
+            pass
+        self.token = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self,exception_type,exception,traceback):
+        self.release()
+
+
+class AppendFile:
+    """ Buffered Appender of a File Shared by Processes - Blocks Written One Writer at a Time (Lock File) """
+
+    def __init__(self,file_path,header=None,block_size=2**20,stale_time=60):
+        """
+        Text is collected and appended in blocks of block_size characters; each block is written in one call while
+        holding the lock file (file_path + '.lock', see FileLock), so blocks of concurrent writers never interleave.
+        :param file_path: Appended file
+        :param header: (optional) Text written first if the file does not exist or is empty (checked under the lock)
+        :param block_size: Buffered characters before a block is written
+        :param stale_time: see FileLock
+        """
+        self.file_path = file_path
+        self.header = header
+        self.block_size = block_size
+        self.lock = FileLock(file_path + '.lock',stale_time)
+        self.buffer = list()
+        self.buffer_size = 0
+
+    def write(self,text):
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+        if self.buffer_size >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        # Writes the buffered text as one block
+        if self.buffer_size == 0:
+            return
+        with self.lock:
+            text = ''.join(self.buffer)
+            if self.header is not None and (os.path.isfile(self.file_path) == False or
+                                            os.path.getsize(self.file_path) == 0):
+                text = self.header + text
+            target = open(self.file_path,'a')
+            target.write(text)
+            target.close()
+        self.buffer = list()
+        self.buffer_size = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exception_type,exception,traceback):
+        self.close()
+
+
+def append_to_file(file_path,text,header=None):
+    # Appends text in one block under the file's lock (see AppendFile)
+    target = AppendFile(file_path,header)
+    target.write(text)
+    target.close()
+
+
+def mad_outliers(values,window,mad_count=5,rolling=False,chunk_size=2**20):
+    """
+    Windowed median absolute deviation (MAD) outlier detection - a value is an outlier if its absolute deviation from
+    the window median is at least mad_count times the window MAD (robust.mad - scaled to the standard deviation).
+    Windows holding 'nan' values flag no outliers.
+    :param values: 1D array
+    :param window: Window length [points]
+    :param mad_count: Number of MADs from the window median to be an outlier
+    :param rolling: False - consecutive non-overlapping windows (the last window holds the remaining values);
+    True - a window of the given length centered on each value (shifted inside the series at both ends)
+    :param chunk_size: Maximum number of window values held in memory at once (rolling windows)
+    :return: Boolean array - True for outliers
+    """
+    values = np.asarray(values,dtype=float)
+    outliers = np.zeros(len(values),dtype=bool)
+    window = max(1,min(int(window),len(values)))
+    if len(values) == 0:
+        return outliers
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # Warnings regarding "nan" values ignored
+        with np.errstate(invalid='ignore'):
+            if rolling is False:
+                full_count = len(values)//window*window
+                for start, stop in [(0,full_count),(full_count,len(values))]:
+                    if stop > start:
+                        windows = values[start:stop].reshape(-1,min(window,stop-start))
+                        medians = np.median(windows,axis=1)[:,np.newaxis]
+                        mads = robust.mad(windows,axis=1,center=medians)[:,np.newaxis]
+                        outliers[start:stop] = (np.abs(windows-medians) >= mad_count*mads).ravel()
+            else:
+                # Median and MAD of every full window - in chunks, as the windows overlap
+                window_count = len(values)-window+1
+                medians = np.empty(window_count)
+                mads = np.empty(window_count)
+                step = max(1,chunk_size//window)
+                for start in range(0,window_count,step):
+                    count = min(step,window_count-start)
+                    windows = np.lib.stride_tricks.as_strided(values[start:],shape=(count,window),
+                                                              strides=(values.strides[0],values.strides[0]))
+                    medians[start:start+count] = np.median(windows,axis=1)
+                    mads[start:start+count] = robust.mad(windows,axis=1,center=medians[start:start+count,np.newaxis])
+                centered = np.clip(np.arange(len(values))-window//2,0,window_count-1)  # window of each value
+                outliers = np.abs(values-medians[centered]) >= mad_count*mads[centered]
+    return outliers
+
+
+def moving_average(values,window,mode='centered'):
+    """
+    Moving average from cumulative sums - O(n) for any window length. 'nan' values are skipped (the average is over
+    the other values of the window); windows without values, or with infinite values of both signs, repeat the
+    previous average.
+    :param values: 1D array
+    :param window: Window length [points]
+    :param mode: 'centered' - window of values[i-window//2+1 : i+window-window//2+1] ('nan' for the first window//2
+    values and where the window passes the end of the series); 'trailing' - window of values[i-window+1 : i+1] ('nan'
+    for the first window-1 values); 'edge' - centered window shortened at both ends of the series (no 'nan' padding)
+    :return: Array of the moving average - aligned with values
+    """
+    values = np.asarray(values,dtype=float)
+    window = max(1,int(window))
+    half = window//2
+    position = np.arange(len(values))
+    if mode == 'centered' or mode == 'edge':
+        low = position-half+1
+        high = position+window-half+1
+    elif mode == 'trailing':
+        low = position-window+1
+        high = position+1
+    else:
+        raise ValueError('Moving average mode must be centered, trailing or edge')
+    if mode == 'centered':
+        valid = (position >= half) & (high <= len(values))
+    else:
+        valid = (low >= 0) | (mode == 'edge')
+    low = np.clip(low,0,len(values))
+    high = np.clip(high,0,len(values))
+
+    # Prefix sums - finite values relative to their mean (limits round-off), non 'nan' and infinite value counts
+    finite = np.isfinite(values)
+    center = values[finite].mean() if finite.any() else 0.0
+    def window_sums(counted):
+        prefix = np.concatenate(([0],np.cumsum(counted)))
+        return prefix[high]-prefix[low]
+    finite_sum = window_sums(np.where(finite,values-center,0))
+    count = window_sums(np.isnan(values) == False)
+    positive_count = window_sums(values == np.inf)
+    negative_count = window_sums(values == -np.inf)
+
+    with np.errstate(invalid='ignore',divide='ignore'):
+        average = finite_sum/count+center
+    average[positive_count > 0] = np.inf
+    average[negative_count > 0] = -np.inf
+    average[(positive_count > 0) & (negative_count > 0)] = np.nan
+    average[valid == False] = np.nan
+
+    # Windows without an average repeat the previous one
+    missing = valid & np.isnan(average)
+    if missing.any():
+        average = average[np.maximum.accumulate(np.where(missing,0,position))]
+    return average
+
+
+def kalman_steady_state_gain(process_variance,measurement_variance):
+    """
+    :param process_variance: Process variance of the scalar (random walk) Kalman filter
+    :param measurement_variance: Measurement variance
+    :return: Steady-state gain - closed form of the fixed point of the gain recursion
+    """
+    priori_error_estimate = (process_variance+np.sqrt(process_variance**2+4*process_variance*measurement_variance))/2.
+    return priori_error_estimate/(priori_error_estimate+measurement_variance)
+
+
+def kalman_gains(length,process_variance,measurement_variance,initial_error_estimate=1.0):
+    """
+    Gains of the scalar Kalman filter - they do not depend on the measurements, so they are shared by every series
+    :param length: Maximum number of steps
+    :param process_variance: see kalman_steady_state_gain
+    :param measurement_variance: see kalman_steady_state_gain
+    :param initial_error_estimate: Initial (posteriori) error estimate
+    :return: [gains of the first steps - until the steady-state gain is reached (at most length), steady-state gain]
+    """
+    steady_state_gain = kalman_steady_state_gain(process_variance,measurement_variance)
+    gains = list()
+    posteri_error_estimate = initial_error_estimate
+    while len(gains) < length:
+        priori_error_estimate = posteri_error_estimate + process_variance
+        blending_factor = priori_error_estimate / (priori_error_estimate + measurement_variance)
+        if abs(blending_factor-steady_state_gain) <= 4*np.finfo(float).eps*steady_state_gain:
+            break
+        gains.append(blending_factor)
+        posteri_error_estimate = (1 - blending_factor) * priori_error_estimate
+    return [np.array(gains),steady_state_gain]
+
+
+def kalman_smooth(values,offsets,process_variance=.0001,measurement_variance=.01,initial_estimate=0.0,
+                  initial_error_estimate=1.0):
+    """
+    Scalar Kalman filter run on a batch of series at once - the first steps (until the gain reaches its steady state)
+    are taken for all series together, the remaining steps of all series are one linear filter pass with the
+    steady-state gain. 'nan' and infinite measurements propagate as in the step by step recursion.
+    :param values: Flat array of the measurements of all series (not modified)
+    :param offsets: Start of each series in values, followed by len(values) - series i is values[offsets[i]:offsets[i+1]]
+    :param process_variance: see kalman_steady_state_gain
+    :param measurement_variance: see kalman_steady_state_gain
+    :param initial_estimate: Initial (posteriori) estimate of each series
+    :param initial_error_estimate: Initial (posteriori) error estimate of each series
+    :return: Array of the (posteriori) estimates - aligned with values
+    """
+    values = np.asarray(values,dtype=float)
+    offsets = np.asarray(offsets,dtype=int)
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    estimates = np.empty(len(values))
+    if len(values) == 0:
+        return estimates
+    gains, steady_state_gain = kalman_gains(lengths.max(),process_variance,measurement_variance,initial_error_estimate)
+
+    # Transient steps - one array operation per step across the series
+    posteri_estimate = np.empty(len(starts))
+    posteri_estimate[:] = initial_estimate
+    for step in range(len(gains)):
+        series = np.flatnonzero(lengths > step)
+        rows = starts[series]+step
+        posteri_estimate[series] += gains[step]*(values[rows]-posteri_estimate[series])
+        estimates[rows] = posteri_estimate[series]
+
+    # Steady state - x[t] = (1-K)*x[t-1] + K*z[t] for the remaining steps of all series in one pass; the state carried
+    # over from the previous series is replaced by the series' own state
+    series_of_rows = np.repeat(np.arange(len(starts)),lengths)
+    steady_rows = np.flatnonzero(np.arange(len(values))-starts[series_of_rows] >= len(gains))
+    if len(steady_rows) == 0:
+        return estimates
+    series = series_of_rows[steady_rows]
+    measurements = values[steady_rows]
+    decay = 1-steady_state_gain
+    with np.errstate(invalid='ignore',over='ignore'):
+        filtered = lfilter([steady_state_gain],[1,-decay],np.where(np.isfinite(measurements),measurements,0))
+        segment_first = np.concatenate(([True],series[1:] != series[:-1]))
+        segment = np.cumsum(segment_first)-1
+        segment_start = np.flatnonzero(segment_first)
+        carried = np.concatenate(([0],filtered[segment_start[1:]-1]))
+        step = np.arange(len(steady_rows))-segment_start[segment]+1
+        initial_state = posteri_estimate[series]
+        result = filtered + decay**step*(np.where(np.isfinite(initial_state),initial_state,0)-carried[segment])
+
+        # Non-finite values - the first non-finite measurement is the estimate, 'nan' from then on
+        invalid = np.isfinite(measurements) == False
+        invalid_count = np.cumsum(invalid)
+        invalid_before = invalid_count-invalid-(invalid_count-invalid)[segment_start][segment]
+        result[invalid] = measurements[invalid]
+        result[(invalid_before > 0) | (np.isfinite(initial_state) == False)] = np.nan
+    estimates[steady_rows] = result
+    return estimates
+
+
+class StreamingStatistics:
+    """ Column-wise Statistics Updated Chunk by Chunk - Mergeable Across Trips and Processes """
+
+    def __init__(self,variable_count,sketch_size=2000):
+        """
+        :param variable_count: Number of variables (columns of the chunks)
+        :param sketch_size: Number of centroids kept per variable by the quantile sketch - median and percentiles are
+        exact until a variable has more than twice this many values, approximate afterwards
+        """
+        self.variable_count = variable_count
+        self.sketch_size = sketch_size
+        self.count = np.zeros(variable_count,dtype=np.int64)  # values other than 'nan'
+        self.nan_count = np.zeros(variable_count,dtype=np.int64)
+        self.mean = np.zeros(variable_count)
+        self.m2 = np.zeros(variable_count)  # sum of squared deviations from the mean (Welford)
+        self.maximum = np.full(variable_count,np.nan)
+        self.minimum = np.full(variable_count,np.nan)
+        # Quantile sketch - sorted centroid values and weights (number of values represented) per variable
+        self.sketch_values = [np.empty(0) for j in range(variable_count)]
+        self.sketch_weights = [np.empty(0) for j in range(variable_count)]
+
+    def _combine(self,count,mean,m2):
+        # Pairwise combination of count/mean/m2 (Chan et al.) - columns without values keep the current moments
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore',divide='ignore'):
+            share = np.where(total > 0,count/total.astype(float),0)
+        self.mean = np.where(count > 0,self.mean + delta*share,self.mean)
+        self.m2 = np.where(count > 0,self.m2 + m2 + delta*delta*self.count*share,self.m2)
+        self.count = total
+
+    def _compress(self,j):
+        # Merges the centroids of variable j into sketch_size groups of equal weight
+        values = self.sketch_values[j]
+        weights = self.sketch_weights[j]
+        order = np.argsort(values,kind='mergesort')
+        values = values[order]
+        weights = weights[order]
+        if len(values) > 2*self.sketch_size:
+            total = weights.sum()
+            groups = np.minimum(((np.cumsum(weights) - weights/2)*self.sketch_size/total).astype(int),
+                                self.sketch_size - 1)
+            weight_sums = np.bincount(groups,weights,self.sketch_size)
+            value_sums = np.bincount(groups,weights*values,self.sketch_size)
+            kept = weight_sums > 0
+            weights = weight_sums[kept]
+            values = value_sums[kept]/weights
+        self.sketch_values[j] = values
+        self.sketch_weights[j] = weights
+
+    def update(self,values):
+        """
+        Adds a chunk of values
+        :param values: 2D array [values x variables] - 'nan' values are counted, but otherwise ignored
+        :return: None
+        """
+        values = np.asarray(values,dtype=float).reshape(-1,self.variable_count)
+        if len(values) == 0:
+            return
+        available = np.isnan(values) == False
+        count = np.count_nonzero(available,axis=0)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean = np.where(available,values,0).sum(axis=0)/count
+            m2 = np.where(available,(values-mean)**2,0).sum(axis=0)
+        self._combine(count,mean,m2)
+        self.nan_count += len(values) - count
+        self.maximum = np.fmax(self.maximum,np.fmax.reduce(values,axis=0))
+        self.minimum = np.fmin(self.minimum,np.fmin.reduce(values,axis=0))
+        for j in range(self.variable_count):
+            if count[j] > 0:
+                self.sketch_values[j] = np.concatenate((self.sketch_values[j],values[available[:,j],j]))
+                self.sketch_weights[j] = np.concatenate((self.sketch_weights[j],np.ones(count[j])))
+                self._compress(j)
+
+    def merge(self,other):
+        """
+        Adds the values summarized by another StreamingStatistics (e.g. of another trip or worker process)
+        :param other: StreamingStatistics with the same variables
+        :return: None
+        """
+        if other.variable_count != self.variable_count:
+            raise ValueError('Statistics of {} and {} variables cannot be merged'.format(self.variable_count,
+                                                                                        other.variable_count))
+        self._combine(other.count,other.mean,other.m2)
+        self.nan_count += other.nan_count
+        self.maximum = np.fmax(self.maximum,other.maximum)
+        self.minimum = np.fmin(self.minimum,other.minimum)
+        for j in range(self.variable_count):
+            self.sketch_values[j] = np.concatenate((self.sketch_values[j],other.sketch_values[j]))
+            self.sketch_weights[j] = np.concatenate((self.sketch_weights[j],other.sketch_weights[j]))
+            self._compress(j)
+
+    def percentile(self,q):
+        """
+        :param q: Percentile (0-100)
+        :return: Array - percentile of each variable, linearly interpolated between ranks as np.nanpercentile
+        """
+        result = np.full(self.variable_count,np.nan)
+        for j in range(self.variable_count):
+            if self.count[j] > 0:
+                weights = self.sketch_weights[j]
+                # rank of each centroid - the center of the values it represents
+                ranks = np.cumsum(weights) - (weights+1)/2.
+                result[j] = np.interp(q/100.*(self.count[j]-1),ranks,self.sketch_values[j])
+        return result
+
+    def statistics(self):
+        """
+        :return: List of arrays in STATISTICS_NAMES order, as column_statistics for all values added
+        """
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean = np.where(self.count > 0,self.mean,np.nan)
+            variance = self.m2/self.count
+            stdev = np.sqrt(variance)
+            coeff_of_var = np.where(self.nan_count == 0,stdev/mean,np.nan)
+        return [mean, self.maximum.copy(), self.minimum.copy(), self.percentile(50), self.percentile(85), stdev,
+                variance, coeff_of_var]
+
+
+class SummaryAccumulator:
+    """ Collection Summary Values Updated Collection by Collection - Mergeable Across Trips and Processes """
+
+    def __init__(self,variables=None,sketch_size=2000):
+        """
+        :param variables: (optional) Column names or NDS file column indices (see PointCollection.column) summarized
+        by statistics
+        :param sketch_size: see StreamingStatistics
+        """
+        if variables is None:
+            variables = list()
+        self.variables = list(variables)
+        self.point_count = 0
+        self.wiper_count = 0  # points with the wipers active
+        self.car_following_count = 0  # points with a lead vehicle
+        self.speed_acceleration = StreamingStatistics(2,sketch_size)  # vtti_speed_network, vtti_accel_x
+        self.variable_statistics = StreamingStatistics(len(self.variables),sketch_size)
+
+    def update(self,collection):
+        """
+        Adds the points of a collection - a trip, or any part of it
+        :param collection: PointCollection
+        :return: None
+        """
+        self.point_count += collection.point_count()
+        self.wiper_count += np.count_nonzero(np.in1d(collection.column('vtti_wiper'),[1,2,3]))
+        self.car_following_count += np.count_nonzero(collection.lead_track_index() >= 0)
+        self.speed_acceleration.update(collection.column_matrix(['vtti_speed_network','vtti_accel_x']))
+        if len(self.variables) > 0:
+            self.variable_statistics.update(collection.column_matrix(self.variables))
+
+    def merge(self,other):
+        """
+        :param other: SummaryAccumulator with the same variables
+        :return: None
+        """
+        self.point_count += other.point_count
+        self.wiper_count += other.wiper_count
+        self.car_following_count += other.car_following_count
+        self.speed_acceleration.merge(other.speed_acceleration)
+        self.variable_statistics.merge(other.variable_statistics)
+
+    # Mean Speed, Max Deceleration, Percent Wipers and Percent Car Following - as the PointCollection methods ('nan'
+    # without points, e.g. a trip without STAC rows)
+    def mean_speed(self):
+        if self.speed_acceleration.count[0] == 0:
+            return np.nan
+        return round(self.speed_acceleration.mean[0],3)
+
+    def max_deceleration(self):
+        return round(self.speed_acceleration.minimum[1],3)
+
+    def percent_wipers_active(self):
+        if self.point_count == 0:
+            return np.nan
+        return round(float(self.wiper_count)/self.point_count,3)
+
+    def percent_car_following(self):
+        if self.point_count == 0:
+            return np.nan
+        return round(float(self.car_following_count)/self.point_count,3)
+
+    def summary_statistics(self,variable_names,save_path,output_file):
+        """
+        Writes the statistics of the variables as PointCollection.summary_statistics
+        :param variable_names: Variable names - column headers
+        :param save_path: Output folder
+        :param output_file: Output file name
+        :return: None
+        """
+        write_statistics_table(variable_names,self.variable_statistics.statistics(),save_path,output_file)
+        print "Success - Statistics Generated"
+
+
+def plot_spec(title,layers,xlabel,ylabel,figsize=(16,12),xlim=None,legend=False):
+    """
+    Lightweight figure specification - values and labels only, so that figures can be rendered later or in other
+    processes (see render_plot, save_plot)
+    :param title: Figure title
+    :param layers: List of [kind ('scatter' or 'plot'), x values, y values, color (None: default), label (None: none)]
+    :param xlabel: x axis label
+    :param ylabel: y axis label
+    :param figsize: Figure size [in]
+    :param xlim: (optional) x axis limits
+    :param legend: True to show the legend
+    :return: Dictionary of the figure specification
+    """
+    return {'title': title,'figsize': figsize,'xlabel': xlabel,'ylabel': ylabel,'xlim': xlim,'legend': legend,
+            'layers': [[kind,np.asarray(x),np.asarray(y),color,label] for kind, x, y, color, label in layers]}
+
+
+def draw_plot(figure,spec):
+    # Draws a figure specification (see plot_spec) on an empty figure
+    figure.suptitle(spec['title'],fontsize=18, fontweight='bold')
+    axes = figure.add_subplot(111)
+    for kind, x, y, color, label in spec['layers']:
+        options = dict()
+        if color is not None:
+            options['c'] = color
+        if label is not None:
+            options['label'] = label
+        if kind == 'scatter':
+            axes.scatter(x,y,**options)
+        else:
+            axes.plot(x,y,**options)
+    axes.set_xlabel(spec['xlabel'])
+    axes.set_ylabel(spec['ylabel'])
+    if spec['xlim'] is not None:
+        axes.set_xlim(spec['xlim'])
+    if spec['legend'] is True:
+        axes.legend()
+
+
+def render_plot(spec,file_path=None):
+    """
+    :param spec: Figure specification (see plot_spec)
+    :param file_path: (optional) Saved figure file
+    :return: pyplot figure (closed)
+    """
+    fig = plt.figure(figsize=spec['figsize'])  # Size of figure
+    draw_plot(fig,spec)
+    plt.close()
+    if file_path is not None:
+        fig.savefig(file_path)
+    return fig
+
+
+def save_plot(spec,file_path):
+    # Saves a figure specification without pyplot (Agg canvas) - independent of the interactive backend, e.g. in
+    # worker processes (see functions.render_figures)
+    fig = Figure(figsize=spec['figsize'])
+    FigureCanvasAgg(fig)
+    draw_plot(fig,spec)
+    fig.savefig(file_path)
+
+
 class DataPoint:
     """ Data from Single Timestamp """  # Returned when __doc__() is called
 
@@ -225,30 +936,25 @@ class DataPoint:
     def __getitem__(self,index):
         return self.data[index]
 
+    # Detect Lead Vehicle Track
+    def lead_track(self):
+        """
+        Single pass over the 8 radar tracks used by all of the lead target methods
+        :return: Returns the track number (1-8) of the first track holding a lead vehicle; None if no lead vehicle
+        """
+        for track in range(1,9):
+            if np.isnan(getattr(self,'track{}_target_id'.format(track))) == False and \
+                    getattr(self,'track{}_is_lead_vehicle'.format(track)) == 1:
+                return track
+        return None
+
     # Detect Car Following
     def is_car_following(self):
         """
         Method used to determine if a vehicle is in "car-following" by detecting if a lead vehicle exists in any track
         :return: Returns True if vehicle is in car-following and False if vehicle is not in
         """
-        if str(float(self.track1_target_id)) != 'nan' and self.track1_is_lead_vehicle == 1:
-            return True
-        elif str(float(self.track2_target_id)) != 'nan' and self.track2_is_lead_vehicle == 1:
-            return True
-        elif str(float(self.track3_target_id)) != 'nan' and self.track3_is_lead_vehicle == 1:
-            return True
-        elif str(float(self.track4_target_id)) != 'nan' and self.track4_is_lead_vehicle == 1:
-            return True
-        elif str(float(self.track5_target_id)) != 'nan' and self.track5_is_lead_vehicle == 1:
-            return True
-        elif str(float(self.track6_target_id)) != 'nan' and self.track6_is_lead_vehicle == 1:
-            return True
-        elif str(float(self.track7_target_id)) != 'nan' and self.track7_is_lead_vehicle == 1:
-            return True
-        elif str(float(self.track8_target_id)) != 'nan' and self.track8_is_lead_vehicle == 1:
-            return True
-        else:
-            return False
+        return self.lead_track() is not None
 
     # Detect Current Targets
     def current_targets(self):
@@ -256,173 +962,64 @@ class DataPoint:
         :return: Returns the list of all targets detected; if no targets detected, empty list is returned
         """
         targets = list()
-        if np.isnan(self.track1_target_id) != True:
-            targets.append(int(self.track1_target_id))
-        if np.isnan(self.track2_target_id) != True:
-            targets.append(int(self.track2_target_id))
-        if np.isnan(self.track3_target_id) != True:
-            targets.append(int(self.track3_target_id))
-        if np.isnan(self.track4_target_id) != True:
-            targets.append(int(self.track4_target_id))
-        if np.isnan(self.track5_target_id) != True:
-            targets.append(int(self.track5_target_id))
-        if np.isnan(self.track6_target_id) != True:
-            targets.append(int(self.track6_target_id))
-        if np.isnan(self.track7_target_id) != True:
-            targets.append(int(self.track7_target_id))
-        if np.isnan(self.track8_target_id) != True:
-            targets.append(int(self.track8_target_id))
+        for track in range(1,9):
+            target_id = getattr(self,'track{}_target_id'.format(track))
+            if np.isnan(target_id) != True:
+                targets.append(int(target_id))
         return targets
 
     # Detect Current Lead Vehicle Target Value
     def lead_target_id(self):
         """
-        :return: Returns the lead vehicle target id; if no lead vehicle - returns "False"
-        """
-        if self.is_car_following() is True:
-            if np.isnan(self.track1_target_id) is not True and self.track1_is_lead_vehicle == 1:
-                return int(self.track1_target_id)
-            elif np.isnan(self.track2_target_id) is not True and self.track2_is_lead_vehicle == 1:
-                return int(self.track2_target_id)
-            elif np.isnan(self.track3_target_id) is not True and self.track3_is_lead_vehicle == 1:
-                return int(self.track3_target_id)
-            elif np.isnan(self.track4_target_id) is not True and self.track4_is_lead_vehicle == 1:
-                return int(self.track4_target_id)
-            elif np.isnan(self.track5_target_id) is not True and self.track5_is_lead_vehicle == 1:
-                return int(self.track5_target_id)
-            elif np.isnan(self.track6_target_id) is not True and self.track6_is_lead_vehicle == 1:
-                return int(self.track6_target_id)
-            elif np.isnan(self.track7_target_id) is not True and self.track7_is_lead_vehicle == 1:
-                return int(self.track7_target_id)
-            elif np.isnan(self.track8_target_id) is not True and self.track8_is_lead_vehicle == 1:
-                return int(self.track8_target_id)
-            else:
-                return np.inf
+        :return: Returns the lead vehicle target id; if no lead vehicle - returns None
+        """
+        track = self.lead_track()
+        if track is not None:
+            return int(getattr(self,'track{}_target_id'.format(track)))
 
     # Detect Current Lead Vehicle Target Track
     def lead_target_track(self):
         """
-        :return: Returns the lead vehicle target track; if no lead vehicle - returns "False"
-        """
-        if self.is_car_following() is True:
-            if str(float(self.track1_target_id)) != 'nan' and self.track1_is_lead_vehicle == 1:
-                return 1
-            elif str(float(self.track2_target_id)) != 'nan' and self.track2_is_lead_vehicle == 1:
-                return 2
-            elif str(float(self.track3_target_id)) != 'nan' and self.track3_is_lead_vehicle == 1:
-                return 3
-            elif str(float(self.track4_target_id)) != 'nan' and self.track4_is_lead_vehicle == 1:
-                return 4
-            elif str(float(self.track5_target_id)) != 'nan' and self.track5_is_lead_vehicle == 1:
-                return 5
-            elif str(float(self.track6_target_id)) != 'nan' and self.track6_is_lead_vehicle == 1:
-                return 6
-            elif str(float(self.track7_target_id)) != 'nan' and self.track7_is_lead_vehicle == 1:
-                return 7
-            elif str(float(self.track8_target_id)) != 'nan' and self.track8_is_lead_vehicle == 1:
-                return 8
-            else:
-                return np.inf
+        :return: Returns the lead vehicle target track; if no lead vehicle - returns None
+        """
+        return self.lead_track()
 
     # Detect Distance to Current Lead Target
     def lead_target_dist(self):
         """
-        :return: Returns the lead vehicle target id; if no lead vehicle - returns "False"
-        """
-        if self.is_car_following() is True:
-            if str(float(self.track1_target_id)) != 'nan' and self.track1_is_lead_vehicle == 1:
-                return round(self.track1_x_pos_processed,3)
-            elif str(float(self.track2_target_id)) != 'nan' and self.track2_is_lead_vehicle == 1:
-                return round(self.track2_x_pos_processed,3)
-            elif str(float(self.track3_target_id)) != 'nan' and self.track3_is_lead_vehicle == 1:
-                return round(self.track3_x_pos_processed,3)
-            elif str(float(self.track4_target_id)) != 'nan' and self.track4_is_lead_vehicle == 1:
-                return round(self.track4_x_pos_processed,3)
-            elif str(float(self.track5_target_id)) != 'nan' and self.track5_is_lead_vehicle == 1:
-                return round(self.track5_x_pos_processed,3)
-            elif str(float(self.track6_target_id)) != 'nan' and self.track6_is_lead_vehicle == 1:
-                return round(self.track6_x_pos_processed,3)
-            elif str(float(self.track7_target_id)) != 'nan' and self.track7_is_lead_vehicle == 1:
-                return round(self.track7_x_pos_processed,3)
-            elif str(float(self.track8_target_id)) != 'nan' and self.track8_is_lead_vehicle == 1:
-                return round(self.track8_x_pos_processed,3)
-            else:
-                return np.inf
+        :return: Returns the distance to the lead vehicle target; if no lead vehicle - returns infinity
+        """
+        track = self.lead_track()
+        if track is not None:
+            return round(getattr(self,'track{}_x_pos_processed'.format(track)),3)
         else:
             return np.inf
 
-    # Detect Distance to Current Lead Target
+    # Detect Headway to Current Lead Target
     def lead_target_headway(self):
         """
-        :return: Returns the lead vehicle target id; if no lead vehicle - returns "False"
-        """
-        if self.is_car_following() is True:
-            if str(float(self.track1_target_id)) != 'nan' and self.track1_is_lead_vehicle == 1:
-                return round(self.track1_headway,3)
-            elif str(float(self.track2_target_id)) != 'nan' and self.track2_is_lead_vehicle == 1:
-                return round(self.track2_headway,3)
-            elif str(float(self.track3_target_id)) != 'nan' and self.track3_is_lead_vehicle == 1:
-                return round(self.track3_headway,3)
-            elif str(float(self.track4_target_id)) != 'nan' and self.track4_is_lead_vehicle == 1:
-                return round(self.track4_headway,3)
-            elif str(float(self.track5_target_id)) != 'nan' and self.track5_is_lead_vehicle == 1:
-                return round(self.track5_headway,3)
-            elif str(float(self.track6_target_id)) != 'nan' and self.track6_is_lead_vehicle == 1:
-                return round(self.track6_headway,3)
-            elif str(float(self.track7_target_id)) != 'nan' and self.track7_is_lead_vehicle == 1:
-                return round(self.track7_headway,3)
-            elif str(float(self.track8_target_id)) != 'nan' and self.track8_is_lead_vehicle == 1:
-                return round(self.track8_headway,3)
-            else:
-                return np.inf
+        :return: Returns the headway to the lead vehicle target; if no lead vehicle - returns None
+        """
+        track = self.lead_track()
+        if track is not None:
+            return round(getattr(self,'track{}_headway'.format(track)),3)
 
     def lead_target_acc(self):
         """
-        :return: Returns the lead vehicle target id; if no lead vehicle - returns "False"
-        """
-        if self.is_car_following() is True:
-            if str(float(self.track1_target_id)) != 'nan' and self.track1_is_lead_vehicle == 1:
-                return round(self.track1_x_acc_estimated,3)
-            elif str(float(self.track2_target_id)) != 'nan' and self.track2_is_lead_vehicle == 1:
-                return round(self.track2_x_acc_estimated,3)
-            elif str(float(self.track3_target_id)) != 'nan' and self.track3_is_lead_vehicle == 1:
-                return round(self.track3_x_acc_estimated,3)
-            elif str(float(self.track4_target_id)) != 'nan' and self.track4_is_lead_vehicle == 1:
-                return round(self.track4_x_acc_estimated,3)
-            elif str(float(self.track5_target_id)) != 'nan' and self.track5_is_lead_vehicle == 1:
-                return round(self.track5_x_acc_estimated,3)
-            elif str(float(self.track6_target_id)) != 'nan' and self.track6_is_lead_vehicle == 1:
-                return round(self.track6_x_acc_estimated,3)
-            elif str(float(self.track7_target_id)) != 'nan' and self.track7_is_lead_vehicle == 1:
-                return round(self.track7_x_acc_estimated,3)
-            elif str(float(self.track8_target_id)) != 'nan' and self.track8_is_lead_vehicle == 1:
-                return round(self.track8_x_acc_estimated,3)
-            else:
-                return np.inf
+        :return: Returns the estimated acceleration of the lead vehicle target; if no lead vehicle - returns None
+        """
+        track = self.lead_track()
+        if track is not None:
+            return round(getattr(self,'track{}_x_acc_estimated'.format(track)),3)
 
     def lead_relative_velocity(self):
         # Relative Velocity with respect to following vehicle
-        if self.is_car_following() is True:  #todo remove this statement
-            if str(float(self.track1_target_id)) != np.nan and self.track1_is_lead_vehicle == 1:
-                return self.track1_x_vel_processed
-            elif str(float(self.track2_target_id)) != np.nan and self.track2_is_lead_vehicle == 1:
-                return self.track2_x_vel_processed
-            elif str(float(self.track3_target_id)) != np.nan and self.track3_is_lead_vehicle == 1:
-                return self.track3_x_vel_processed
-            elif str(float(self.track4_target_id)) != np.nan and self.track4_is_lead_vehicle == 1:
-                return self.track4_x_vel_processed
-            elif str(float(self.track5_target_id)) != np.nan and self.track5_is_lead_vehicle == 1:
-                return self.track5_x_vel_processed
-            elif str(float(self.track6_target_id)) != np.nan and self.track6_is_lead_vehicle == 1:
-                return self.track6_x_vel_processed
-            elif str(float(self.track7_target_id)) != np.nan and self.track7_is_lead_vehicle == 1:
-                return self.track7_x_vel_processed
-            elif str(float(self.track8_target_id)) != np.nan and self.track8_is_lead_vehicle == 1:
-                return self.track8_x_vel_processed
-            else:
-                return np.NINF  # Negative infinity
-        else:
-             return np.NINF
+        # Read from the first track flagged as lead vehicle - unlike lead_track, even if its target id is 'nan'
+        if self.lead_track() is not None:
+            for track in range(1,9):
+                if getattr(self,'track{}_is_lead_vehicle'.format(track)) == 1:
+                    return getattr(self,'track{}_x_vel_processed'.format(track))
+        return np.NINF  # Negative infinity
 
     # Return when print(instance) is used
     def __str__(self):
@@ -435,22 +1032,37 @@ class PointCollection:
     # Instantiation
     def __init__(self,input_data = None):
         """
-        :param list_of_data_points: List of DataPoints to be provided
+        :param input_data: List of DataPoints, a single DataPoint, or a 2D array of NDS rows (columnar mode)
         :return: no return - initializes the collection object
         """
+        # Columnar mode: NDS rows kept as one 2D float array; DataPoints only built on demand
+        self.data_matrix = None
+        self.column_index = None
+        self.file_columns = None  # NDS file column index of each matrix column (fewer than the file if projected)
+        self._projected = False
+        self._buffer = None  # Row storage behind data_matrix (may hold spare capacity for appends)
+        self._rows = None  # Index view: the rows of data_matrix holding the points (None - all rows, see select)
+        # Values derived from the points (time stamp index, series) - built on first use, dropped when the points change
+        self._derived = dict()
+        self._derived_version = 0
+        self._storage_version = [0]  # Change counter - shared with the collections sharing the points (see select)
+
         if input_data is None:
             self.list_of_data_points = list()
             self.index = 0
         else:
-            if isinstance(input_data,list) is True:
+            if isinstance(input_data,np.ndarray) is True:
+                self.list_of_data_points = None
+                self.block_append(input_data)
+            elif isinstance(input_data,list) is True:
                 if isinstance(input_data[0],DataPoint) is True:
-                    self.list_of_data_points = input_data
+                    self.list_of_data_points = list(input_data)  # Own list - appends never modify the caller's list
             elif isinstance(input_data,DataPoint) is True:
                 self.list_of_data_points = list()
                 self.list_of_data_points.append(input_data)
             else:
                 raise TypeError('Must input DataPoint objects into PointCollections')
-            self.index = len(self.list_of_data_points)
+            self.index = self.point_count()
 
     # Iterator
     def __iter__(self):
@@ -461,103 +1073,461 @@ class PointCollection:
         if self.index == 0:
             raise StopIteration
         self.index = self.index - 1
-        return self.list_of_data_points[self.index]
+        return self[self.index]
 
     # Getitem
     def __getitem__(self,index):
+        if self.data_matrix is not None:
+            return self.data_point(index)
         return self.list_of_data_points[index]
 
+    def is_columnar(self):
+        return self.data_matrix is not None
+
+    def data_point(self,index):
+        """
+        Build the DataPoint for one row of a columnar collection (on demand - not stored)
+        :param index: Row index within the collection
+        :return: DataPoint
+        """
+        if self._rows is not None:
+            index = self._rows[index]
+        row = self.data_matrix[index]
+        if self._projected is True:  # Full width row (NDS file columns then STAC) - columns not imported are 'nan'
+            column_count = max(len(NDS_COLUMN_NAMES),self.file_columns[-1]+1)
+            data = np.empty(column_count+len(STAC_COLUMN_NAMES))
+            data[:] = np.nan
+            data[self.file_columns] = row[:len(self.file_columns)]
+            data[column_count:] = row[len(self.file_columns):]
+            point = DataPoint(data)
+        else:
+            point = DataPoint(row)
+        for name in STAC_COLUMN_NAMES:
+            setattr(point,name,row[self.column_index[name]])
+        return point
+
+    def column(self,name):
+        """
+        :param name: Column name (see NDS_COLUMN_NAMES/STAC_COLUMN_NAMES) or NDS file column index
+        :return: Array of the column values; a view into the data matrix for columnar collections (a copy of the
+        column for index views)
+        """
+        if self.data_matrix is not None:
+            if name not in self.column_index:
+                raise KeyError('Column {} was not imported (see the columns option of import_wy_nds)'.format(name))
+            if self._rows is not None:
+                return self.data_matrix[self._rows,self.column_index[name]]
+            return self.data_matrix[:,self.column_index[name]]
+
+        if isinstance(name,str) is True and name in STAC_COLUMN_NAMES:
+            return np.array([getattr(point,name) for point in self.list_of_data_points],dtype=float)
+        if isinstance(name,str) is True:
+            name = NDS_COLUMN_INDEX[name]
+        return np.array([point[name] for point in self.list_of_data_points],dtype=float)
+
+    def set_column(self,name,values):
+        """
+        :param name: Column name to be overwritten (e.g. 'track1_x_vel_processed')
+        :param values: Values for every point in the collection
+        :return: no return - updates the collection
+        """
+        self.set_columns([name],np.reshape(values,(-1,1)))
+
+    def set_columns(self,names,values):
+        """
+        :param names: Column names to be overwritten (e.g. the STAC_COLUMN_NAMES)
+        :param values: 2D array [points x names] - values for every point in the collection
+        :return: no return - updates the collection (one assignment for columnar collections)
+        """
+        if self.data_matrix is not None:
+            columns = [self.column_index[name] for name in names]
+            if self._rows is not None:  # Written through to the shared rows
+                self.data_matrix[self._rows[:,np.newaxis],columns] = values
+            else:
+                self.data_matrix[:,columns] = values
+        else:
+            values = np.asarray(values)
+            for i in range(len(self.list_of_data_points)):
+                for j in range(len(names)):
+                    setattr(self.list_of_data_points[i],names[j],values[i,j])
+        self._points_changed()
+
+    def _points_changed(self):
+        # Called whenever points are added or modified - drops the derived values of every collection sharing them
+        self._storage_version[0] += 1
+
+    def _cached(self,key,function):
+        # Value derived from the points - computed by function on first use, kept until the points change
+        if self._derived_version != self._storage_version[0]:
+            self._derived = dict()
+            self._derived_version = self._storage_version[0]
+        if key not in self._derived:
+            value = function()
+            if isinstance(value,np.ndarray) is True:
+                value.flags.writeable = False  # Shared by every caller
+            self._derived[key] = value
+        return self._derived[key]
+
+    def track_values(self,suffix):
+        """
+        :param suffix: Per-track variable, e.g. 'target_id' for the track1_target_id ... track8_target_id columns
+        :return: 2D array of the variable [points x 8 tracks]
+        """
+        names = ['track{}_{}'.format(track,suffix) for track in range(1,9)]
+        if self._rows is not None:
+            return self.data_matrix[self._rows[:,np.newaxis],[self.column_index[name] for name in names]]
+        if self.data_matrix is not None:
+            return self.data_matrix[:,[self.column_index[name] for name in names]]
+        return np.column_stack([self.column(name) for name in names])
+
+    def lead_track_index(self):
+        """
+        Vectorized DataPoint.lead_track - resolves the lead vehicle track of every point in one pass
+        :return: Integer array of the lead track index (0-7) of each point; -1 if no lead vehicle (read only - cached)
+        """
+        def lead_track_index():
+            is_lead = (np.isnan(self.track_values('target_id')) == False) & (self.track_values('is_lead_vehicle') == 1)
+            lead_track_index = np.argmax(is_lead,axis=1)
+            lead_track_index[is_lead.any(axis=1) == False] = -1
+            return lead_track_index
+        return self._cached('lead_track_index',lead_track_index)
+
+    def lead_velocity_track_index(self):
+        """
+        Vectorized track resolution of DataPoint.lead_relative_velocity - the first track flagged as lead vehicle
+        (target id not checked) of each point with a lead vehicle
+        :return: Integer array of the track index (0-7) of each point; -1 if no lead vehicle (read only - cached)
+        """
+        def lead_velocity_track_index():
+            lead_velocity_track_index = np.argmax(self.track_values('is_lead_vehicle') == 1,axis=1)
+            lead_velocity_track_index[self.lead_track_index() < 0] = -1
+            return lead_velocity_track_index
+        return self._cached('lead_velocity_track_index',lead_velocity_track_index)
+
+    def lead_target_values(self,suffix,missing=np.nan,lead_track_index=None):
+        """
+        Gathers a per-track variable from the lead track of each point
+        :param suffix: Per-track variable, e.g. 'x_pos_processed'
+        :param missing: Value assigned to points without a lead vehicle
+        :param lead_track_index: (optional) result of lead_track_index() - to share one pass between variables - or of
+        lead_velocity_track_index()
+        :return: Array of the lead target's value at each point
+        """
+        if lead_track_index is None:
+            lead_track_index = self.lead_track_index()
+        values = np.empty(len(lead_track_index))
+        values[:] = missing
+        rows = np.flatnonzero(lead_track_index >= 0)
+        if self.data_matrix is not None:
+            columns = np.array([self.column_index['track{}_{}'.format(track,suffix)] for track in range(1,9)])
+            matrix_rows = rows
+            if self._rows is not None:
+                matrix_rows = self._rows[rows]
+            values[rows] = self.data_matrix[matrix_rows,columns[lead_track_index[rows]]]
+        else:
+            values[rows] = self.track_values(suffix)[rows,lead_track_index[rows]]
+        return values
+
+    def lead_target_ids(self):
+        """
+        :return: Array of the lead target id at each point; nan if no lead vehicle
+        """
+        return self.lead_target_values('target_id')
+
+    def lead_target_dists(self):
+        """
+        :return: Array of the distance to the lead target at each point; infinity if no lead vehicle
+        """
+        return np.round(self.lead_target_values('x_pos_processed',np.inf),3)
+
+    def _reserve_rows(self,count):
+        # Adds count rows behind the existing points (storage grows geometrically); returns the new rows to be filled
+        if self._rows is not None:  # An index view first gets its own copy of its rows
+            matrix = self.data_matrix[self._rows]
+            self._rows = None
+            self._buffer = matrix
+            self.data_matrix = matrix
+            self._storage_version = [self._storage_version[0]]
+        size = self.point_count()
+        if size+count > len(self._buffer):
+            buffer = np.empty((max(2*len(self._buffer),size+count),self._buffer.shape[1]))
+            buffer[:size] = self.data_matrix
+            self._buffer = buffer
+            self._storage_version = [self._storage_version[0]]
+        self.data_matrix = self._buffer[:size+count]
+        self.index = self.point_count()
+        self._points_changed()
+        return self.data_matrix[size:]
+
+    def _set_file_columns(self,file_columns):
+        # Records which NDS file columns the data matrix holds
+        self.file_columns = list(file_columns)
+        self._projected = self.file_columns != range(len(self.file_columns))
+        self.column_index = nds_column_index(self.file_columns)
+
+    def block_append(self,block,file_columns=None):
+        """
+        Appends a block of rows as read from the NDS file (see functions.iter_csv_blocks) to a columnar collection.
+        An empty collection becomes columnar on the first block.
+        :param block: 2D array of NDS rows
+        :param file_columns: (optional) NDS file column index of each block column, if only some columns were read
+        :return: no return - updates the collection
+        """
+        column_count = block.shape[1]
+        if file_columns is None:
+            file_columns = range(column_count)
+        if len(file_columns) != column_count:
+            raise ValueError('Block column count does not match the file columns')
+        if self.data_matrix is None:
+            if self.list_of_data_points is not None and len(self.list_of_data_points) > 0:
+                raise TypeError('Blocks can only be appended to columnar or empty collections')
+            self.list_of_data_points = None
+            self._buffer = np.empty((len(block),column_count+len(STAC_COLUMN_NAMES)))
+            self.data_matrix = self._buffer[:0]
+            self._set_file_columns(file_columns)
+        if list(file_columns) != self.file_columns:
+            raise ValueError('Block columns do not match the collection')
+
+        rows = self._reserve_rows(len(block))
+        rows[:,:column_count] = block
+        rows[:,column_count:] = np.nan
+
+    def adopt_matrix(self,matrix,file_columns=None):
+        """
+        Uses an existing columnar matrix (NDS columns followed by the STAC columns, e.g. a memory mapped cache file)
+        as the storage of an empty collection, without copying it
+        :param matrix: 2D array in the layout of data_matrix
+        :param file_columns: (optional) NDS file column index of each NDS matrix column, if only some columns were read
+        :return: no return - updates the collection
+        """
+        if file_columns is None:
+            file_columns = range(matrix.shape[1]-len(STAC_COLUMN_NAMES))
+        if len(file_columns) != matrix.shape[1]-len(STAC_COLUMN_NAMES):
+            raise ValueError('Matrix column count does not match the file columns')
+        if self.point_count() > 0:
+            raise TypeError('Matrix can only be adopted by an empty collection')
+        self.list_of_data_points = None
+        self._buffer = matrix
+        self.data_matrix = matrix
+        self._rows = None
+        self._set_file_columns(file_columns)
+        self.index = self.point_count()
+        self._points_changed()
+
+    def _point_row(self,point):
+        # Matrix row for a DataPoint appended to a columnar collection
+        row = np.empty(self.data_matrix.shape[1])
+        row[:] = np.nan
+        file_columns = np.array(self.file_columns,dtype=int)
+        available = file_columns < len(point.data)
+        row[np.flatnonzero(available)] = np.asarray(point.data,dtype=float)[file_columns[available]]
+        for name in STAC_COLUMN_NAMES:
+            row[self.column_index[name]] = getattr(point,name)
+        return row
+
     # Append Data Point to Collection
     def point_append(self,added_points):
         """
         :param added_points: DataPoints to be added to Collection - single point or list of points
         :return: no return - updates the collection to include the DataPoints specified
         """
+        if self.data_matrix is not None:
+            if isinstance(added_points,DataPoint) is True:
+                added_points = [added_points]
+            if isinstance(added_points,list) is True and isinstance(added_points[0],DataPoint) is True:
+                rows = np.array([self._point_row(added_points[i]) for i in range(len(added_points))])
+                self._reserve_rows(len(rows))[:] = rows
+                return
+            raise TypeError('List of DataPoints or single DataPoint required')
+
+        # Appended in place - amortized constant time per point
         if isinstance(added_points,list) is True:
             if isinstance(added_points[0],DataPoint) is True:
-                temp_list = list()
-                if len(self.list_of_data_points) > 0:
-                    for i in range(len(self.list_of_data_points)):
-                        temp_list.append(self.list_of_data_points[i])
-                for i in range(len(added_points)):
-                    temp_list.append(added_points[i])
-
-                self.list_of_data_points = temp_list
-                del temp_list
+                self.list_of_data_points.extend(added_points)
                 self.index = len(self.list_of_data_points)
+                self._points_changed()
 
         elif isinstance(added_points,DataPoint) is True:
-            temp_list = list()
-            if len(self.list_of_data_points) > 0:
-                for i in range(len(self.list_of_data_points)):
-                    temp_list.append(self.list_of_data_points[i])
-
-            temp_list.append(added_points)
-
-            self.list_of_data_points = temp_list
-            del temp_list
+            self.list_of_data_points.append(added_points)
             self.index = len(self.list_of_data_points)
+            self._points_changed()
 
         else:
             raise TypeError('List of DataPoints or single DataPoint required')
 
+    def column_matrix(self,names):
+        """
+        :param names: Column names or NDS file column indices (see column)
+        :return: 2D array of the columns [points x columns] - column-major, so column-wise reductions are contiguous
+        """
+        matrix = np.empty((self.point_count(),len(names)),order='F')
+        for j in range(len(names)):
+            matrix[:,j] = self.column(names[j])
+        return matrix
+
+    # Subset of the Collection
+    def select(self,index):
+        """
+        Builds a collection from a subset of the points in one step - no DataPoints are copied or built.
+        For columnar collections the new collection is a view sharing the rows of this collection, no data is copied:
+        consecutive points become a slice of the data matrix, other selections an index view holding only the row
+        indices. Changes through set_column are seen by both collections; appending points to a view moves it to its
+        own storage first.
+        :param index: slice of point indices (e.g. slice(start,stop)), boolean mask or array of point indices
+        :return: PointCollection of the selected points, in index order
+        """
+        collection = PointCollection()
+        if self.data_matrix is not None:
+            if isinstance(index,slice) is True and self._rows is None:
+                collection.adopt_matrix(self.data_matrix[index],self.file_columns)
+                return collection
+            if isinstance(index,slice) is True:
+                rows = self._rows[index]
+            else:
+                index = np.asarray(index)
+                if index.dtype == bool:
+                    index = np.flatnonzero(index)
+                rows = index.astype(int)
+                rows[rows < 0] += self.point_count()
+                if self._rows is not None:
+                    rows = self._rows[rows]
+            if len(rows) == 0:
+                collection.adopt_matrix(self.data_matrix[:0],self.file_columns)
+            elif rows[-1]-rows[0] == len(rows)-1 and np.all(np.diff(rows) == 1):  # Consecutive rows
+                collection.adopt_matrix(self.data_matrix[rows[0]:rows[-1]+1],self.file_columns)
+            else:
+                collection.adopt_matrix(self.data_matrix,self.file_columns)
+                collection._rows = rows
+                collection.index = collection.point_count()
+        else:
+            if isinstance(index,slice) is True:
+                collection.list_of_data_points = self.list_of_data_points[index]
+            else:
+                index = np.asarray(index)
+                if index.dtype == bool:
+                    index = np.flatnonzero(index)
+                collection.list_of_data_points = [self.list_of_data_points[i] for i in index]
+            collection.index = collection.point_count()
+        collection._storage_version = self._storage_version
+        return collection
+
+    # Time Stamp Index
+    def timestamp_index(self):
+        """
+        Sorted VTTI time stamps for binary search range queries - built once, rebuilt after the points change
+        :return: [sorted time stamps, sorting order of the points ('None' if the points are already in time order)]
+        """
+        def timestamp_index():
+            time_stamps = self.column('vtti_time_stamp')
+            with np.errstate(invalid='ignore'):  # 'nan' time stamps are out of order
+                in_order = len(time_stamps) < 2 or np.all(time_stamps[1:] >= time_stamps[:-1])
+            if in_order:
+                return [time_stamps,None]
+            # Out of order or 'nan' time stamps ('nan' sorted last - never within a range)
+            order = np.argsort(time_stamps,kind='mergesort')
+            return [time_stamps[order],order]
+        return self._cached('timestamp_index',timestamp_index)
+
+    def timestamp_ranges(self,starts,stops):
+        """
+        Batch range query: the points with start <= vtti_time_stamp <= stop for many (start, stop) pairs at once.
+        All pairs are located with one binary search each (O(log n)); for points in time order every result is a
+        view sharing the rows of this collection (see select).
+        :param starts: Starting VTTI time stamp values
+        :param stops: Stopping VTTI time stamp values
+        :return: List of PointCollections, one per (start, stop) pair
+        """
+        sorted_time_stamps, order = self.timestamp_index()
+        first = np.searchsorted(sorted_time_stamps,starts,side='left')
+        last = np.searchsorted(sorted_time_stamps,stops,side='right')
+        collections = list()
+        for i in range(len(first)):
+            if order is None:
+                collections.append(self.select(slice(first[i],max(first[i],last[i]))))
+            else:
+                collections.append(self.select(np.sort(order[first[i]:last[i]])))  # Kept in collection order
+        return collections
+
+    def timestamp_range(self,start,stop):
+        """
+        :param start: Starting VTTI time stamp value
+        :param stop: Stopping VTTI time stamp value
+        :return: PointCollection with the points between the start and stop time stamp values (see timestamp_ranges)
+        """
+        return self.timestamp_ranges([start],[stop])[0]
+
     # Number of Points in Collection
     def point_count(self):
+        if self._rows is not None:
+            return len(self._rows)
+        if self.data_matrix is not None:
+            return len(self.data_matrix)
         return len(self.list_of_data_points)
 
     # Median
     def median(self):
         if self.point_count % 2 == 0:
-            return np.mean(self.list_of_data_points[self.point_count()/2],self.list_of_data_points[(self.point_count()/2)-1])
+            return np.mean(self[self.point_count()/2],self[(self.point_count()/2)-1])
         else:
-            return self.list_of_data_points[(self.point_count()-1)/2]
+            return self[(self.point_count()-1)/2]
 
     # Driving Time covered by Collection [sec]
     def time_elapsed(self):
         return self.point_count()/float(10)
 
+    # Target ID Occurrences
+    def target_occurrences(self,lead=False):
+        """
+        Unique target ids of the Collection with their occurrences - one np.unique pass over the target id columns
+        :param lead: True - lead targets only (see lead_target_ids); False - targets detected in any track
+        :return: [ids, counts, first, last, target_index] - target ids (int) in order of first appearance, number of
+        detections of each target, row index of its first and last detection, and the position in ids of each detected
+        target id (array shaped as the target id values - [points] for lead targets, [points x 8 tracks] otherwise;
+        -1 if no target). Read only - cached.
+        """
+        def target_occurrences():
+            if lead is True:
+                target_ids = self.lead_target_ids()
+            else:
+                target_ids = self.track_values('target_id')
+            target_index = np.empty(target_ids.shape,dtype=int)
+            target_index[:] = -1
+            detections = np.flatnonzero(np.isnan(target_ids.ravel()) == False)  # points in order, tracks 1-8
+            unique_ids, first_detection, inverse, counts = np.unique(np.trunc(target_ids.ravel()[detections]),
+                                                                     return_index=True,return_inverse=True,
+                                                                     return_counts=True)
+            last_detection = len(detections)-1-np.unique(inverse[::-1],return_index=True)[1]
+            order = np.argsort(first_detection)  # order of first appearance
+            rank = np.argsort(order)
+            target_index.ravel()[detections] = rank[inverse]
+            rows = detections//(target_ids.shape[1] if target_ids.ndim == 2 else 1)  # row of each detection
+            occurrences = [unique_ids[order].astype(int),counts[order],rows[first_detection[order]],
+                           rows[last_detection[order]],target_index]
+            for values in occurrences:
+                values.flags.writeable = False  # Shared by every caller
+            return occurrences
+        if lead is True:
+            return self._cached('lead_target_occurrences',target_occurrences)
+        return self._cached('target_occurrences',target_occurrences)
+
     # List of Target IDs for trip
     def list_of_target_ids(self):
         """
         :return: Return a list of all targets identified within the Collection
         """
-        unique_target_ids = list()
-        temp_targets = list()
-        for i in range(len(self.list_of_data_points)):
-            temp_targets.append(self.list_of_data_points[i].current_targets())
-        for i in range(len(temp_targets)):
-            if len(temp_targets[i]) != 0:
-                for j in range(len(temp_targets[i])):
-                    if temp_targets[i][j] not in unique_target_ids:
-                        unique_target_ids.append(temp_targets[i][j])
-        return unique_target_ids
+        return self.target_occurrences()[0].tolist()
 
     # List of Lead Target Ids
     def list_of_lead_targets(self):
         """
         :return: Return a list of all identified LEAD targets within the Collection
         """
-        unique_lead_target_ids = list()
-        temp_targets = list()
-        for i in range(len(self.list_of_data_points)):
-            temp_targets.append(self.list_of_data_points[i].lead_target_id())
-        for i in range(len(temp_targets)):
-            if temp_targets[i] is not None:
-                if temp_targets[i] not in unique_lead_target_ids:
-                    unique_lead_target_ids.append(int(temp_targets[i]))
-        return unique_lead_target_ids
+        return self.target_occurrences(lead=True)[0].tolist()
 
     # Distance Travelled (assuming consecutive points) in Collection
     def dist_traveled(self):
-        temp_dist = 0
-        for i in range(len(self.list_of_data_points)):
-            speed_temp = self.list_of_data_points[i].vtti_speed_network
-            try:
-                int(speed_temp)
-                dist = speed_temp / float(36000)
-                temp_dist += dist
-            except ValueError:
-                continue
+        speed = self.column('vtti_speed_network')
+        temp_dist = np.sum(speed[np.isnan(speed) == False] / float(36000))
         return round(temp_dist,3)
 
     # Location start (assuming consecutive points) in collection
@@ -570,651 +1540,443 @@ class PointCollection:
 
     # Average Speed
     def mean_speed(self):
-        temp = list()
-        for i in range(len(self.list_of_data_points)):
-            temp.append(self.list_of_data_points[i].vtti_speed_network)
-        return round(np.nanmean(temp),3)
+        return round(np.nanmean(self.column('vtti_speed_network')),3)
 
     # Max Deceleration
     def max_deceleration(self):
-        temp = list()
-        for i in range(len(self.list_of_data_points)):
-            temp.append(self.list_of_data_points[i].vtti_accel_x)
-        return round(np.nanmin(temp),3)
+        return round(np.nanmin(self.column('vtti_accel_x')),3)
 
     # Percent Wipers
     def percent_wipers_active(self):
-        temp = 0
-        for i in range(len(self.list_of_data_points)):
-            wiper_status = self.list_of_data_points[i].vtti_wiper
-            if wiper_status == 1 or wiper_status == 2 or wiper_status == 3:
-                temp += 1
-        return round(float(temp)/len(self.list_of_data_points),3)
+        temp = np.count_nonzero(np.in1d(self.column('vtti_wiper'),[1,2,3]))
+        return round(float(temp)/self.point_count(),3)
 
     # Percent of Time Car Following
     def percent_car_following(self):
-        temp = 0
-        for i in range(len(self.list_of_data_points)):
-            if self.list_of_data_points[i].is_car_following() is True:
-                temp += 1
-        return round(float(temp)/len(self.list_of_data_points),3)
+        temp = np.count_nonzero(self.lead_track_index() >= 0)
+        return round(float(temp)/self.point_count(),3)
 
     # Summary Statistics of Variable Availability
     def summary_variable_availability(self,variable_index,save_path,output_file):
-        count_available = [0 for col in range(len(variable_index))]
-        for i in range(len(self.list_of_data_points)):
-            for j in range(len(variable_index)):
-                temp = self.list_of_data_points[i][variable_index[j][1]]
-                if str(float(self.list_of_data_points[i][variable_index[j][1]])) != 'nan':
-                    count_available[j] += 1
-
-        percent_available = [0 for col in range(len(variable_index))]
-        for i in range(len(count_available)):
-            percent_available[i] = count_available[i]/float(len(self.list_of_data_points))
+        variables = self.column_matrix([variable_index[j][1] for j in range(len(variable_index))])
+        count_available = np.count_nonzero(np.isnan(variables) == False,axis=0).tolist()
+        percent_available = [count/float(self.point_count()) for count in count_available]
 
-        target = open(os.path.join(save_path, output_file),'w')  # Output file
-        target.write("Variable Name, Percent, Count")
-        target.write("\n")
+        lines = ["Variable Name, Percent, Count"]
         for i in range(len(count_available)):
-            target.write("{},{},{}".format(variable_index[i][0],percent_available[i],count_available[i]))
-            target.write("\n")
+            lines.append("{},{},{}".format(variable_index[i][0],percent_available[i],count_available[i]))
+        target = open(os.path.join(save_path, output_file),'w')  # Output file
+        target.write("\n".join(lines)+"\n")
         target.close()
 
         print "Success - Data Availability File Generated"
 
     # Summary of Relevant Statistics
     def summary_statistics(self,variable_index,save_path,output_file):
-        # Iteration assigning values from the NDS data file
+        # Selected NDS variables as one array - each variable's values are also assigned to variable_index
+        variables = self.column_matrix([variable_index[i][1] for i in range(len(variable_index))])
         for i in range(len(variable_index)):
-            index = variable_index[i][1]
-            values_temp = ['nan' for k in range(len(self.list_of_data_points))]  # defaults to 'nan' if value missed
-            for j in range(len(self.list_of_data_points)):
-                values_temp[j] = self.list_of_data_points[j][index]
-            variable_index[i][2] = values_temp
+            variable_index[i][2] = variables[:,i]
 
-        target = open(os.path.join(save_path, output_file),'w')  # Output file
-
-        # Print Headers to file
-        target.write("File: {}".format(output_file))
-        target.write("\n")
-        target.write("Variables,")
-        for i in range(1):      # Write variable names to file
-            for j in range(len(variable_index)):
-                # Formatting adjustment for final value in a row
-                if j == len(variable_index) - 1:
-                    target.write("{}".format(variable_index[j][0]))
-                else:
-                    target.write("{},".format(variable_index[j][0]))
-        target.write("\n")
-
-        stats_operations_names = ['Mean','Max','Min','Median','Percentile85','Stdev','Variance','Coeff of Variation']
-
-        # Statistics Calculations
-        warnings.filterwarnings('ignore') # Warnings regarding all "nan" values ignored
-        for i in range(len(stats_operations_names)):
-            target.write(stats_operations_names[i]+',')
-            for j in range(len(variable_index)):
-                variable_array = variable_index[j][2] # Array of values for statistical operation
-                if i == 0:  # Mean
-                    # Formatting adjustment for final value in a row
-                    if j == len(variable_index) - 1:
-                        mean = np.nanmean(variable_array)
-                        target.write("{}".format(mean))
-                    else:
-                        mean = np.nanmean(variable_array)
-                        target.write("{},".format(mean))
-                elif i == 1:  # Maximum
-                    # Formatting adjustment for final value in a row
-                    if j == len(variable_index) - 1:
-                        max = np.nanmax(variable_array)
-                        target.write("{}".format(max))
-                    else:
-                        max = np.nanmax(variable_array)
-                        target.write("{},".format(max))
-                elif i == 2:  # Minimum
-                    # Formatting adjustment for final value in a row
-                    if j == len(variable_index) - 1:
-                        min = np.nanmin(variable_array)
-                        target.write("{}".format(min))
-                    else:
-                        min = np.nanmin(variable_array)
-                        target.write("{},".format(min))
-                elif i == 3:  # Median
-                    # Formatting adjustment for final value in a row
-                    if j == len(variable_index) - 1:
-                        median = np.nanmedian(variable_array)
-                        target.write("{}".format(median))
-                    else:
-                        median = np.nanmedian(variable_array)
-                        target.write("{},".format(median))
-                elif i == 4:  # 85th Percentile
-                    # Formatting adjustment for final value in a row
-                    if j == len(variable_index) - 1:
-                        percentile85 = np.nanpercentile(variable_array,85)
-                        target.write("{}".format(percentile85))
-                    else:
-                        percentile85 = np.nanpercentile(variable_array,85)
-                        target.write("{},".format(percentile85))
-                elif i == 5:  # Standard Deviation
-                    # Formatting adjustment for final value in a row
-                    if j == len(variable_index) - 1:
-                        std = np.nanstd(variable_array)
-                        target.write("{}".format(std))
-                    else:
-                        std = np.nanstd(variable_array)
-                        target.write("{},".format(std))
-                elif i == 6:  # Variance
-                    # Formatting adjustment for final value in a row
-                    if j == len(variable_index) - 1:
-                        var = np.nanvar(variable_array)
-                        target.write("{}".format(var))
-                    else:
-                        var = np.nanvar(variable_array)
-                        target.write("{},".format(var))
-                elif i == 7:  # Coefficient of Variation
-                    # Formatting adjustment for final value in a row
-                    if j == len(variable_index) - 1:
-                        coeff_of_var = sps.variation(variable_array)
-                        target.write("{}".format(coeff_of_var))
-                    else:
-                        coeff_of_var = sps.variation(variable_array)
-                        target.write("{},".format(coeff_of_var))
-            target.write("\n")
-        target.close()
+        # Statistics Calculations - all variables at once
+        write_statistics_table([variable_index[i][0] for i in range(len(variable_index))],column_statistics(variables),
+                               save_path,output_file)
         print "Success - Statistics Generated"
 
     def start_stop_vtti_timestamp(self):
-        try: start = int(self.list_of_data_points[0].vtti_time_stamp)
-        except ValueError:
-            try: start = int(self.list_of_data_points[1].vtti_time_stamp)
-            except ValueError:
-                try: start = int(self.list_of_data_points[2].vtti_time_stamp)
-                except ValueError:
-                    try: start = int(self.list_of_data_points[3].vtti_time_stamp)
-                    except ValueError:
-                        try: start = int(self.list_of_data_points[4].vtti_time_stamp)
-                        except ValueError:
-                            raise ValueError('Numeric Value not within first five points of collection')
-
-        stop = int(self.list_of_data_points[len(self.list_of_data_points)-1].vtti_time_stamp)
+        time_stamps = self.column('vtti_time_stamp')
+        available = np.flatnonzero(np.isnan(time_stamps[:5]) == False)
+        if len(available) == 0:
+            raise ValueError('Numeric Value not within first five points of collection')
+        start = int(time_stamps[available[0]])
+
+        stop = int(time_stamps[-1])
         return [start,stop]
 
-    def v_following(self):
-        # Using Network Speed - should check with GPS Speed
-        v_following = list()
-        for i in range(len(self.list_of_data_points)-1):
-            v_following.append(self.list_of_data_points[i].vtti_speed_network*1000/3600)  # m/s
+    # Derived Car Following Series
+    def series(self,name):
+        """
+        Derived car following series as an array - computed on first use and cached until the points change.
+        The methods of the same name return these values as new lists.
+        :param name: 'v_following', 'dV', 'v_target', 'dX', 'dT', 'dT_vtti', 'a_target' or 'a_following'
+        :return: Read only array - one value per time step (per point for a_target and a_following)
+        """
+        if name == 'v_following':
+            # Using Network Speed - should check with GPS Speed
+            function = lambda: self.column('vtti_speed_network')[:-1]*1000/3600  # m/s
+        elif name == 'dV':
+            # relative velocity between following vehicle and target
+            function = lambda: self.lead_target_values('x_vel_processed',np.NINF,
+                                                       self.lead_velocity_track_index())[1:]  # m/s
+        elif name == 'v_target':
+            # infinite where the relative velocity is not available
+            function = lambda: self.series('v_following')-self.series('dV')  # m/s
+        elif name == 'dX':
+            # separating distance between following vehicle and target
+            function = lambda: self.lead_target_dists()[1:]
+        elif name == 'dT':
+            # accumulative timestamp (starting at 0) from the seconds elapsed since last timestep
+            function = lambda: np.cumsum(np.diff(self.column('vtti_time_stamp'))/1000)  # sec
+        elif name == 'dT_vtti':
+            function = lambda: self.column('vtti_time_stamp')[:-1]
+        elif name == 'a_target':
+            function = lambda: np.round(self.lead_target_values('x_acc_estimated'),3)
+        elif name == 'a_following':
+            function = lambda: self.column('vtti_accel_x')
+        else:
+            raise ValueError('Unknown series: {}'.format(name))
+        return self._cached('series_{}'.format(name),function)
 
-        return v_following  # m/s
+    def v_following(self):
+        return self.series('v_following').tolist()  # m/s
 
     def dV(self):
-        dV = list()
-        for i in range(len(self.list_of_data_points)-1):
-            # relative velocity between following vehicle and target
-            dV_temp = self.list_of_data_points[i+1].lead_relative_velocity()
-            dV.append(dV_temp)
-        return dV  #m/s
+        return self.series('dV').tolist()  #m/s
 
     def v_target(self):
-        v_target = list()
-        v_following = self.v_following()
-        dV = self.dV()
-        for i in range(len(v_following)):
-            if np.isinf(dV[i]) is True:  # Works for both positive and negative infinity!
-                v_target.append(np.inf)
-            else:
-                v_target.append(np.subtract(v_following[i],dV[i]))
-        return v_target  # m/s
+        return self.series('v_target').tolist()  # m/s
 
     def dX(self):
-        dX = list()
-        for i in range(len(self.list_of_data_points)-1):
-            # separating distance between following vehicle and target
-            x_sep = self.list_of_data_points[i+1].lead_target_dist()
-            dX.append(x_sep)
-        return dX
+        return self.series('dX').tolist()
 
     def dT(self):
-        dT = list()
-        t_temp = 0
-        for i in range(len(self.list_of_data_points)-1):
-            # seconds elapsed since last timestep
-            dt_temp = (self.list_of_data_points[i+1].vtti_time_stamp-self.list_of_data_points[i].vtti_time_stamp)/1000  # sec
-            # accumulative timestamp (starting at 0)
-            t_temp += dt_temp
-            dT.append(t_temp)
-        return dT
+        return self.series('dT').tolist()
 
     def dT_vtti(self):
-        dT = list()
-        for i in range(len(self.list_of_data_points)-1):
-            dT.append(self.list_of_data_points[i].vtti_time_stamp)
-        return dT
+        return self.series('dT_vtti').tolist()
 
     def a_target(self):
-        a_target = list()
-        for i in range(len(self.list_of_data_points)):
-            a_target.append(self.list_of_data_points[i].lead_target_acc())
-        return a_target
+        return self.series('a_target').tolist()
 
     def a_following(self):
-        a_following = list()
-        for i in range(len(self.list_of_data_points)):
-            a_following.append(self.list_of_data_points[i].vtti_accel_x)
-        return a_following
+        return self.series('a_following').tolist()
+
+    def plot_t_X_spec(self,title = 't-X'):
+        return plot_spec(title,[['scatter',self.dT_vtti(),self.dX(),None,None]],"VTTI Timestamp",
+                         "Distance to Lead Vehicle")
 
     def plot_t_X(self,title = 't-X'):
-        fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig.suptitle(title,fontsize=18, fontweight='bold')
-        target_distances = self.dX()
-        timestamp_values = self.dT_vtti()
-        plt.scatter(timestamp_values,target_distances)
-        plt.ylabel("Distance to Lead Vehicle")
-        plt.xlabel("VTTI Timestamp")
-        plt.close()
-        return fig
+        return render_plot(self.plot_t_X_spec(title))
 
-    def plot_dV_X(self, title = 'dV-X'):
-        fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig.suptitle(title,fontsize=18, fontweight='bold')
+    def plot_dV_X_spec(self, title = 'dV-X'):
         dV = self.dV()
         dX = self.dX()
-        plt.scatter(dV,dX)
-       # plt.xlim([-3.5,3.5])
-        plt.ylabel("Distance to Target, X")
-        plt.xlabel("Change in Velocity, dV")
-
         # plt.ylim([0,60])  # Distance to lead vehicle
         dV_abs = list()
         for i in range(len(dV)):
             dV_abs.append(abs(dV[i]))
-        plt.xlim([-max(dV_abs),max(dV_abs)])
-        plt.close()
-        return fig
+        return plot_spec(title,[['scatter',dV,dX,None,None]],"Change in Velocity, dV","Distance to Target, X",
+                         xlim=[-max(dV_abs),max(dV_abs)])
 
-    def plot_t_dV(self, title = 't-dV'):
-        fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig.suptitle(title,fontsize=18, fontweight='bold')
-        dV = self.dV()
-        dt = self.dT()
-        plt.scatter(dt,dV)
-        plt.xlabel("Time")
-        plt.ylabel("Change in Velocity, dV")
-        plt.close()
-        return fig
+    def plot_dV_X(self, title = 'dV-X'):
+        return render_plot(self.plot_dV_X_spec(title))
 
-    def outlier_separation(self,mad_count=5,rolling_increment=20):
-        dV = list()
-        dX = list()
-        dt = list()
-        V_lead = list()
-        t_temp = 0
-        for i in range(len(self.list_of_data_points)-1):
-            dt_temp = (self.list_of_data_points[i+1].vtti_time_stamp-self.list_of_data_points[i].vtti_time_stamp)/1000  #[sec]
-            d_travelled_temp = self.list_of_data_points[i].vtti_speed_network*1000/3600*dt_temp
-            dX_temp = self.list_of_data_points[i+1].lead_target_dist()+d_travelled_temp-self.list_of_data_points[i].lead_target_dist()
-            X_temp = self.list_of_data_points[i+1].lead_target_dist()
-            V_target_temp = dX_temp/dt_temp - self.list_of_data_points[i+1].lead_target_acc()*dt_temp
-            dV_temp = self.list_of_data_points[i].vtti_speed_network*1000/3600 - V_target_temp  # Convert to m/s
-            t_temp += dt_temp
-            dX.append(X_temp)
-            dV.append(dV_temp)
-            dt.append(t_temp)
-            V_lead.append(V_target_temp)
-        index_list = list()
-        for i in range(len(dV)):
-            index_list.append(i)
-
-        rolling_increment = rolling_increment*10
-        outlier_index = list()
-        for i in range(0,len(dV),rolling_increment):
-            temp_dV = list()
-            temp_index_list = list()
-            for j in range(rolling_increment):
-                index = i+j
-                try:
-                    temp_dV.append(dV[index])
-                    temp_index_list.append(index_list[index])
-                except IndexError:
-                    break
-
-            median = np.median(temp_dV)
-            temp_diff_list = list()
-            for i in range(len(temp_dV)):
-                temp_diff_list.append(abs(temp_dV[i]-median))
-            median_absolute_deviation = np.median(temp_diff_list)
-            print "{} : {}".format(robust.mad(temp_dV),median_absolute_deviation)
-            median_absolute_deviation = robust.mad(temp_dV)
-            temp_outlier_index = list()
-            for i in range(len(temp_diff_list)):
-                if temp_diff_list[i] >= mad_count*median_absolute_deviation:
-                    temp_outlier_index.append(i)
-
-            for i in temp_outlier_index:
-                outlier_index.append(temp_index_list[i])
-
-        new_dV = list()
-        new_X = list()
-        new_t = list()
-        outlier_dV = list()
-        outlier_X = list()
-        outlier_t = list()
-        for i in range(len(dV)):
-            if i in outlier_index:
-                outlier_dV.append(dV[i])
-                outlier_X.append(dX[i])
-                outlier_t.append(dt[i])
-            else:
-                new_dV.append(dV[i])
-                new_X.append(dX[i])
-                new_t.append(dt[i])
+    def plot_t_dV_spec(self, title = 't-dV'):
+        return plot_spec(title,[['scatter',self.dT(),self.dV(),None,None]],"Time","Change in Velocity, dV")
 
-        fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig.suptitle('title',fontsize=18, fontweight='bold')
-        plt.scatter(dt,V_lead,c='b')
-        #plt.scatter(outlier_t,outlier_dV,c='r')
-        plt.xlabel("Time, T")
-        plt.ylabel("Change in Velocity, dV")
-        plt.close()
-        return fig
+    def plot_t_dV(self, title = 't-dV'):
+        return render_plot(self.plot_t_dV_spec(title))
 
-    def kalman_filter(self):
-        dV = self.dV()
-        dX = self.dX()
-        dt = self.dT()
-        V_lead = self.v_target()
+    def outlier_separation_spec(self,mad_count=5,rolling_increment=20,rolling=False,
+                                title='Lead Vehicle Velocity Outliers'):
+        """
+        :param mad_count: see mad_outliers
+        :param rolling_increment: Window length [sec] (10 Hz points)
+        :param rolling: see mad_outliers
+        :param title: Figure title
+        :return: Figure specification of the lead vehicle velocity over time - relative velocity outliers in red
+        """
+        lead_track_index = self.lead_track_index()
+        lead_dist = np.round(self.lead_target_values('x_pos_processed',np.inf,lead_track_index),3)
+        lead_acc = np.round(self.lead_target_values('x_acc_estimated',np.nan,lead_track_index),3)
+        speed = self.column('vtti_speed_network')
+
+        dt_temp = np.diff(self.column('vtti_time_stamp'))/1000  #[sec]
+        d_travelled_temp = speed[:-1]*1000/3600*dt_temp
+        dX_temp = lead_dist[1:]+d_travelled_temp-lead_dist[:-1]
+        V_lead = dX_temp/dt_temp - lead_acc[1:]*dt_temp
+        dV = speed[:-1]*1000/3600 - V_lead  # Convert to m/s
+        dt = np.cumsum(dt_temp)
+
+        outliers = mad_outliers(dV,rolling_increment*10,mad_count,rolling)
+        return plot_spec(title,[['scatter',dt[outliers == False],V_lead[outliers == False],'b','kept'],
+                                ['scatter',dt[outliers],V_lead[outliers],'r','outlier']],
+                         "Time, T","Lead Vehicle Velocity",legend=True)
+
+    def outlier_separation(self,mad_count=5,rolling_increment=20,rolling=False,
+                           title='Lead Vehicle Velocity Outliers'):
+        return render_plot(self.outlier_separation_spec(mad_count,rolling_increment,rolling,title))
 
+    def kalman_filter(self):
         """
         Kalman Filter
         """
         # http://scottlobdell.me/2014/08/kalman-filtering-python-reading-sensor-input/
         # http://www.cs.unc.edu/~welch/media/pdf/kalman_intro.pdf
 
-        # Initial parameters
-        iteration_count = len(V_lead)
-        noisy_measurement = V_lead
-        process_variance = .0001
-        estimated_measurement_variance = .01 # estimate of measurement var, change to see effect
-
-        # Initial Guess
-        posteri_estimate = 0.0
-        posteri_error_estimate = 1.0
-
-        posteri_estimate_for_graphing = []
-
-        for iteration in range(1,iteration_count):
-            # time update
-            priori_estimate = posteri_estimate
-            priori_error_estimate = posteri_error_estimate + process_variance
+        # Target velocity after the first step filtered (see kalman_smooth)
+        noisy_measurement = self.series('v_target')[1:]
+        posteri_estimate_for_graphing = kalman_smooth(noisy_measurement,[0,len(noisy_measurement)],
+                                                      process_variance=.0001,measurement_variance=.01)
+        dX_graph = self.series('dX')[1:]
 
-            # measurement update
-            blending_factor = priori_error_estimate / (priori_error_estimate + estimated_measurement_variance)
-            posteri_estimate = priori_estimate + blending_factor * (noisy_measurement[iteration] - priori_estimate)
-            posteri_error_estimate = (1 - blending_factor) * priori_error_estimate
-            posteri_estimate_for_graphing.append(posteri_estimate)
-
-        noisy_measurement_graph = noisy_measurement
-        noisy_measurement_graph.remove(noisy_measurement[0])
-
-        dt_graph = dt
-        dt_graph.remove(dt[0])
-
-        dX_graph = dX
-        dX_graph.remove(dX[0])
-
-        for i in range(len(self.list_of_data_points)-2):
-            V_target_temp = posteri_estimate_for_graphing[i]
-            dV_temp = self.list_of_data_points[i].vtti_speed_network*1000/3600 - V_target_temp  # Convert to m/s
-            dV.append(dV_temp)
-
-        print len(noisy_measurement)
-        print len(dV)
-        print len(dX_graph)
+        # Relative velocity from the filtered target velocity
+        dV = self.column('vtti_speed_network')[:len(posteri_estimate_for_graphing)]*1000/3600 - \
+             posteri_estimate_for_graphing  # Convert to m/s
 
         fig = plt.figure(figsize=(16,12))  # Size of figure
         fig.suptitle('sample',fontsize=18, fontweight='bold')
-        #plt.scatter(dt_graph,noisy_measurement_graph,c='r')
-        #plt.plot(dt_graph,posteri_estimate_for_graphing, c='b')
         plt.scatter(dV,dX_graph)
-        #plt.plot(actual_values, c='g')
-        #plt.scatter(dt,V_lead,c='b')
-        #plt.scatter(outlier_t,outlier_dV,c='r')
         plt.xlabel("Time, T")
         plt.ylabel("Change in Velocity, dV")
         plt.close()
         return fig
 
     def mean_dist_lead_target(self):
-        temp = list()
-        for i in range(len(self.list_of_data_points)):
-            temp.append(self.list_of_data_points[i].lead_target_dist())
-        return np.nanmin(temp)
+        return np.nanmin(self.lead_target_dists())
 
     def mean_headway_lead_target(self):
-        temp = list()
-        for i in range(len(self.list_of_data_points)):
-            temp.append(self.list_of_data_points[i].lead_target_headway())
-        return np.nanmin(temp)
+        return np.nanmin(np.round(self.lead_target_values('headway'),3))
 
     def cf_instance_lead_target_id(self):
-        temp = self.list_of_data_points[0].lead_target_id()
-        for i in range(len(self.list_of_data_points)):
-            if temp == self.list_of_data_points[i].lead_target_id():
-                continue
+        lead_target_ids = self.lead_target_ids()
+        if np.all(np.isnan(lead_target_ids)) == True:
+            return None
+        if np.all(lead_target_ids == lead_target_ids[0]) == False:
+            return False
+        return int(lead_target_ids[0])
+
+    # Summary Record
+    def summary_record(self):
+        """
+        Values of the collection summary methods from one pass over the columns - the speed, acceleration and wiper
+        columns are gathered once and the lead track resolution and target enumeration are shared (cached)
+        :return: Dictionary keyed by method name: 'point_count', 'time_elapsed', 'dist_traveled',
+        'start_stop_vtti_timestamp', 'percent_car_following', 'target_count' (len of list_of_target_ids),
+        'lead_target_count' (len of list_of_lead_targets), 'mean_speed', 'max_deceleration', 'percent_wipers_active',
+        'mean_dist_lead_target', 'mean_headway_lead_target', 'cf_instance_lead_target_id'
+        """
+        def summary_record():
+            point_count = self.point_count()
+            variables = self.column_matrix(['vtti_speed_network','vtti_accel_x','vtti_wiper'])
+            speed = variables[:,0]
+            lead_track_index = self.lead_track_index()
+            lead_target_occurrences = self.target_occurrences(lead=True)
+
+            record = dict()
+            record['point_count'] = point_count
+            record['time_elapsed'] = point_count/float(10)
+            record['dist_traveled'] = round(np.sum(speed[np.isnan(speed) == False] / float(36000)),3)
+            record['start_stop_vtti_timestamp'] = self.start_stop_vtti_timestamp()
+            record['percent_car_following'] = round(float(np.count_nonzero(lead_track_index >= 0))/point_count,3)
+            record['target_count'] = len(self.target_occurrences()[0])
+            record['lead_target_count'] = len(lead_target_occurrences[0])
+            record['mean_speed'] = round(np.nanmean(speed),3)
+            record['max_deceleration'] = round(np.nanmin(variables[:,1]),3)
+            record['percent_wipers_active'] = round(float(np.count_nonzero(np.in1d(variables[:,2],[1,2,3])))/point_count,3)
+            record['mean_dist_lead_target'] = np.nanmin(np.round(self.lead_target_values('x_pos_processed',np.inf,
+                                                                                          lead_track_index),3))
+            record['mean_headway_lead_target'] = np.nanmin(np.round(self.lead_target_values('headway',np.nan,
+                                                                                             lead_track_index),3))
+            # Single lead target id - None if no lead target, False if more than one
+            if lead_target_occurrences[1].sum() == 0:
+                record['cf_instance_lead_target_id'] = None
+            elif len(lead_target_occurrences[0]) > 1 or lead_target_occurrences[1][0] != point_count:
+                record['cf_instance_lead_target_id'] = False
             else:
-                temp = False
-        return temp
+                record['cf_instance_lead_target_id'] = int(lead_target_occurrences[0][0])
+            return record
+        return dict(self._cached('summary_record',summary_record))
 
     def generate_processed_data_class(self):
-        data = list()
-        dV = self.dV()
-        dX = self.dX()
-        dT = self.dT()
-        dT_vtti = self.dT_vtti()
-        v_target = self.v_target()
-        v_following = self.v_following()
-        a_target = self.a_target()
-        a_following = self.a_following()
-
-        for i in range(len(self.dV())):
-            data.append([dV[i],dX[i],dT[i],dT_vtti[i],v_target[i],v_following[i],a_target[i],a_following[i]])
+        names = ['dV','dX','dT','dT_vtti','v_target','v_following','a_target','a_following']
+        step_count = len(self.series('dV'))
+        data = np.column_stack([self.series(name)[:step_count] for name in names])
         return ProcessedData('wy_nds',data)
 
 
+# Variables of ProcessedData - in column order ('wy_nds' data rows and ProcessedData.matrix)
+PROCESSED_DATA_VARIABLES = ['dV', 'dX', 'T', 'T_vtti', 'v_target', 'v_following', 'a_target', 'a_following']
+
+# Columns of the imported data holding each variable - per data source (variables not provided are 'nan')
+PROCESSED_DATA_SOURCE_COLUMNS = {
+    # Headers- 0: driver_id,1: unique_inst,2: instance_id,3: timestamp,4: leader_vel,5: leader_accel,
+    # 6: follower_vel,7: follower_accel,8: delta_dist,9: delta_vel
+    'fhwa_irv': {'dV': 9, 'dX': 8, 'T': 3, 'v_target': 4, 'v_following': 6, 'a_target': 5, 'a_following': 7},
+    'stac_nds': {'T_vtti': 0, 'dV': 10, 'dX': 8, 'T': 0, 'a_target': 12},
+    # Headers- 0: Timestamp, 1: lead velocity, 2: lead acceleration, 3: dX, 4: following velocity,
+    # 5: following acceleration, 6: dV
+    'synthetic': {'dV': 6, 'dX': 3, 'T': 0, 'v_target': 1, 'v_following': 4, 'a_target': 2, 'a_following': 5}}
+
+# First line of binary ProcessedData files (see ProcessedData.binary_export)
+PROCESSED_DATA_FILE_MAGIC = 'PROCESSED_DATA 1'
+
+
+def csv_rows(matrix):
+    """
+    All values are formatted by one string formatting call over the flattened matrix - no per-row joins
+    :param matrix: 2D array [rows x columns]
+    :return: Text of the rows - comma separated values formatted as "{}".format, one line per row
+    """
+    matrix = np.asarray(matrix,dtype=float)
+    line = ','.join(['%s']*matrix.shape[1]) + '\n'  # '%s' of a float is "{}".format (12 significant digits)
+    return (line*matrix.shape[0]) % tuple(matrix.ravel().tolist())
+
+
 class ProcessedData:
     """ Processed Car Following Data dV dX """
 
     # Instantiation
     def __init__(self,data_source,data):
-
+        """
+        The variables (dV, dX, T, ...) are float arrays - views of one buffer with a row per variable, grown
+        geometrically by merge. offsets holds the first row of each CF instance, followed by the number of rows.
+        :param data_source: 'wy_nds' (rows in PROCESSED_DATA_VARIABLES order), 'blank' (no rows), 'list' (list of
+        ProcessedData - one CF instance each), 'columns' ([variables x points array, offsets, metadata] - the array is
+        used without copying, e.g. a memory map of a binary export), or a data source of PROCESSED_DATA_SOURCE_COLUMNS
+        (imported array)
+        :param data: Data of the source
+        """
         self.data = data
         self.data_source = data_source
+        self.metadata = dict()  # Stored with binary exports (see binary_export)
 
-        if self.data_source == 'list':
-            self.index = 0
-            for i in range(len(self.data)):
-                self.index += len(self.data[i].dV)
-        else:
-            self.index = len(self.data)
-
+        offsets = None
+        copy = True
         if self.data_source == 'wy_nds':
-            self.dV = list()
-            self.dX = list()
-            self.T = list()
-            self.T_vtti = list()
-            self.v_target = list()
-            self.v_following = list()
-            self.a_target = list()
-            self.a_following = list()
-            for i in range(len(self.data)):
-                self.dV.append(self.data[i][0])
-                self.dX.append(self.data[i][1])
-                self.T.append(self.data[i][2])
-                self.T_vtti.append(self.data[i][3])
-                self.v_target.append(self.data[i][4])
-                self.v_following.append(self.data[i][5])
-                self.a_target.append(self.data[i][6])
-                self.a_following.append(self.data[i][7])
-            # Create empty lists because size of list changes with update
-            self.v_target_update = None
-            self.dV_update = None
-            self.v_target_original_graph = None
-            self.dV_original_graph = None
-            self.dX_graph = None
-            self.T_graph = None
-            self.T_vtti_graph = None
-            self.v_following_graph = None
-            self.a_target_graph = None
-            self.a_following_graph = None
-
+            columns = np.asarray(self.data,dtype=float).reshape(-1,len(PROCESSED_DATA_VARIABLES)).T
         elif self.data_source == 'blank':
             # To create an empty assignment Processed Data Array (for combinations)
-            self.dV = list()
-            self.dX = list()
-            self.T = list()
-            self.T_vtti = list()
-            self.v_target = list()
-            self.v_following = list()
-            self.a_target = list()
-            self.a_following = list()
-
-            # Create empty lists because size of list changes with update
-            self.v_target_update = None
-            self.dV_update = None
-            self.v_target_original_graph = None
-            self.dV_original_graph = None
-            self.dX_graph = None
-            self.T_graph = None
-            self.T_vtti_graph = None
-            self.v_following_graph = None
-            self.a_target_graph = None
-            self.a_following_graph = None
-
+            columns = np.empty((len(PROCESSED_DATA_VARIABLES),0))
         elif self.data_source == 'list':
-            # To create an empty assignment Processed Data Array (for combinations)
-            self.dV = list()
-            self.dX = list()
-            self.T = list()
-            self.T_vtti = list()
-            self.v_target = list()
-            self.v_following = list()
-            self.a_target = list()
-            self.a_following = list()
-            for i in range(len(self.data)):
-                self.dV.extend(data[i].dV)
-                self.dX.extend(data[i].dX)
-                self.T.extend(data[i].T)
-                self.T_vtti.extend(data[i].T_vtti)
-                self.v_target.extend(data[i].v_target)
-                self.v_following.extend(data[i].v_following)
-                self.a_target.extend(data[i].a_target)
-                self.a_following.extend(data[i].a_following)
-            # Create empty lists because size of list changes with update
-            self.v_target_update = None
-            self.dV_update = None
-            self.v_target_original_graph = None
-            self.dV_original_graph = None
-            self.dX_graph = None
-            self.T_graph = None
-            self.T_vtti_graph = None
-            self.v_following_graph = None
-            self.a_target_graph = None
-            self.a_following_graph = None
-
-        elif self.data_source == 'fhwa_irv':
-            # Headers- 0: driver_id,1: unique_inst,2: instance_id,3: timestamp,4: leader_vel,5: leader_accel,
-            # 6: follower_vel,7: follower_accel,8: delta_dist,9: delta_vel
-            self.dV = list()
-            self.dX = list()
-            self.T = list()
-            self.T_vtti = list()
-            self.v_target = list()
-            self.v_following = list()
-            self.a_target = list()
-            self.a_following = list()
-            for i in range(len(self.data)):
-                self.dV.append(self.data[i][9])
-                self.dX.append(self.data[i][8])
-                self.T.append(self.data[i][3])
-                self.v_target.append(self.data[i][4])
-                self.v_following.append(self.data[i][6])
-                self.a_target.append(self.data[i][5])
-                self.a_following.append(self.data[i][7])
-            # Create empty lists because size of list changes with update
-            self.v_target_update = None
-            self.dV_update = None
-            self.v_target_original_graph = None
-            self.dV_original_graph = None
-            self.dX_graph = None
-            self.T_graph = None
-            self.T_vtti_graph = None
-            self.v_following_graph = None
-            self.a_target_graph = None
-            self.a_following_graph = None
-
-        elif data_source == 'stac_nds':
-            self.dV = list()
-            self.dX = list()
-            self.T = list()
-            self.T_vtti = list()
-            self.v_target = list()
-            self.v_following = list()
-            self.a_target = list()
-            self.a_following = list()
+            # Combination of processed data - the instances' rows one after another
+            columns = np.concatenate([self.data[i].columns() for i in range(len(self.data))] +
+                                     [np.empty((len(PROCESSED_DATA_VARIABLES),0))],axis=1)
+            offsets = [np.zeros(1,dtype=int)]
             for i in range(len(self.data)):
-                self.T_vtti.append(self.data[i][0])
-                self.dV.append(self.data[i][10])
-                self.dX.append(self.data[i][8])
-                self.T.append(self.data[i][0])
-                #self.v_target.append(self.data[i][4])
-                #self.v_following.append(self.data[i][6])
-                self.a_target.append(self.data[i][12])
-                #self.a_following.append(self.data[i][7])
-            # Create empty lists because size of list changes with update
-            self.v_target_update = None
-            self.dV_update = None
-            self.v_target_original_graph = None
-            self.dV_original_graph = None
-            self.dX_graph = None
-            self.T_graph = None
-            self.T_vtti_graph = None
-            self.v_following_graph = None
-            self.a_target_graph = None
-            self.a_following_graph = None
-
-        elif data_source == "synthetic":
-            # Headers- 0: Timestamp, 1: lead velocity, 2: lead acceleration, 3: dX, 4: following velocity,
-            # 5: following acceleration, 6: dV
-            self.dV = list()
-            self.dX = list()
-            self.T = list()
-            self.T_vtti = list()
-            self.v_target = list()
-            self.v_following = list()
-            self.a_target = list()
-            self.a_following = list()
-            for i in range(len(self.data)):
-                self.dV.append(self.data[i][6])
-                self.dX.append(self.data[i][3])
-                self.T.append(self.data[i][0])
-                self.v_target.append(self.data[i][1])
-                self.v_following.append(self.data[i][4])
-                self.a_target.append(self.data[i][2])
-                self.a_following.append(self.data[i][5])
-            # Create empty lists because size of list changes with update
-            self.v_target_update = None
-            self.dV_update = None
-            self.v_target_original_graph = None
-            self.dV_original_graph = None
-            self.dX_graph = None
-            self.T_graph = None
-            self.T_vtti_graph = None
-            self.v_following_graph = None
-            self.a_target_graph = None
-            self.a_following_graph = None
-
+                offsets.append(self.data[i].offsets[1:] + offsets[-1][-1])
+            offsets = np.concatenate(offsets)
+        elif self.data_source == 'columns':
+            columns, offsets = self.data[:2]
+            if len(self.data) > 2:
+                self.metadata = dict(self.data[2])
+            copy = False
+        elif self.data_source in PROCESSED_DATA_SOURCE_COLUMNS:
+            data = np.asarray(self.data,dtype=float)  # Typed array from functions.import_numeric_csv
+            columns = np.empty((len(PROCESSED_DATA_VARIABLES),len(data)))
+            columns[:] = np.nan
+            source_columns = PROCESSED_DATA_SOURCE_COLUMNS[self.data_source]
+            for i in range(len(PROCESSED_DATA_VARIABLES)):
+                if PROCESSED_DATA_VARIABLES[i] in source_columns:
+                    columns[i] = data[:,source_columns[PROCESSED_DATA_VARIABLES[i]]]
         else:
             raise ValueError("Incorrect Data Source Provided")
+        self._set_columns(columns,offsets,copy)
+
+        # Create empty lists because size of list changes with update
+        self.v_target_update = None
+        self.dV_update = None
+        self.v_target_original_graph = None
+        self.dV_original_graph = None
+        self.dX_graph = None
+        self.T_graph = None
+        self.T_vtti_graph = None
+        self.v_following_graph = None
+        self.a_target_graph = None
+        self.a_following_graph = None
+
+    def _set_columns(self,columns,offsets=None,copy=True):
+        # Replaces all rows - columns: [variables x rows]; offsets: CF instance offsets (default: a single instance)
+        # copy: False to keep using a float array with contiguous rows (e.g. a read only memory map)
+        self._buffer = np.array(columns,dtype=float,order='C',ndmin=2,copy=copy).reshape(len(PROCESSED_DATA_VARIABLES),-1)
+        if offsets is None:
+            offsets = [0,self._buffer.shape[1]] if self._buffer.shape[1] > 0 else [0]
+        self._rows = list(self._buffer)
+        self._original_version = None
+        self._update_version = None
+        self._use_version([range(len(PROCESSED_DATA_VARIABLES)),slice(0,self._buffer.shape[1]),
+                           np.asarray(offsets,dtype=int)])
+
+    """
+    Versions - [row of each variable (see _rows), columns of the points (slice, or array of column numbers),
+    CF instance offsets]. Original and updated variables are views of the same rows; only updated variables
+    (e.g. the filtered relative velocity) get rows of their own, so switching between versions costs no copies.
+    """
+
+    def _use_version(self,version):
+        # Variable attributes - views of the rows (copies if the version's points are not consecutive)
+        self._version = version
+        self.offsets = version[2]
+        for i in range(len(PROCESSED_DATA_VARIABLES)):
+            setattr(self,PROCESSED_DATA_VARIABLES[i],self._rows[version[0][i]][version[1]])
+        self.index = len(self.dV)
+
+    def _set_update(self,values,rows):
+        """
+        Update version - a subset of the points with some variables replaced; assigns the update variables
+        :param values: Dictionary of updated variable values - aligned with rows
+        :param rows: Points of the update - slice or array of point numbers of the current version
+        """
+        variable_rows, point_columns = self._version[:2]
+        if isinstance(point_columns,slice) is True and isinstance(rows,slice) is True:
+            start, stop, step = rows.indices(self.index)
+            update_columns = slice(point_columns.start+start,point_columns.start+max(start,stop))
+        else:
+            update_columns = np.arange(self._buffer.shape[1])[point_columns][rows]
+        update_rows = list(variable_rows)
+        for name in values:
+            # New row - arrays handed out for earlier versions are never overwritten
+            self._rows.append(np.empty(self._buffer.shape[1]))
+            self._rows[-1][update_columns] = values[name]
+            update_rows[PROCESSED_DATA_VARIABLES.index(name)] = len(self._rows)-1
+        update_offsets = np.searchsorted(np.arange(self.index)[rows],self.offsets)
+        self._update_version = [update_rows,update_columns,update_offsets]
+        # Rows of dropped versions released (arrays handed out keep their own reference)
+        used_rows = set(update_rows) | set(variable_rows)
+        if self._original_version is not None:
+            used_rows.update(self._original_version[0])
+        for row in range(len(PROCESSED_DATA_VARIABLES),len(self._rows)):
+            if row not in used_rows:
+                self._rows[row] = None
+
+        def update_variable(name,version_rows):
+            return self._rows[version_rows[PROCESSED_DATA_VARIABLES.index(name)]][update_columns]
+        self.dV_update = update_variable('dV',update_rows)
+        self.v_target_update = update_variable('v_target',update_rows)
+        self.dV_original_graph = update_variable('dV',variable_rows)
+        self.v_target_original_graph = update_variable('v_target',variable_rows)
+        self.dX_graph = update_variable('dX',update_rows)
+        self.T_graph = update_variable('T',update_rows)
+        self.T_vtti_graph = update_variable('T_vtti',update_rows)
+        self.a_target_graph = update_variable('a_target',update_rows)
+        self.a_following_graph = update_variable('a_following',update_rows)
+        self.v_following_graph = update_variable('v_following',update_rows)
+
+    def _compact(self):
+        # True if the current version is the buffer's leading points of the original rows
+        return (list(self._version[0]) == range(len(PROCESSED_DATA_VARIABLES)) and
+                isinstance(self._version[1],slice) is True and self._version[1].start == 0)
+
+    def columns(self):
+        """
+        :return: 2D array [variables x points] in PROCESSED_DATA_VARIABLES order - view, one contiguous row per variable
+        (a copy after replace_original)
+        """
+        if self._compact() is True:
+            return self._buffer[:,:self.index]
+        return np.vstack([getattr(self,name) for name in PROCESSED_DATA_VARIABLES])
+
+    def matrix(self):
+        """
+        :return: 2D array [points x variables] in PROCESSED_DATA_VARIABLES order - view
+        """
+        return self.columns().T
+
+    def instance_index(self):
+        """
+        :return: Array of the CF instance number of each point (see offsets)
+        """
+        return np.repeat(np.arange(len(self.offsets)-1),np.diff(self.offsets))
 
     def next(self):
         if self.index == 0:
@@ -1227,64 +1989,92 @@ class ProcessedData:
 
     def merge(self,processed_data_object):
         # Right now this is only merging original findings (ignoring updated)
-        self.dV.extend(processed_data_object.dV)
-        self.dX.extend(processed_data_object.dX)
-        self.T.extend(processed_data_object.T)
-        self.T_vtti.extend(processed_data_object.T_vtti)
-        self.v_target.extend(processed_data_object.v_target)
-        self.v_following.extend(processed_data_object.v_following)
-        self.a_target.extend(processed_data_object.a_target)
-        self.a_following.extend(processed_data_object.a_following)
-
-        self.index += len(processed_data_object.dV)
+        # Rows appended to the buffer - reallocated with room to spare when full (amortized constant time per row)
+        if self._compact() == False or self._original_version is not None:
+            self._set_columns(self.columns(),self.offsets)  # Current version as the only one - replaced points kept
+        count = self.index + processed_data_object.index
+        if count > self._buffer.shape[1] or self._buffer.flags.writeable == False:
+            buffer = np.empty((len(self._buffer),max(count,2*self._buffer.shape[1])))
+            buffer[:,:self.index] = self._buffer[:,:self.index]
+            self._buffer = buffer
+        self._buffer[:,self.index:count] = processed_data_object.columns()
+        self._rows = list(self._buffer)
+        self._original_version = None
+        self._update_version = None
+        self._use_version([self._version[0],slice(0,count),
+                           np.concatenate((self.offsets,processed_data_object.offsets[1:] + self.index))])
 
     def replace_original(self):
-        if len(self.dV_update) != 0:
-            self.dV = deepcopy(self.dV_update)
-            self.dX = deepcopy(self.dX_graph)
-            self.T = deepcopy(self.T_graph)
-            self.T_vtti = deepcopy(self.T_vtti_graph)
-            self.v_target = deepcopy(self.v_target_update)
-            self.v_following = deepcopy(self.v_following_graph)
-            self.a_target = deepcopy(self.a_target_graph)
-            self.a_following = deepcopy(self.a_following_graph)
+        # The update version becomes the current version - the replaced version is kept (see restore_original)
+        if self._update_version is not None and len(self.dV_update) != 0:
+            self._original_version = self._version[:2] + [self.offsets]
+            self._use_version(self._update_version)
+
+    def restore_original(self):
+        # Switches back to the version replaced by replace_original
+        if self._original_version is not None:
+            self._update_version = self._version
+            self._use_version(self._original_version)
+            self._original_version = None
 
     def original_export(self,filename,path):
+        # Rows formatted at once and written in one call (see csv_rows)
         target = open(os.path.join(path,filename),'w')
         target.write("{}".format(filename))
         target.write("\n")
         target.write("\n")
         target.write("dV [m/s], dX [m], dT [s], dT_vtti, v_target [m/s], v_following [m/s], a_target [m/s2], a_following [m/s2]")
         target.write("\n")
-
-        for i in range(len(self.dV)):
-            target.write("{},{},{},{},{},{},{},{}".format(self.dV[i],self.dX[i],self.T[i],self.T_vtti[i],self.v_target[i],
-                                                          self.v_following[i],self.a_target[i],self.a_following[i]))
-            target.write('\n')
+        target.write(csv_rows(self.matrix()))
         target.close()
 
-    def update_export(self,filename,path):
+    def update_export(self,filename,path,combined=None):
+        """
+        Exports the update variables - also appended to 00-updated_exports_combined.csv in path
+        :param filename: File name
+        :param path: Save path
+        :param combined: (optional) AppendFile of the combined export shared by many exports (flushed by the caller)
+        """
+        rows = csv_rows(np.column_stack((self.dV_update,self.dX_graph,self.T_graph,self.T_vtti_graph,
+                                         self.v_target_update,self.v_following_graph,self.a_target_graph,
+                                         self.a_following_graph)))
         target = open(os.path.join(path,filename),'w')
         target.write("{}".format(filename))
         target.write("\n")
         target.write("\n")
         target.write("Update dV [m/s], dX [m], dT [s], dT_vtti, Update v_target [m/s], v_following [m/s], a_target [m/s2], a_following [m/s2]")
         target.write("\n")
-        for i in range(len(self.dV_update)):
-            target.write("{},{},{},{},{},{},{},{}".format(self.dV_update[i],self.dX_graph[i],self.T_graph[i],self.T_vtti_graph[i],
-                                                          self.v_target_update[i],self.v_following_graph[i],
-                                                          self.a_target_graph[i],self.a_following_graph[i]))
-            target.write('\n')
+        target.write(rows)
+        target.close()
+        if combined is None:
+            append_to_file(os.path.join(path,'00-updated_exports_combined.csv'),rows)
+        else:
+            combined.write(rows)
+
+    def binary_export(self,filename,path,metadata=None):
+        """
+        Binary columnar export of the current variables - read back without parsing by functions.import_processed_data.
+        File: PROCESSED_DATA_FILE_MAGIC line, JSON header line (variables, point count, CF instance offsets, metadata)
+        padded to a multiple of 64 bytes, then one little endian float64 row per variable.
+        :param filename: File name (e.g. '<event id>_processed.bin')
+        :param path: Save path
+        :param metadata: (optional) Dictionary of JSON serializable values stored with the data, e.g. event id and
+        filter settings - updates the metadata of the object
+        """
+        if metadata is not None:
+            self.metadata.update(metadata)
+        header = json.dumps({'variables': PROCESSED_DATA_VARIABLES,'count': self.index,'dtype': '<f8',
+                             'offsets': [int(offset) for offset in self.offsets],
+                             'data_source': self.data_source,'metadata': self.metadata})
+        prefix = PROCESSED_DATA_FILE_MAGIC + '\n' + header
+        prefix += ' '*(-(len(prefix)+1) % 64) + '\n'  # Aligned start of the float rows
+        target = open(os.path.join(path,filename),'wb')
+        target.write(prefix)
+        np.ascontiguousarray(self.columns(),dtype='<f8').tofile(target)
         target.close()
-        target2 = open(os.path.join(path,'00-updated_exports_combined.csv'),'a')
-        for i in range(len(self.dV_update)):
-            target2.write("{},{},{},{},{},{},{},{}".format(self.dV_update[i],self.dX_graph[i],self.T_graph[i],self.T_vtti_graph[i],
-                                                          self.v_target_update[i],self.v_following_graph[i],
-                                                          self.a_target_graph[i],self.a_following_graph[i]))
-            target2.write('\n')
-        target2.close()
 
     def reset(self):
+        self._update_version = None
         self.v_target_update = None
         self.dV_update = None
         self.v_target_original_graph = None
@@ -1294,7 +2084,7 @@ class ProcessedData:
         self.T_vtti_graph = None
         self.v_following_graph = None
 
-    def kalman_filter(self, process_variance = .0001):
+    def kalman_filter(self, process_variance = .0001, estimated_measurement_variance = .01):
         """
         Kalman Filter
         -----------------------------------------------------------------------------------------------
@@ -1307,115 +2097,51 @@ class ProcessedData:
         steps, and the acceleration estimation from the radar. In order to account for measurement errors from the
         radar data indicated in the calculation of the target velocity, the Kalman filter is used to predict and correct
         the target velocity.
-        """
-
-        # Input Relative Velocity - Noisy measurement to be filtered
-        dV = self.dV
-
-        diff_list = list()
-        for i in range(len(dV)-1):
-            diff_list.append(dV[i+1]-dV[i])
-        stdev_dV = np.nanstd(diff_list)
-        estimated_measurement_variance = .01  # Radar Documentation NDS
-        print estimated_measurement_variance
-
-        # Initial Guess
-        posteri_estimate = 0.0
-        posteri_error_estimate = 1.0
-
-        # Updated relative velocity values
-        self.dV_update = []
-
-        # Loop for each velocity reading
-        for i in range(len(dV)-1):
-            # time update
-            priori_estimate = posteri_estimate
-            priori_error_estimate = posteri_error_estimate + process_variance
-
-            # measurement update
-            blending_factor = priori_error_estimate / (priori_error_estimate + estimated_measurement_variance)
-            posteri_estimate = priori_estimate + blending_factor * (dV[i+1] - priori_estimate)
-            posteri_error_estimate = (1 - blending_factor) * priori_error_estimate
-            self.dV_update.append(posteri_estimate)
-
-        print self.dV_update
 
-        # Create Updated Variables - removing the first row due to change in size of kalman updated data
-        self.v_target_original_graph = self.v_target
-        self.v_target_original_graph.remove(self.v_target[0])
-
-        self.dV_original_graph = self.dV
-        self.dV_original_graph.remove(self.dV[0])
-
-        self.v_target_update = self.v_target
-        # self.v_target_update.remove(self.v_target[0])
-
-        self.T_graph = self.T
-        self.T_graph.remove(self.T[0])
-
-        self.dX_graph = self.dX
-        self.dX_graph.remove(self.dX[0])
-
-        self.T_vtti_graph = self.T_vtti
-        self.T_vtti_graph.remove(self.T_vtti[0])
-
-        self.a_target_graph = self.a_target
-        self.a_target_graph.remove(self.a_target[0])
-
-        self.a_following_graph = self.a_following
-        self.a_following_graph.remove(self.a_following[0])
+        The relative velocity values after the first are filtered (see kalman_smooth) - the original values are not
+        modified. Many datasets are filtered in one batch by functions.smooth_with_kalman_filter.
+        :param process_variance: see kalman_steady_state_gain
+        :param estimated_measurement_variance: Measurement variance - Radar Documentation NDS
+        """
+        dV = np.asarray(self.dV,dtype=float)[1:]  # Input Relative Velocity - Noisy measurement to be filtered
+        self.kalman_update(kalman_smooth(dV,[0,len(dV)],process_variance,estimated_measurement_variance))
 
-        self.v_following_graph = self.v_following
-        self.v_following_graph.remove(self.v_following[0])
+    def kalman_update(self,dV_update):
+        """
+        Assigns Kalman filtered relative velocity values (see kalman_filter) and the matching update variables -
+        removing the first row due to change in size of kalman updated data
+        :param dV_update: Filtered relative velocity values - one less than the original values
+        """
+        self._set_update({'dV': dV_update},slice(1,self.index))
 
-    def moving_average(self, resolution='automatically_defined'):
+    def moving_average(self, resolution='automatically_defined', mode='centered'):
+        """
+        Moving average of the relative velocity (see moving_average) - the update variables are aligned views; in
+        centered mode the last resolution/2 points are dropped
+        :param resolution: Window length [points] - default 1% of the points
+        :param mode: 'centered', 'trailing' or 'edge' (see moving_average)
+        """
         # Assumes consecutive timestamps
         if resolution == 'automatically_defined':
             resolution = int(len(self.dV)*0.01)
-        #print resolution
-
-        X = self.dV
-        Y = [np.nan for i in range(len(X)-resolution/2)]
-        #print X
-        for i in range(resolution/2, len(X)-resolution/2):
-            index = i
-            #print index
-            Y[index] = 0
-            counter = 0
-            for j in range(-resolution/2,resolution/2):
-                if np.isnan(X[index-j])== False:
-                    Y[index]=Y[index]+X[index-j]
-                    counter += 1
-            if np.isnan(Y[index]) == True:
-                print 'nan'
-                Y[index] = Y[index-1]
-            else:
-                Y[index] = Y[index]/counter
-
-        self.dV_update = deepcopy(Y)
-        #print self.dV_update
-
-        # Create Updated Variables - removing the first row due to change in size of updated data
-        self.v_target_original_graph = deepcopy(self.v_target)
-        self.dV_original_graph = deepcopy(self.dV)
-        self.v_target_update = deepcopy(self.v_target)
-        self.T_graph = deepcopy(self.T)
-        self.dX_graph = deepcopy(self.dX)
-        self.T_vtti_graph = deepcopy(self.T_vtti)
-        self.a_target_graph = deepcopy(self.a_target)
-        self.a_following_graph = deepcopy(self.a_following)
-        self.v_following_graph = deepcopy(self.v_following)
-
-        for i in range(resolution/2):
-            self.v_target_original_graph.pop(-1)
-            self.dV_original_graph.pop(-1)
-            self.v_target_update.pop(-1)
-            self.T_graph.pop(-1)
-            self.dX_graph.pop(-1)
-            self.T_vtti_graph.pop(-1)
-            self.a_target_graph.pop(-1)
-            self.a_following_graph.pop(-1)
-            self.v_following_graph.pop(-1)
+        count = len(self.dV)
+        if mode == 'centered':
+            count = max(0,len(self.dV)-resolution/2)
+
+        self._set_update({'dV': moving_average(self.dV,resolution,mode)[:count]},slice(0,count))
+
+    def remove_outliers(self, mad_count=5, window=200, rolling=False):
+        """
+        Filtering stage removing relative velocity outliers (see mad_outliers) - the remaining points are kept in the
+        update variables (replace_original makes them the original values for the next stage)
+        :param mad_count: see mad_outliers
+        :param window: Window length [points]
+        :param rolling: see mad_outliers
+        :return: Boolean array - True for the removed points
+        """
+        outliers = mad_outliers(self.dV,window,mad_count,rolling)
+        self._set_update({},np.flatnonzero(outliers == False))
+        return outliers
 
     def plot_t_X_original(self,title = 'Original: Time vs. Separation Distance'):
         fig = plt.figure(figsize=(16,12))  # Size of figure
@@ -1426,18 +2152,14 @@ class ProcessedData:
         plt.close()
         return fig
 
-    def plot_dV_X_original(self, title = 'Original: Relative Velocity vs. Separation Distance'):
-        fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig.suptitle(title,fontsize=18, fontweight='bold')
-        plt.scatter(self.dV,self.dX,c='b')
+    def plot_dV_X_original_spec(self, title = 'Original: Relative Velocity vs. Separation Distance'):
         #plt.xlim([-10,10]); plt.ylim([0,120])
-        plt.ylabel("Separation Distance [m]")
-        plt.xlabel("Relative Velocity [m/s]: Following Vehicle - Lead Vehicle")
-        plt.legend()
+        return plot_spec(title,[['scatter',self.dV,self.dX,'b',None]],
+                         "Relative Velocity [m/s]: Following Vehicle - Lead Vehicle","Separation Distance [m]",
+                         legend=True)
 
-        plt.close()
-
-        return fig
+    def plot_dV_X_original(self, title = 'Original: Relative Velocity vs. Separation Distance'):
+        return render_plot(self.plot_dV_X_original_spec(title))
 
     def plot_t_v_host_original(self, title = 'Original: Host Vehicle Velocity over CF Instance'):
         fig = plt.figure(figsize=(16,12))  # Size of figure
@@ -1448,49 +2170,39 @@ class ProcessedData:
         plt.close()
         return fig
 
+    def plot_t_dV_original_spec(self, title = 'Original: Relative Velocity over CF Instance'):
+        return plot_spec(title,[['scatter',self.T,self.dV,'b',None]],"Normalized Time Stamp [s]",
+                         "Relative Velocity [m/s]: Following Vehicle - Lead Vehicle")
+
     def plot_t_dV_original(self, title = 'Original: Relative Velocity over CF Instance'):
-        fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig.suptitle(title,fontsize=18, fontweight='bold')
-        plt.scatter(self.T,self.dV,c='b')
-        plt.xlabel("Normalized Time Stamp [s]")
-        plt.ylabel("Relative Velocity [m/s]: Following Vehicle - Lead Vehicle")
-        plt.close()
-        return fig
+        return render_plot(self.plot_t_dV_original_spec(title))
+
+    def plot_t_v_target_kalman_spec(self, title = 'Kalman: Target Vehicle Velocity over CF Instance'):
+        return plot_spec(title,[['scatter',self.T_graph,self.v_target_original_graph,'b','original'],
+                                ['plot',self.T_graph,self.v_target_update,'r','update']],
+                         "Normalized Time Stamp [s]","Target Velocity [m/s]",legend=True)
 
     def plot_t_v_target_kalman(self, title = 'Kalman: Target Vehicle Velocity over CF Instance'):
-        fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig.suptitle(title,fontsize=18, fontweight='bold')
-        plt.scatter(self.T_graph,self.v_target_original_graph,c='b',label='original')
-        plt.plot(self.T_graph,self.v_target_update, c='r',label='update')
-        plt.xlabel("Normalized Time Stamp [s]")
-        plt.ylabel("Target Velocity [m/s]")
-        plt.legend()
-        plt.close()
-        return fig
+        return render_plot(self.plot_t_v_target_kalman_spec(title))
+
+    def plot_dV_X_kalman_spec(self, title = 'Kalman: Relative Velocity vs. Separation Distance'):
+        return plot_spec(title,[['scatter',self.dV_original_graph,self.dX_graph,'b','original'],
+                                ['scatter',self.dV_update,self.dX_graph,'r','update']],
+                         "Relative Velocity [m/s]: Following Vehicle - Lead Vehicle","Separation Distance [m]",
+                         legend=True)
 
     def plot_dV_X_kalman(self, title = 'Kalman: Relative Velocity vs. Separation Distance'):
-        fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig.suptitle(title,fontsize=18, fontweight='bold')
-        plt.scatter(self.dV_original_graph,self.dX_graph,c='b',label='original')
-        plt.scatter(self.dV_update,self.dX_graph,c='r',label='update')
-        plt.ylabel("Separation Distance [m]")
-        plt.xlabel("Relative Velocity [m/s]: Following Vehicle - Lead Vehicle")
-        plt.legend()
-        plt.close()
-        return fig
+        return render_plot(self.plot_dV_X_kalman_spec(title))
 
-    def plot_t_dV_kalman(self, title = 'Kalman: Relative Velocity over CF Instance'):
-        #fig = plt.figure(figsize=(16,12))  # Size of figure
-        fig = plt.figure(figsize=(16,8))
-        fig.suptitle(title,fontsize=18, fontweight='bold')
-        plt.scatter(self.T_graph,self.dV_original_graph,c='b',label='original')
-        plt.plot(self.T_graph,self.dV_update,c='r',label='update')
+    def plot_t_dV_kalman_spec(self, title = 'Kalman: Relative Velocity over CF Instance'):
         #plt.xlim([0,600])
-        plt.xlabel("Normalized Time Stamp [s]")
-        plt.ylabel("Relative Velocity [m/s]: Following Vehicle - Lead Vehicle")
-        plt.legend()
-        plt.close()
-        return fig
+        return plot_spec(title,[['scatter',self.T_graph,self.dV_original_graph,'b','original'],
+                                ['plot',self.T_graph,self.dV_update,'r','update']],
+                         "Normalized Time Stamp [s]","Relative Velocity [m/s]: Following Vehicle - Lead Vehicle",
+                         figsize=(16,8),legend=True)
+
+    def plot_t_dV_kalman(self, title = 'Kalman: Relative Velocity over CF Instance'):
+        return render_plot(self.plot_t_dV_kalman_spec(title))
 
     def plot_t_X_update(self,title = 'Updated: Separation Distance over CF Instance'):
         fig = plt.figure(figsize=(16,12))  # Size of figure
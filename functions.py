@@ -1,4 +1,10 @@
 from classes import *
+from itertools import islice
+from collections import deque
+import hashlib
+import json
+import multiprocessing
+import time
 
 """
 /*******************************************************************
@@ -31,113 +37,381 @@ def import_trip_ids(path,filename):
     return trip_num
 
 
-def import_nds_stac(stac_file_name, path):
-    stac_file = open(os.path.join(path,stac_file_name), 'r')  # Open NDSfile
-    stac_data = np.genfromtxt(stac_file, delimiter=',',skip_header=1,missing_values=np.nan)  # Import data such that blank entries are given 'nan' values
-    stac_file.close()
+# Default total size of the parsed file cache (see load_cached_array)
+CACHE_MAX_BYTES = 4*1024**3
 
-    return stac_data
 
+def file_digest(file_path,chunk_size=2**20):
+    # SHA1 of the file content - read in chunks
+    digest = hashlib.sha1()
+    file = open(file_path, 'rb')
+    try:
+        chunk = file.read(chunk_size)
+        while len(chunk) > 0:
+            digest.update(chunk)
+            chunk = file.read(chunk_size)
+    finally:
+        file.close()
+    return digest.hexdigest()
+
+
+def read_cache_index(cache_path):
+    index_file = os.path.join(cache_path,'cache_index.json')
+    if not os.path.isfile(index_file):
+        return dict()
+    file = open(index_file, 'r')
+    try:
+        return json.load(file)
+    except ValueError:  # Damaged index - cached arrays are rebuilt as they are requested
+        return dict()
+    finally:
+        file.close()
 
-def import_wy_nds(nds_file_name,path):
-    # Import NDS Data as DATA POINTS
-    nds_file = open(os.path.join(path,nds_file_name), 'r')  # Open NDSfile
-    nds_data = np.genfromtxt(nds_file, delimiter=',',skip_header=1,missing_values=np.nan)  # Import data such that blank entries are given 'nan' values
-    nds_file.close()
 
-    data_points = list()
-    for i in range(len(nds_data)):
-        data_points.append(DataPoint(nds_data[i]))
-    del nds_data
-    return PointCollection(data_points)
+def write_cache_index(cache_path,index):
+    # Written to a temporary file first so that readers never see a partially written index
+    index_file = os.path.join(cache_path,'cache_index.json')
+    temp_file = '{}.{}.tmp'.format(index_file,os.getpid())
+    file = open(temp_file, 'w')
+    json.dump(index,file)
+    file.close()
+    try:
+        os.rename(temp_file,index_file)
+    except OSError:  # Windows does not replace an existing file on rename
+        os.remove(index_file)
+        os.rename(temp_file,index_file)
 
 
-def import_wy_nds_stac(nds_file_name,nds_path,stac_file_name,stac_path):
+def cache_lock(cache_path):
+    # Lock of the cache index - held while the index is read, changed and written back (see FileLock)
+    return FileLock(os.path.join(cache_path,'cache_index.json.lock'))
 
-    def time_interpollation(time,value,nds_time):
-        new_value = [np.nan for i in range(len(nds_time))]
 
-        j = 0
-        for i in range(len(nds_time)):
-            while time[j]<nds_time[i] and j<len(time)-1:
-                if time[j]<nds_time[i] and time[j+1]>nds_time[i]:
-                    new_value[i] = (value[j+1]-value[j])/(time[j+1]-time[j])*(nds_time[i]-time[j])+value[j]
-                j+=1
+def evict_index_entries(cache_path,index,max_bytes,keep=None):
+    """
+    Removes the least recently used cached arrays from the cache folder and the index (called holding the cache lock).
+    Arrays that cannot be removed (e.g. memory mapped by another process on Windows) are skipped for now and stay in
+    the index, so that a later eviction removes them.
+    :param cache_path: Cache folder
+    :param index: Cache index (see read_cache_index) - changed in place
+    :param max_bytes: Allowed total size of the cached arrays
+    :param keep: (optional) Array file name that is never evicted (e.g. the one currently being loaded)
+    :return: Total size of the cache after eviction [bytes]
+    """
+    array_files = dict()  # array file: [size, last used] - several index entries may share one array file
+    for key in index:
+        entry = index[key]
+        last_used = max(array_files.get(entry['array_file'],[0,0])[1],entry.get('last_used',0))
+        array_files[entry['array_file']] = [entry['bytes'],last_used]
+
+    total_bytes = sum([array_files[array_file][0] for array_file in array_files])
+    for array_file in sorted(array_files,key=lambda name: array_files[name][1]):
+        if total_bytes <= max_bytes:
+            break
+        if array_file == keep:
+            continue
+        try:
+            if os.path.isfile(os.path.join(cache_path,array_file)):
+                os.remove(os.path.join(cache_path,array_file))
+        except OSError:
+            continue
+        total_bytes -= array_files[array_file][0]
+        for key in [key for key in index if index[key]['array_file'] == array_file]:
+            del index[key]
+    return total_bytes
 
-        # Get rid of non values by averaging existing values
-        for i in range(len(new_value)-2):
-            if np.isfinite(new_value[i+1]) == False:
-                new_value[i+1] = np.mean([new_value[i],new_value[i+2]])
-        return new_value
 
-    nds_datapoints = import_wy_nds(nds_file_name,nds_path)  # Point Collection!
-    stac_data = import_nds_stac(stac_file_name, stac_path)
+def evict_cache(cache_path,max_bytes=CACHE_MAX_BYTES,keep=None):
+    """
+    Removes the least recently used cached arrays until the cache is no larger than max_bytes.
+    :param cache_path: Cache folder
+    :param max_bytes: Allowed total size of the cached arrays
+    :param keep: (optional) Array file name that is never evicted (e.g. the one currently being loaded)
+    :return: Total size of the cache after eviction [bytes]
+    """
+    with cache_lock(cache_path):
+        index = read_cache_index(cache_path)
+        total_bytes = evict_index_entries(cache_path,index,max_bytes,keep)
+        write_cache_index(cache_path,index)
+    return total_bytes
+
+
+def save_cached_array(cache_path,array_file,data):
+    # Written to a temporary file first so that other processes never load a partially written array
+    temp_file = os.path.join(cache_path,'{}.{}.tmp'.format(array_file,os.getpid()))
+    file = open(temp_file, 'wb')
+    np.save(file,data)
+    file.close()
+    try:
+        os.rename(temp_file,os.path.join(cache_path,array_file))
+    except OSError:  # Windows - saved by another process in the meantime (same content)
+        os.remove(temp_file)
+    return os.path.getsize(os.path.join(cache_path,array_file))
+
 
-    new_time_nds = list()
-    for i in range(nds_datapoints.point_count()):
-        new_time_nds.append(nds_datapoints[i].vtti_time_stamp)
+def load_cached_array(file_name,path,cache_path,parse_tag,parse_function,mmap_mode='r',max_bytes=CACHE_MAX_BYTES):
+    """
+    Transparent on-disk cache of parsed input files.
+    Parsed arrays are stored as .npy files next to an index keyed by file path, size and modification time, and are
+    memory mapped on later loads. The content hash is only computed when the key is new, so that a copied or touched
+    file with identical content reuses the existing array instead of being parsed again.
+    The cache may be shared by processes (see batch_process_trips): files are hashed and parsed without holding the
+    cache lock; the index update, eviction and memory mapping are done holding it (see cache_lock).
+    :param file_name: Input file name
+    :param path: Location of the input file
+    :param cache_path: Cache folder; if None the file is parsed without caching
+    :param parse_tag: String identifying how the file is parsed (importer and its options)
+    :param parse_function: Function with no arguments returning the parsed 2D float array
+    :param mmap_mode: Memory map mode of cached arrays - 'r' read only, 'c' copy on write
+    :param max_bytes: Total cache size, least recently used arrays are evicted beyond this size
+    :return: Parsed array
+    """
+    if cache_path is None:
+        return parse_function()
+    initialize_save_path(cache_path)
+
+    file_path = os.path.abspath(os.path.join(path,file_name))
+    size = os.path.getsize(file_path)
+    mtime = os.path.getmtime(file_path)
+    key = hashlib.sha1('{}|{}|{!r}|{}'.format(file_path,size,mtime,parse_tag)).hexdigest()
+
+    index = read_cache_index(cache_path)  # Written by renaming, so a consistent index without the lock
+    entry = index.get(key)
+    if entry is not None and not os.path.isfile(os.path.join(cache_path,entry['array_file'])):
+        entry = None
+
+    data = None
+    if entry is None:
+        digest = file_digest(file_path)
+        for other_key in index:
+            other = index[other_key]
+            if other['sha1'] == digest and other['parse_tag'] == parse_tag and \
+                    os.path.isfile(os.path.join(cache_path,other['array_file'])):
+                entry = dict(other)
+                break
+        if entry is None:
+            data = parse_function()
+            array_file = '{}.npy'.format(key)
+            entry = {'sha1': digest, 'parse_tag': parse_tag, 'array_file': array_file,
+                     'bytes': save_cached_array(cache_path,array_file,data)}
+        entry['file'] = file_path
+        entry['size'] = size
+        entry['mtime'] = mtime
+
+    with cache_lock(cache_path):
+        index = read_cache_index(cache_path)  # Entries added by other processes in the meantime are kept
+        if data is None and not os.path.isfile(os.path.join(cache_path,entry['array_file'])):
+            # Evicted by another process since the index was read
+            data = parse_function()
+            entry['array_file'] = '{}.npy'.format(key)
+            entry['bytes'] = save_cached_array(cache_path,entry['array_file'],data)
+        entry['last_used'] = time.time()
+        index[key] = entry
+        if max_bytes is not None:
+            evict_index_entries(cache_path,index,max_bytes,keep=entry['array_file'])
+        write_cache_index(cache_path,index)
+        if data is None:
+            data = np.load(os.path.join(cache_path,entry['array_file']),mmap_mode=mmap_mode)
+    return data
 
-    time_stac = list()
-    for i in range(len(stac_data)):
-        time_stac.append(stac_data[i][0])
 
-    value_stac_dV = list()
-    for i in range(len(stac_data)):
-        value_stac_dV.append(stac_data[i][6])
+def parse_csv_block(lines,usecols=None):
+    # Parse a list of CSV lines into a 2D float array - blank entries are given 'nan' values, blank lines are skipped
+    # usecols: (optional) column indices to be read, other columns are skipped without being converted
+    lines = [line for line in lines if line.strip() != '']
+    if len(lines) == 0:
+        return None
+    block = np.genfromtxt(lines, delimiter=',',missing_values=np.nan,usecols=usecols)
+    if block.ndim < 2:
+        block = block.reshape(len(lines),-1)
+    return block
 
-    # Separate stac based on track
-    track_list = [1,2,3,4,5,6,7,8]
-    track_value_list_stac = [list() for i in range(len(track_list))]
-    track_time_list_stac = [list() for i in range(len(track_list))]
 
-    for i in range(len(stac_data)):
-        for j in range(len(track_list)):
-            if track_list[j]==stac_data[i][1]:
-                track_value_list_stac [j].append(stac_data[i][10])
-                track_time_list_stac[j].append(stac_data[i][0])
+def iter_csv_blocks(file_name,path,block_size=10000,skip_header=1,usecols=None):
+    """
+    Generator reading a numeric CSV file (NDS time series, STAC) in fixed size blocks of rows, so that a long trip
+    can be processed in bounded memory while the remainder of the file is still being read.
+    :param file_name: CSV file name
+    :param path: Location of the file
+    :param block_size: Number of rows per block
+    :param skip_header: Number of header lines
+    :param usecols: (optional) Column indices to be read - all columns if None
+    :return: Yields 2D float arrays of up to block_size rows - blank lines are skipped (blocks of blank lines are not
+    yielded)
+    """
+    file = open(os.path.join(path,file_name), 'r')
+    try:
+        for i in range(skip_header):  # Number of header lines
+            file.next()  # Header Line
+        while True:
+            lines = list(islice(file,block_size))
+            if len(lines) == 0:
+                break
+            block = parse_csv_block(lines,usecols)
+            if block is not None:
+                yield block
+    finally:
+        file.close()
+
+
+def import_nds_stac(stac_file_name, path, block_size=10000, cache_path=None):
+    stac_data = load_cached_array(stac_file_name,path,cache_path,'nds_stac',
+                                  lambda: np.concatenate(list(iter_csv_blocks(stac_file_name,path,block_size))))
+
+    return stac_data
+
+
+def iter_wy_nds(nds_file_name,path,block_size=10000,columns=None):
+    # Import NDS Data one block at a time - yields columnar Point Collections of up to block_size points
+    file_columns = None
+    if columns is not None:
+        file_columns = nds_file_columns(columns)
+    for block in iter_csv_blocks(nds_file_name,path,block_size,usecols=file_columns):
+        collection = PointCollection()
+        collection.block_append(block,file_columns)
+        yield collection
+
+
+def import_wy_nds(nds_file_name,path,columnar=True,block_size=10000,cache_path=None,columns=None):
+    """
+    Import NDS Data as a columnar Point Collection (columnar=False: one DATA POINT object per row)
+    :param nds_file_name: NDS time series file name
+    :param path: Location of the file
+    :param columnar: True - columnar Point Collection; False - Point Collection of DataPoints
+    :param block_size: Number of rows parsed at a time
+    :param cache_path: (optional) Folder for the on-disk cache of parsed files (see load_cached_array)
+    :param columns: (optional) Column projection - only these NDS columns are parsed and stored, all others are 'nan'.
+    List of column names, file column indices, or the variable_index from import_variable_preferences;
+    CF_PIPELINE_COLUMNS covers the car following analysis. All columns if None.
+    :return: Point Collection
+    """
+    file_columns = None
+    parse_tag = 'wy_nds'
+    if columns is not None:
+        file_columns = nds_file_columns(columns)
+        parse_tag = 'wy_nds|columns={}'.format(','.join([str(column) for column in file_columns]))
+
+    if columnar is False and cache_path is None and file_columns is None:
+        data_points = list()
+        for block in iter_csv_blocks(nds_file_name,path,block_size):
+            for i in range(len(block)):
+                data_points.append(DataPoint(block[i]))
+        return PointCollection(data_points)
+
+    collection = PointCollection()
+    if cache_path is not None:
+        # Cached columnar matrix is memory mapped copy-on-write: STAC columns can be filled without touching the cache
+        collection.adopt_matrix(load_cached_array(nds_file_name,path,cache_path,parse_tag,
+                                                  lambda: import_wy_nds(nds_file_name,path,True,block_size,
+                                                                        columns=file_columns).data_matrix,
+                                                  mmap_mode='c'),file_columns)
+    else:
+        for block in iter_csv_blocks(nds_file_name,path,block_size,usecols=file_columns):
+            collection.block_append(block,file_columns)
+
+    if columnar is True:
+        return collection
+    return PointCollection([collection[i] for i in range(collection.point_count())])
 
-    track_value_new_list = [list() for i in range(len(track_list))]
+
+def time_interpolation(time,value,new_time):
+    """
+    Linear interpolation of a time series (e.g. one STAC track) at new time stamps (e.g. the NDS time stamps).
+    A new time stamp is interpolated if it lies strictly between two consecutive time stamps of the series; as in the
+    sequential merge this replaces, only the first new time stamp falling in each interval is interpolated.
+    :param time: Time stamps of the series (ascending)
+    :param value: Values of the series
+    :param new_time: Time stamps to be interpolated
+    :return: Array of interpolated values - 'nan' where not interpolated
+    """
+    time = np.asarray(time,dtype=float)
+    value = np.asarray(value,dtype=float)
+    new_time = np.asarray(new_time,dtype=float)
+    new_value = np.empty(len(new_time))
+    new_value[:] = np.nan
+    if len(time) < 2 or len(new_time) == 0:
+        return new_value
+
+    upper = np.searchsorted(time,new_time,side='left')  # First time stamp >= new time stamp
+    # Merge position reached before each new time stamp (never moves back; 'nan' time stamps do not move it)
+    position = np.where(np.isnan(new_time),0,np.minimum(upper,len(time)-1))
+    previous = np.concatenate(([0],np.maximum.accumulate(position)[:-1]))
+    rows = np.flatnonzero((upper > previous) & (upper < len(time)))
+    rows = rows[time[upper[rows]] > new_time[rows]]
+    j = upper[rows]-1
+    new_value[rows] = (value[j+1]-value[j])/(time[j+1]-time[j])*(new_time[rows]-time[j])+value[j]
+    return new_value
+
+
+def fill_isolated_gaps(values):
+    """
+    Gap filling of the sequential merge, on arrays: each non-finite value (other than the first and last) is replaced
+    by the mean of the previous value - as already filled - and the next value. A gap between two finite values gets
+    their mean; within a run of non-finite values the first filled value is carried on, and becomes 'nan' from the
+    first next value that does not match it.
+    :param values: Array of values - 1D, or 2D with each column filled separately
+    :return: Filled copy of values
+    """
+    values = np.array(values,dtype=float,order='F')
+    flat = values.ravel(order='F')  # View - columns one after the other
+    if len(values) < 3:
+        return values
+    position = np.arange(len(flat)) % len(values)
+    gap = (np.isfinite(flat) == False) & (position > 0) & (position < len(values)-1)
+    gaps = np.flatnonzero(gap)
+    if len(gaps) == 0:
+        return values
+
+    run_first = gap[gaps-1] == False  # Previous value not filled
+    run = np.cumsum(run_first)-1
+    run_start = gaps[run_first]
+    with np.errstate(invalid='ignore'):
+        carried = ((flat[run_start-1]+flat[run_start+1])/2)[run]
+        next_value = flat[gaps+1]
+        broken = (run_first == False) & (np.isfinite(next_value) == False) & (next_value != carried)
+    broken_count = np.cumsum(broken)
+    flat[gaps] = np.where(broken_count > broken_count[run_first][run],np.nan,carried)
+    return values
+
+
+def import_wy_nds_stac(nds_file_name,nds_path,stac_file_name,stac_path,cache_path=None,columns=None):
+    # NDS Point Collection with the STAC target velocities interpolated to the NDS time stamps
+    nds_datapoints = import_wy_nds(nds_file_name,nds_path,cache_path=cache_path,columns=columns)  # Point Collection!
+    stac_data = import_nds_stac(stac_file_name, stac_path, cache_path=cache_path)
+
+    new_time_nds = nds_datapoints.column('vtti_time_stamp')
+
+    # Separate stac based on track - one sort by track then time
+    order = np.lexsort((stac_data[:,0],stac_data[:,1]))
+    track_stac = stac_data[order,1]
+    time_stac = stac_data[order,0]
+    value_stac = stac_data[order,10]
+
+    track_list = [1,2,3,4,5,6,7,8]
+    track_start = np.searchsorted(track_stac,track_list,side='left')
+    track_end = np.searchsorted(track_stac,track_list,side='right')
+
+    names = list()
+    new_values = list()
     for i in range(len(track_list)):
-        if len(track_time_list_stac[i]) != 0:  # Accounting for tracks with no lead vehicles
-            track_value_new_list[i] = time_interpollation(track_time_list_stac[i],track_value_list_stac[i],new_time_nds)
-
-    for i in range(len(track_value_new_list)):
-        if len(track_value_new_list[i]) != 0:  # Accounting for tracks with no lead vehicles
-            if i+1 == 1:
-                for j in range(nds_datapoints.point_count()):
-                    nds_datapoints[j].track1_x_vel_processed = track_value_new_list[i][j]
-            elif i+1 == 2:
-                for j in range(nds_datapoints.point_count()):
-                    nds_datapoints[j].track2_x_vel_processed = track_value_new_list[i][j]
-            elif i+1 == 3:
-                for j in range(nds_datapoints.point_count()):
-                    nds_datapoints[j].track3_x_vel_processed = track_value_new_list[i][j]
-            elif i+1 == 4:
-                for j in range(nds_datapoints.point_count()):
-                    nds_datapoints[j].track4_x_vel_processed = track_value_new_list[i][j]
-            elif i+1 == 5:
-                for j in range(nds_datapoints.point_count()):
-                    nds_datapoints[j].track5_x_vel_processed = track_value_new_list[i][j]
-            elif i+1 == 6:
-                for j in range(nds_datapoints.point_count()):
-                    nds_datapoints[j].track6_x_vel_processed = track_value_new_list[i][j]
-            elif i+1 == 7:
-                for j in range(nds_datapoints.point_count()):
-                    nds_datapoints[j].track7_x_vel_processed = track_value_new_list[i][j]
-            elif i+1 == 8:
-                for j in range(nds_datapoints.point_count()):
-                    nds_datapoints[j].track8_x_vel_processed = track_value_new_list[i][j]
+        if track_end[i] > track_start[i]:  # Accounting for tracks with no lead vehicles
+            names.append('track{}_x_vel_processed'.format(track_list[i]))
+            new_values.append(time_interpolation(time_stac[track_start[i]:track_end[i]],
+                                                 value_stac[track_start[i]:track_end[i]],new_time_nds))
+    if len(names) > 0:  # All tracks filled and written at once
+        nds_datapoints.set_columns(names,fill_isolated_gaps(np.column_stack(new_values)))
 
     return nds_datapoints
 
 
-def compile_wy_nds_stac_CF_events(nds_file_name,nds_path,stac_file_name,stac_path,save_path,timestamp):
+def compile_wy_nds_stac_CF_events(nds_file_name,nds_path,stac_file_name,stac_path,save_path,timestamp,cache_path=None,
+                                  columns=None):
     # Output is Processed Data Class - Combining all of the CF instanes in one file to one dataset
 
     processed_data_output_filename = '{}_nds_processed_data.csv'.format(timestamp)
     processed_data_all = ProcessedData('blank',list())
 
-    point_collection_1 = import_wy_nds_stac(nds_file_name,nds_path,stac_file_name,stac_path)
+    point_collection_1 = import_wy_nds_stac(nds_file_name,nds_path,stac_file_name,stac_path,cache_path,columns)
     list_of_collections = generate_car_following_collections(point_collection_1,min_cf_time=40,max_cf_dist=60)
     processed_data_combined = processed_data(list_of_collections)
 
@@ -148,66 +422,152 @@ def compile_wy_nds_stac_CF_events(nds_file_name,nds_path,stac_file_name,stac_pat
     return processed_data_all
 
 
-def import_stac_radardata(file_name,path):
-    # Imports STAC Radar Data
-    file = open(os.path.join(path,file_name), 'r')  # Open Vehicle Data file
-    for i in range(1):  # Number of header lines
-        file.next()  # Header Line
-    data = []
-    for line in file:
-        data.append(line.strip().split(','))
-    file.close()
+def count_lines(file_path,chunk_size=2**20):
+    # Number of lines in a file (a final line without a line break is counted)
+    line_count = 0
+    last_chunk = ''
+    file = open(file_path, 'rb')
+    try:
+        chunk = file.read(chunk_size)
+        while len(chunk) > 0:
+            line_count += chunk.count('\n')
+            last_chunk = chunk
+            chunk = file.read(chunk_size)
+    finally:
+        file.close()
+    if len(last_chunk) > 0 and last_chunk[-1] != '\n':
+        line_count += 1
+    return line_count
 
-    # Convert data from Float to Integer
-    for i in range(len(data)):
-        for j in range(len(data[i])):
-            try:
-                data[i][j] = float(data[i][j])
-            except ValueError:
-                data[i][j] = np.nan
 
-    return data
+def parse_numeric_lines(lines):
+    """
+    Converts a block of CSV lines to a 2D float64 array without a per-cell Python loop.
+    Blank and non-numeric entries are given 'nan' values; shorter rows are padded with 'nan'.
+    :param lines: List of CSV lines
+    :return: 2D float64 array [lines x columns]
+    """
+    text = '\n'.join([line.strip() for line in lines])
+    if text == '':  # Single blank line
+        return np.array([[np.nan]])
+
+    # Number of columns in each line, from the positions of the commas and line breaks
+    characters = np.frombuffer(text,dtype=np.uint8)
+    comma_count = np.cumsum(characters == ord(','))
+    line_ends = np.append(np.flatnonzero(characters == ord('\n')),len(characters)-1)
+    widths = np.diff(np.append(0,comma_count[line_ends]))+1
+    width = int(widths.max())
+    if np.any(widths < width):  # Pad short rows with blank entries
+        rows = text.split('\n')
+        for i in np.flatnonzero(widths < width):
+            rows[i] += ','*(width-widths[i])
+        text = '\n'.join(rows)
+    text = text.replace('\n',',')
+
+    # Fast path - entirely numeric block (strict conversion - any blank or text entry raises ValueError)
+    cells = text.split(',')
+    try:
+        return np.array(cells,dtype=float).reshape(len(widths),width)
+    except ValueError:
+        pass
+
+    # Blank or text entries - converted column by column, each distinct entry of a failing column only once
+    values = np.empty((len(widths),width))
+    for j in range(width):
+        column_cells = cells[j::width]
+        try:
+            values[:,j] = np.fromiter(map(float,column_cells),np.float64,len(column_cells))
+        except ValueError:
+            cell_values = dict()
+            for cell in set(column_cells):
+                try:
+                    cell_values[cell] = float(cell)
+                except ValueError:
+                    cell_values[cell] = np.nan
+            values[:,j] = np.fromiter(map(cell_values.__getitem__,column_cells),np.float64,len(column_cells))
+    return values
 
 
-def import_fhwa_irv(irv_file_name,path):
-    # Imports FHWA IRV data - to be directly entered in as "Processed Data Class"
-    file = open(os.path.join(path,irv_file_name), 'r')  # Open Vehicle Data file
-    for i in range(14):  # Number of header lines
-        file.next()  # Header Line
-    data = []
-    for line in file:
-        data.append(line.strip().split(','))
-    file.close()
+def import_numeric_csv(file_name,path,skip_header=1,block_size=100000):
+    """
+    Fast typed CSV parser shared by the FHWA IRV, STAC radar and synthetic data importers.
+    The file is read straight into a preallocated float64 array (sized from a line count) one block of lines at a time.
+    :param file_name: CSV file name
+    :param path: Location of the file
+    :param skip_header: Number of header lines
+    :param block_size: Number of lines converted at once
+    :return: 2D float64 array [rows x columns]; blank and non-numeric entries are given 'nan' values
+    """
+    row_count = max(count_lines(os.path.join(path,file_name))-skip_header,0)
+    data = np.empty((row_count,0))
 
-    # Convert data from Float to Integer
-    for i in range(len(data)):
-        for j in range(len(data[i])):
-            try:
-                data[i][j] = float(data[i][j])
-            except ValueError:
-                data[i][j] = np.nan
+    file = open(os.path.join(path,file_name), 'r')  # Open Vehicle Data file
+    try:
+        for i in range(skip_header):  # Number of header lines
+            file.next()  # Header Line
+        row = 0
+        while row < row_count:
+            lines = list(islice(file,min(block_size,row_count-row)))
+            if len(lines) == 0:
+                break
+            values = parse_numeric_lines(lines)
+            if values.shape[1] > data.shape[1]:  # Wider rows than seen so far - pad the array with 'nan'
+                padding = np.empty((row_count,values.shape[1]-data.shape[1]))
+                padding[:] = np.nan
+                data = np.hstack([data,padding])
+            data[row:row+len(values),:values.shape[1]] = values
+            data[row:row+len(values),values.shape[1]:] = np.nan
+            row += len(values)
+    finally:
+        file.close()
 
-    return data
+    return data[:row]
 
 
-def import_synthetic_data(file_name,path):
+def import_stac_radardata(file_name,path,cache_path=None):
+    # Imports STAC Radar Data
+    return load_cached_array(file_name,path,cache_path,'stac_radardata',
+                             lambda: import_numeric_csv(file_name,path,skip_header=1))
+
+
+def import_fhwa_irv(irv_file_name,path,cache_path=None):
+    # Imports FHWA IRV data - to be directly entered in as "Processed Data Class"
+    return load_cached_array(irv_file_name,path,cache_path,'fhwa_irv',
+                             lambda: import_numeric_csv(irv_file_name,path,skip_header=14))
+
+
+def import_synthetic_data(file_name,path,cache_path=None):
     # Imports generated synthetic data - to be directly entered in as "Processed Data Class"
-    file = open(os.path.join(path,file_name), 'r')  # Open Vehicle Data file
-    for i in range(4):  # Number of header lines
-        file.next()  # Header Line
-    data = []
-    for line in file:
-        data.append(line.strip().split(','))
-    file.close()
+    return load_cached_array(file_name,path,cache_path,'synthetic',
+                             lambda: import_numeric_csv(file_name,path,skip_header=4))
 
-    # Convert data from Float to Integer
-    for i in range(len(data)):
-        for j in range(len(data[i])):
-            try:
-                data[i][j] = float(data[i][j])
-            except ValueError:
-                data[i][j] = np.nan
-    return data
+
+def import_processed_data(file_name,path,mmap_mode='r'):
+    """
+    Opens a binary ProcessedData export (see ProcessedData.binary_export) - the variables are memory mapped, so
+    nothing is parsed or copied. Updated variables (e.g. moving_average) get their own arrays.
+    :param file_name: Binary export file name
+    :param path: Location of the file
+    :param mmap_mode: Memory map mode - 'r' read only, 'c' copy on write, None to read the values into memory
+    :return: ProcessedData with the exported variables, CF instance offsets and metadata
+    """
+    file_path = os.path.join(path,file_name)
+    file = open(file_path, 'rb')
+    try:
+        if file.readline().rstrip('\n') != PROCESSED_DATA_FILE_MAGIC:
+            raise ValueError("{} is not a binary ProcessedData export".format(file_path))
+        header = json.loads(file.readline())
+        data_offset = file.tell()
+        if header['variables'] != PROCESSED_DATA_VARIABLES:
+            raise ValueError("{} holds the variables {}".format(file_path,header['variables']))
+        shape = (len(PROCESSED_DATA_VARIABLES),header['count'])
+        if mmap_mode is None or header['count'] == 0:
+            columns = np.fromfile(file,dtype=header['dtype'],count=shape[0]*shape[1]).reshape(shape)
+    finally:
+        file.close()
+    if mmap_mode is not None and header['count'] > 0:
+        columns = np.memmap(file_path,dtype=header['dtype'],mode=mmap_mode,offset=data_offset,shape=shape)
+    return ProcessedData('columns',[columns,header['offsets'],header['metadata']])
 
 
 def initialize_save_path(save_path):
@@ -247,18 +607,25 @@ def check_files_exist(trip_numbers,open_nds_data_path):
         raise SystemError  # Stop running script if error detected.
 
 
-def import_cf_data(input_source,input_filename,input_path,log_path=None,timestamp=None,stac_filename=None,stac_path=None):
+def import_cf_data(input_source,input_filename,input_path,log_path=None,timestamp=None,stac_filename=None,stac_path=None,
+                   cache_path=None,columns=None):
+    # cache_path: (optional) folder for the on-disk cache of parsed input files (see load_cached_array)
+    # columns: (optional) NDS column projection, e.g. CF_PIPELINE_COLUMNS (see import_wy_nds)
     if input_source == 'fhwa_irv':
-        data = import_fhwa_irv(input_filename,input_path)
+        data = import_fhwa_irv(input_filename,input_path,cache_path)
         processed_data = ProcessedData(input_source,data)
     elif input_source == 'wy_nds':
-        data = import_wy_nds(input_filename,input_path)
+        data = import_wy_nds(input_filename,input_path,cache_path=cache_path,columns=columns)
         # todo STAC
     elif input_source == 'wy_nds_stac':
-        processed_data = compile_wy_nds_stac_CF_events(input_filename,input_path,stac_filename,stac_path,log_path,timestamp)
+        processed_data = compile_wy_nds_stac_CF_events(input_filename,input_path,stac_filename,stac_path,log_path,timestamp,
+                                                       cache_path,columns)
     elif input_source == 'synthetic':
-        data = import_synthetic_data(input_filename,input_path)
+        data = import_synthetic_data(input_filename,input_path,cache_path)
         processed_data = ProcessedData(input_source,data)
+    elif input_source == 'processed_data':
+        # Binary export of pre-extracted data (see ProcessedData.binary_export) - memory mapped, not parsed
+        processed_data = import_processed_data(input_filename,input_path)
 
     return processed_data
 
@@ -274,189 +641,174 @@ def generate_collection_from_timestamps(collection_initial,start,stop):
     :param stop: stopping VTTI time stamp value
     :return: PointCollection with DataPoints between the start and stop time stamp values
     """
-    generated_collection = PointCollection()
-    for i in range(collection_initial.point_count()):
-        if collection_initial[i].vtti_time_stamp >= start and collection_initial[i].vtti_time_stamp <= stop:
-            generated_collection.point_append(collection_initial[i])
-    return generated_collection
+    return collection_initial.timestamp_range(start,stop)
 
 
-def generate_car_following_collections(collection_initial, min_cf_time=60, max_cf_dist=80, min_speed=1,event_id = None, figure_save_path = None):
-    # Create initial Arrays for aggregating CF Instances
-    lead_targets = collection_initial.list_of_lead_targets()
-    list_of_collections = [PointCollection() for row in range(len(lead_targets))]
+def generate_collections_from_timestamps(collection_initial,start_stop_list):
+    """
+    :param collection_initial: Original PointCollection datapoint
+    :param start_stop_list: List of [start, stop] VTTI time stamp values - e.g. event windows to be extracted
+    :return: List of PointCollections, one per [start, stop] (see PointCollection.timestamp_ranges)
+    """
+    if len(start_stop_list) == 0:
+        return list()
+    start_stop_list = np.asarray(start_stop_list,dtype=float)
+    return collection_initial.timestamp_ranges(start_stop_list[:,0],start_stop_list[:,1])
 
-    # Sort Data Points in CF behavior based on target ID into DataCollections
-    for i in range(collection_initial.point_count()):
-        for j in range(len(lead_targets)):
-            if collection_initial[i].lead_target_id() == lead_targets[j]:
-                try:
-                    if collection_initial[i].vtti_time_stamp < list_of_collections[j][list_of_collections[j].point_count()-1].vtti_time_stamp+3000:
-                        list_of_collections[j].point_append(collection_initial[i])
-                except IndexError:
-                    list_of_collections[j].point_append(collection_initial[i])
-
-    # Checking distance requirements
-    temp = list()  # For collecting single instances
-    temp_list = list()  # For collecting all instances
-    for i in range(len(list_of_collections)):
-        for j in range(list_of_collections[i].point_count()):
-            if list_of_collections[i][j].lead_target_dist() < max_cf_dist:
-                temp.append(list_of_collections[i][j])
-            else:
-                if len(temp) > 0:
-                    temp_list.append(PointCollection(temp))
-                    temp = list()
-        if len(temp) > 0:
-            temp_list.append(PointCollection(temp))
-            temp = list()
-
-    list_of_collections = deepcopy(temp_list)
-
-    # Check the subject vehicle's velocity requirements - for freeway driving
-    temp = list()  # For collecting single instances
-    temp_list = list()  # For collecting all instances
-    for i in range(len(list_of_collections)):
-        for j in range(list_of_collections[i].point_count()):
-            if list_of_collections[i][j].vtti_speed_network > min_speed:
-                temp.append(list_of_collections[i][j])
-            else:
-                if len(temp) > 0:
-                    temp_list.append(PointCollection(temp))
-                    temp = list()
-        if len(temp) > 0:
-            temp_list.append(PointCollection(temp))
-            temp = list()
-
-    list_of_collections = deepcopy(temp_list)
-
-    # Checking time requirements
-    temp_list = list()
-    for i in range(len(list_of_collections)):
-        if list_of_collections[i].time_elapsed() >= min_cf_time:
-            temp_list.append(list_of_collections[i])
-    list_of_collections = temp_list
+
+def car_following_segments(collection_initial, min_cf_time=60, max_cf_dist=80, min_speed=1):
+    """
+    Car following segmentation computed on arrays in one pass over the trip:
+     (1) points are grouped by lead target (targets in order of first appearance, points in time order); a target's
+         points are kept until the first gap of 3000 ms or more between kept points - the rest of that target is
+         dropped ('nan' time stamps are skipped). Time stamps are assumed to increase, as in the NDS time series.
+     (2) runs of consecutive points of one target with a lead distance below max_cf_dist and a speed above min_speed
+     (3) runs of at least min_cf_time seconds (10 Hz points)
+    :param collection_initial: PointCollection of the trip
+    :param min_cf_time: Minimum car following duration [s]
+    :param max_cf_dist: Maximum distance to the lead target
+    :param min_speed: Minimum speed of the subject vehicle
+    :return: rows - point indices of the trip grouped by lead target; segments - [start, stop] positions in rows of
+    each car following instance (the instance is rows[start:stop])
+    """
+    # Rank of each point's lead target by first appearance (see PointCollection.target_occurrences)
+    lead_target_rank = collection_initial.target_occurrences(lead=True)[4]
+    candidates = np.flatnonzero(lead_target_rank >= 0)
+    if len(candidates) == 0:
+        return candidates, np.zeros((0,2),dtype=int)
+
+    # (1) Group by lead target - stable sort keeps the time order
+    target_rank = lead_target_rank[candidates]
+    group_order = np.argsort(target_rank,kind='mergesort')
+    rows = candidates[group_order]
+    group = target_rank[group_order]
+    group_first = np.concatenate(([True],group[1:] != group[:-1]))
+
+    # Time gap rule - compared between consecutive valid time stamps of a target
+    time_stamps = collection_initial.column('vtti_time_stamp')[rows]
+    valid = np.flatnonzero(np.isnan(time_stamps) == False)
+    keep = np.zeros(len(rows),dtype=bool)
+    if len(valid) > 0:
+        same_group = group[valid[1:]] == group[valid[:-1]]
+        gap = same_group & ((time_stamps[valid[1:]] < time_stamps[valid[:-1]]+3000) == False)
+        gap_count = np.cumsum(np.concatenate(([False],gap)))
+        valid_group_first = np.concatenate(([True],same_group == False))
+        group_start = np.maximum.accumulate(np.where(valid_group_first,np.arange(len(valid)),0))
+        keep[valid[gap_count == gap_count[group_start]]] = True  # No gap since the first point of the target
+    # The first point of a target is always kept - if its time stamp is 'nan' no other point of the target is
+    nan_first_groups = group[group_first & np.isnan(time_stamps)]
+    keep[np.in1d(group,nan_first_groups)] = False
+    keep[group_first] = True
+    rows = rows[keep]
+    group = group[keep]
+
+    # (2) Distance and speed conditions - runs end at failing points and at target changes
+    with np.errstate(invalid='ignore'):  # 'nan' distances and speeds fail the conditions
+        condition = (collection_initial.lead_target_dists()[rows] < max_cf_dist) & \
+                    (collection_initial.column('vtti_speed_network')[rows] > min_speed)
+    target_change = np.concatenate(([True],group[1:] != group[:-1],[True]))
+    run_start = np.flatnonzero(condition & (target_change[:-1] | np.concatenate(([True],condition[:-1] == False))))
+    run_stop = np.flatnonzero(condition & (target_change[1:] | np.concatenate((condition[1:] == False,[True]))))+1
+
+    # (3) Time requirement
+    long_enough = (run_stop-run_start)/float(10) >= min_cf_time
+    return rows, np.column_stack((run_start[long_enough],run_stop[long_enough]))
+
+
+def generate_car_following_collections(collection_initial, min_cf_time=60, max_cf_dist=80, min_speed=1,event_id = None, figure_save_path = None,
+                                       figures = None):
+    # figures: (optional) list collecting the figures for later rendering instead of saving them now (see save_figures)
+    # Car following instances found on arrays (see car_following_segments) - each instance is a view of the trip
+    # collection (PointCollection.select), holding only its row indices
+    rows, segments = car_following_segments(collection_initial,min_cf_time,max_cf_dist,min_speed)
+    list_of_collections = [collection_initial.select(rows[segments[i][0]:segments[i][1]]) for i in range(len(segments))]
 
     # If required information is provided, produce and save Dist - Time plots for CF instances
     if figure_save_path is not None and event_id is not None:
+        plots = list()
         for i in range(len(list_of_collections)):
-            temp = list_of_collections[i].plot_t_X('{}_{}_t-X fig2'.format(event_id,i+1))
-            temp.savefig(os.path.join(figure_save_path,'{}_{}_t-X fig2'.format(event_id,i+1)))
+            name = '{}_{}_t-X fig2'.format(event_id,i+1)
+            plots.append([list_of_collections[i].plot_t_X_spec(name),os.path.join(figure_save_path,name)])
         for i in range(len(list_of_collections)):
-            temp = list_of_collections[i].plot_dV_X('{}_{}_dV-X fig2'.format(event_id,i+1))
-            temp.savefig(os.path.join(figure_save_path,'{}_{}_dV-X fig2'.format(event_id,i+1)))
+            name = '{}_{}_dV-X fig2'.format(event_id,i+1)
+            plots.append([list_of_collections[i].plot_dV_X_spec(name),os.path.join(figure_save_path,name)])
         for i in range(len(list_of_collections)):
-            temp = list_of_collections[i].plot_t_dV('{}_{}_t-dV fig2'.format(event_id,i+1))
-            temp.savefig(os.path.join(figure_save_path,'{}_{}_t-dV fig2'.format(event_id,i+1)))
+            name = '{}_{}_t-dV fig2'.format(event_id,i+1)
+            plots.append([list_of_collections[i].plot_t_dV_spec(name),os.path.join(figure_save_path,name)])
+        save_figures(plots,figures)
 
     return list_of_collections
 
 
 def collection_summary(collection_initial,run_time,summary_save_path = None, event_id = None, summary_file = 'collection_summary.csv',log_file = 'runtime_log.csv'):
+    record = collection_initial.summary_record()  # One pass over the trip - formatted below for console, log and csv
+    start, stop = record['start_stop_vtti_timestamp']
     print "----------------------------------------------------------------------------"
-    print "Collection Length: {} min".format(round(collection_initial.time_elapsed()/float(60)),3)
-    print "Number of Data Points: {}".format(collection_initial.point_count())
-    print "Approximate Distance Traveled: {} km".format(collection_initial.dist_traveled())
-    print "Trip VTTI Timestamps: {} to {}".format(collection_initial.start_stop_vtti_timestamp()[0],
-                                                  collection_initial.start_stop_vtti_timestamp()[1])
-    print "Percent Time Vehicle in Car Following: {}%".format(collection_initial.percent_car_following()*100)
-    print "Number of Total Targets Identified: {}".format(len(collection_initial.list_of_target_ids()))
-    print "Number of Lead Targets Identified: {}".format(len(collection_initial.list_of_lead_targets()))
+    print "Collection Length: {} min".format(round(record['time_elapsed']/float(60)),3)
+    print "Number of Data Points: {}".format(record['point_count'])
+    print "Approximate Distance Traveled: {} km".format(record['dist_traveled'])
+    print "Trip VTTI Timestamps: {} to {}".format(start,stop)
+    print "Percent Time Vehicle in Car Following: {}%".format(record['percent_car_following']*100)
+    print "Number of Total Targets Identified: {}".format(record['target_count'])
+    print "Number of Lead Targets Identified: {}".format(record['lead_target_count'])
 
     if summary_save_path is not None and event_id is not None:
-        target = open(os.path.join(summary_save_path,log_file), 'a')
-        target.write("----------------------------------------------------------------------------")
-        target.write("\n")
-        target.write("Event ID: {} ---- Time: {}".format(event_id,run_time))
-        target.write("\n")
-        target.write("\n")
-        target.write("Collection Length: {} min".format(round(collection_initial.time_elapsed()/float(60)),3))
-        target.write("\n")
-        target.write("Number of Data Points: {}".format(collection_initial.point_count()))
-        target.write("\n")
-        target.write("Approximate Distance Traveled: {} km".format(round(collection_initial.dist_traveled()),3))
-        target.write("\n")
-        target.write("Trip VTTI Timestamps: {} to {}".format(collection_initial.start_stop_vtti_timestamp()[0], collection_initial.start_stop_vtti_timestamp()[1]))
-        target.write("\n")
-        target.write("Percent Time Vehicle in Car Following: {}%".format(collection_initial.percent_car_following()*100))
-        target.write("\n")
-        target.write("Number of Total Targets Identified: {}".format(len(collection_initial.list_of_target_ids())))
-        target.write("\n")
-        target.write("Number of Lead Targets Identified: {}".format(len(collection_initial.list_of_lead_targets())))
-        target.write("\n")
-        target.close()
-
-        if not os.path.isfile(os.path.join(summary_save_path,summary_file)):
-            target2 = open(os.path.join(summary_save_path,summary_file), 'a')
-            target2.write("Event Id,Run Time,Collection Length [min],No. Points,Distance Traveled [km],VTTI Start Timestamp,"
-                          "VTTI Stop Timestamp, Percent Time Vehicle Car Following,Number Total Targets Identified,"
-                          "Number Lead Targets Identified, Mean Speed, Maximum Deceleration, Percent Time Wipers Active")
-            target2.write("\n")
-        else:
-            target2 = open(os.path.join(summary_save_path,summary_file), 'a')
-        target2.write("{},{},{},{},{},{},{},{},{},{},{},{},{}".format(event_id,run_time,round(collection_initial.time_elapsed()/float(60),3),
-                     collection_initial.point_count(),round(collection_initial.dist_traveled(),3),collection_initial.start_stop_vtti_timestamp()[0],
-                     collection_initial.start_stop_vtti_timestamp()[1], collection_initial.percent_car_following()*100,
-                     len(collection_initial.list_of_target_ids()),len(collection_initial.list_of_lead_targets()),collection_initial.mean_speed(),
-                     collection_initial.max_deceleration(),collection_initial.percent_wipers_active()))
-        target2.write("\n")
-        target2.close()
+        lines = ["----------------------------------------------------------------------------",
+                 "Event ID: {} ---- Time: {}".format(event_id,run_time),
+                 "",
+                 "Collection Length: {} min".format(round(record['time_elapsed']/float(60)),3),
+                 "Number of Data Points: {}".format(record['point_count']),
+                 "Approximate Distance Traveled: {} km".format(round(record['dist_traveled']),3),
+                 "Trip VTTI Timestamps: {} to {}".format(start,stop),
+                 "Percent Time Vehicle in Car Following: {}%".format(record['percent_car_following']*100),
+                 "Number of Total Targets Identified: {}".format(record['target_count']),
+                 "Number of Lead Targets Identified: {}".format(record['lead_target_count'])]
+        # Shared by the trips of batch runs - appended under a lock file (see AppendFile)
+        append_to_file(os.path.join(summary_save_path,log_file),"\n".join(lines)+"\n")
+
+        header = ("Event Id,Run Time,Collection Length [min],No. Points,Distance Traveled [km],VTTI Start Timestamp,"
+                  "VTTI Stop Timestamp, Percent Time Vehicle Car Following,Number Total Targets Identified,"
+                  "Number Lead Targets Identified, Mean Speed, Maximum Deceleration, Percent Time Wipers Active\n")
+        line = "{},{},{},{},{},{},{},{},{},{},{},{},{}".format(event_id,run_time,round(record['time_elapsed']/float(60),3),
+               record['point_count'],round(record['dist_traveled'],3),start,stop,record['percent_car_following']*100,
+               record['target_count'],record['lead_target_count'],record['mean_speed'],
+               record['max_deceleration'],record['percent_wipers_active'])
+        append_to_file(os.path.join(summary_save_path,summary_file),line+"\n",header)
 
 
 def car_following_collection_summary(list_car_following_collections, run_time, min_cf_time, max_cf_dist,min_speed,summary_save_path = None, event_id = None, log_file = 'runtime_log.csv'):
     print "----------------------------------------------------------------------------"
     print "CF Instances Identified greater than {} seconds and less than {} meters: {}".format(min_cf_time,max_cf_dist,len(list_car_following_collections))
 
-    if summary_save_path is not None and event_id is not None:
-        target = open(os.path.join(summary_save_path,log_file), 'a')
-        target.write("----------------------------------------------------------------------------")
-        target.write("\n")
-        target.write("Event ID: {} ---- Time: {}".format(event_id,run_time))
-        target.write("\n")
-        target.write("\n")
-        target.write("CF Instances Identified greater than {} seconds and less than {} meters: {}".format(min_cf_time,max_cf_dist,len(list_car_following_collections)))
-        target.write("\n")
-
-        summary_file = '{}_cf_collections_summary.csv'.format(event_id)
-        target2 = open(os.path.join(summary_save_path,summary_file), 'w')
-        target2.write("Event ID: {}".format(event_id))
-        target2.write("\n")
-        target2.write("Run Time: {}".format(run_time))
-        target2.write("\n")
-        target2.write("Min Following Time: {}".format(min_cf_time))
-        target2.write("\n")
-        target2.write("Max Following Dist: {}".format(max_cf_dist))
-        target2.write("\n")
-        target2.write("\n")
-        target2.write("Instance No.,Length [sec],VTTI Start Timestamp, VTTI Stop Timestamp, Mean Speed [km/hr], Max Deceleration [m/s2], "
-                      "% Active Wipers, Mean Distance to Lead Target [m], Mean Headway to Lead Target [s], Lead Target ID No.")
-        target2.write("\n")
+    log_lines = ["----------------------------------------------------------------------------",
+                 "Event ID: {} ---- Time: {}".format(event_id,run_time),
+                 "",
+                 "CF Instances Identified greater than {} seconds and less than {} meters: {}".format(min_cf_time,max_cf_dist,len(list_car_following_collections))]
+    summary_lines = ["Event ID: {}".format(event_id),
+                     "Run Time: {}".format(run_time),
+                     "Min Following Time: {}".format(min_cf_time),
+                     "Max Following Dist: {}".format(max_cf_dist),
+                     "",
+                     "Instance No.,Length [sec],VTTI Start Timestamp, VTTI Stop Timestamp, Mean Speed [km/hr], Max Deceleration [m/s2], "
+                     "% Active Wipers, Mean Distance to Lead Target [m], Mean Headway to Lead Target [s], Lead Target ID No."]
 
     for i in range(len(list_car_following_collections)):
-        print "  Length of Instance {}: {} sec, {} - {}".format(i+1,list_car_following_collections[i].time_elapsed(),
-                                                        list_car_following_collections[i].start_stop_vtti_timestamp()[0],
-                                                        list_car_following_collections[i].start_stop_vtti_timestamp()[1])
-
-        if summary_save_path is not None and event_id is not None:
-            target.write(" ")
-            target.write("  Length of Instance {}: {} sec, {} - {}".format(i+1,list_car_following_collections[i].time_elapsed(),
-                                                        list_car_following_collections[i].start_stop_vtti_timestamp()[0],
-                                                        list_car_following_collections[i].start_stop_vtti_timestamp()[1]))
-            target.write("\n")
-
-
-            target2.write("{},{},{},{},{},{},{},{},{},{}".format(i+1,list_car_following_collections[i].time_elapsed(),
-                                                        list_car_following_collections[i].start_stop_vtti_timestamp()[0],
-                                                        list_car_following_collections[i].start_stop_vtti_timestamp()[1],
-                                                        list_car_following_collections[i].mean_speed(),
-                                                        list_car_following_collections[i].max_deceleration(),
-                                                        list_car_following_collections[i].percent_wipers_active(),
-                                                        list_car_following_collections[i].mean_dist_lead_target(),
-                                                        list_car_following_collections[i].mean_headway_lead_target(),
-                                                        list_car_following_collections[i].cf_instance_lead_target_id()))
-            target2.write("\n")
+        record = list_car_following_collections[i].summary_record()  # One pass over the instance
+        start, stop = record['start_stop_vtti_timestamp']
+        print "  Length of Instance {}: {} sec, {} - {}".format(i+1,record['time_elapsed'],start,stop)
+
+        log_lines.append(" "+"  Length of Instance {}: {} sec, {} - {}".format(i+1,record['time_elapsed'],start,stop))
+        summary_lines.append("{},{},{},{},{},{},{},{},{},{}".format(i+1,record['time_elapsed'],start,stop,
+                                                                   record['mean_speed'],record['max_deceleration'],
+                                                                   record['percent_wipers_active'],
+                                                                   record['mean_dist_lead_target'],
+                                                                   record['mean_headway_lead_target'],
+                                                                   record['cf_instance_lead_target_id']))
+
     if summary_save_path is not None and event_id is not None:
-        target.close()
+        append_to_file(os.path.join(summary_save_path,log_file),"\n".join(log_lines)+"\n")
+        target2 = open(os.path.join(summary_save_path,'{}_cf_collections_summary.csv'.format(event_id)), 'w')
+        target2.write("\n".join(summary_lines)+"\n")
         target2.close()
 
 
@@ -465,56 +817,263 @@ def car_following_collection_summary(list_car_following_collections, run_time, m
     # todo create two new arrays with the removed outliers and the remaining dV and dX so both can be plotted in the same plot and color coordinated
 
 
-def processed_data(list_car_following_collections, export_save_path = None, event_id = None,log_file = 'runtime_log.csv'):
+def processed_data(list_car_following_collections, export_save_path = None, event_id = None,log_file = 'runtime_log.csv',
+                   figures = None):
+    # figures: (optional) list collecting the figures for later rendering instead of saving them now (see save_figures)
     processed_data_list = list()
+    plots = list()
     for i in range(len(list_car_following_collections)):
         temp_processed_data = list_car_following_collections[i].generate_processed_data_class()
         temp_processed_data.moving_average(16)
 
         if export_save_path is not None and event_id is not None:
-            temp_fig = temp_processed_data.plot_t_dV_kalman()
-            temp_fig.savefig(os.path.join(export_save_path,'{}_{}_t-dV_filter'.format(event_id,i+1)))
-            temp_fig = temp_processed_data.plot_dV_X_kalman()
-            temp_fig.savefig(os.path.join(export_save_path,'{}_{}_X-dV_filter'.format(event_id,i+1)))
+            plots.append([temp_processed_data.plot_t_dV_kalman_spec(),
+                          os.path.join(export_save_path,'{}_{}_t-dV_filter'.format(event_id,i+1))])
+            plots.append([temp_processed_data.plot_dV_X_kalman_spec(),
+                          os.path.join(export_save_path,'{}_{}_X-dV_filter'.format(event_id,i+1))])
 
         temp_processed_data.replace_original()
         processed_data_list.append(temp_processed_data)  # List of Processed Data Classes
         if export_save_path is not None and event_id is not None:
-            temp_fig = temp_processed_data.plot_t_dV_original()
-            temp_fig.savefig(os.path.join(export_save_path,'{}_{}_t-dV_new'.format(event_id,i+1)))
-            temp_fig = temp_processed_data.plot_dV_X_original()
-            temp_fig.savefig(os.path.join(export_save_path,'{}_{}_X-dV_new'.format(event_id,i+1)))
+            plots.append([temp_processed_data.plot_t_dV_original_spec(),
+                          os.path.join(export_save_path,'{}_{}_t-dV_new'.format(event_id,i+1))])
+            plots.append([temp_processed_data.plot_dV_X_original_spec(),
+                          os.path.join(export_save_path,'{}_{}_X-dV_new'.format(event_id,i+1))])
 
     processed_data_combined = ProcessedData('list',processed_data_list)
 
     if export_save_path is not None and event_id is not None:
-        temp_fig = processed_data_combined.plot_dV_X_original()
-        temp_fig.savefig(os.path.join(export_save_path,'{}_{}_ALL_Events'.format(event_id,i+1)))
+        instance_count = len(list_car_following_collections)
+        plots.append([processed_data_combined.plot_dV_X_original_spec(),
+                      os.path.join(export_save_path,'{}_{}_ALL_Events'.format(event_id,instance_count))])
+        save_figures(plots,figures)
 
     return processed_data_combined
 
 
-def smooth_with_kalman_filter(processed_data_list, export_save_path = None, event_id = None, log_file = 'runtime_log.csv'):
+def process_trip(nds_file_name,nds_path,stac_file_name,stac_path,cache_path=None,columns=CF_PIPELINE_COLUMNS,
+                 min_cf_time=40,max_cf_dist=60,min_speed=1):
+    """
+    Import -> car following collections -> processed data for one trip (worker of batch_process_trips).
+    Only the processed values are returned, so no DataPoints have to be pickled between processes.
+    :param nds_file_name: NDS time series file name
+    :param nds_path: Location of the NDS file
+    :param stac_file_name: STAC file of the trip
+    :param stac_path: Location of the STAC file
+    :param cache_path: (optional) Folder for the on-disk cache of parsed files (see load_cached_array)
+    :param columns: NDS column projection (see import_wy_nds)
+    :param min_cf_time: see generate_car_following_collections
+    :param max_cf_dist: see generate_car_following_collections
+    :param min_speed: see generate_car_following_collections
+    :return: [2D float array - one row per point, columns in PROCESSED_DATA_VARIABLES order, CF instance offsets
+    (see ProcessedData.offsets)]
+    """
+    collection = import_wy_nds_stac(nds_file_name,nds_path,stac_file_name,stac_path,cache_path,columns)
+    list_of_collections = generate_car_following_collections(collection,min_cf_time,max_cf_dist,min_speed)
+    processed_data_combined = processed_data(list_of_collections)
+
+    return [processed_data_combined.matrix(),processed_data_combined.offsets]
+
+
+def trip_jobs(trip_numbers,nds_path,stac_path,*arguments):
+    """
+    :param trip_numbers: Trips as returned by import_trip_ids - rows of [event id, STAC file name]; the NDS file of
+    each trip is Event_ID_<event id>.csv (see check_files_exist)
+    :param nds_path: Location of the NDS files
+    :param stac_path: Location of the STAC files
+    :param arguments: Further arguments of the worker function, the same for every trip
+    :return: List of [event id, worker function arguments] - one per trip
+    """
+    jobs = list()
+    for i in range(len(trip_numbers)):
+        if len(trip_numbers[i]) < 2 or trip_numbers[i][1] == '':
+            raise ValueError('No STAC file given for Event_ID_{}'.format(trip_numbers[i][0]))
+        jobs.append([trip_numbers[i][0],('Event_ID_{}.csv'.format(trip_numbers[i][0]),nds_path,trip_numbers[i][1],
+                                         stac_path) + arguments])
+    return jobs
+
+
+def map_jobs(function,jobs,processes=None,max_in_flight=None):
+    """
+    Runs a worker function for each job on a pool of worker processes. Results are yielded in job order and at most
+    max_in_flight jobs are submitted but not yet yielded, so memory stays bounded for long job lists.
+    :param function: Module level worker function (e.g. process_trip)
+    :param jobs: List of [job id, worker function arguments] (e.g. trip_jobs)
+    :param processes: Number of worker processes (default: number of CPUs); 1 runs the jobs in this process
+    :param max_in_flight: Maximum number of outstanding jobs (default: twice the number of processes)
+    :return: Yields (job id, worker function result) for each job
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes == 1:
+        for i in range(len(jobs)):
+            yield jobs[i][0], function(*jobs[i][1])
+        return
+    if max_in_flight is None:
+        max_in_flight = 2*processes
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        in_flight = deque()  # [job id, AsyncResult] in submission order
+        for i in range(len(jobs)):
+            if len(in_flight) >= max_in_flight:
+                job_id, result = in_flight.popleft()
+                yield job_id, result.get()
+            in_flight.append([jobs[i][0],pool.apply_async(function,jobs[i][1])])
+        while len(in_flight) > 0:
+            job_id, result = in_flight.popleft()
+            yield job_id, result.get()
+        pool.close()
+    finally:
+        pool.terminate()  # Also stops outstanding jobs if the caller stops iterating early
+        pool.join()
+
+
+def batch_process_trips(trip_numbers,nds_path,stac_path=None,processes=None,max_in_flight=None,cache_path=None,
+                        columns=CF_PIPELINE_COLUMNS,min_cf_time=40,max_cf_dist=60,min_speed=1):
+    """
+    Processes a list of trips on a pool of worker processes (see process_trip and map_jobs).
+    :param trip_numbers: Trips as returned by import_trip_ids (see trip_jobs)
+    :param nds_path: Location of the NDS files
+    :param stac_path: Location of the STAC files (default: nds_path)
+    :param processes: see map_jobs
+    :param max_in_flight: see map_jobs
+    :param cache_path: (optional) Folder for the on-disk cache of parsed files, shared by the workers
+    :param columns: NDS column projection (see import_wy_nds)
+    :param min_cf_time: see generate_car_following_collections
+    :param max_cf_dist: see generate_car_following_collections
+    :param min_speed: see generate_car_following_collections
+    :return: Yields (event id, ProcessedData) for each trip
+    """
+    if stac_path is None:
+        stac_path = nds_path
+    jobs = trip_jobs(trip_numbers,nds_path,stac_path,cache_path,columns,min_cf_time,max_cf_dist,min_speed)
+    for event_id, [data, offsets] in map_jobs(process_trip,jobs,processes,max_in_flight):
+        yield event_id, ProcessedData('columns',[np.asarray(data).T,offsets])
+
+
+def summarize_trip(nds_file_name,nds_path,stac_file_name,stac_path,cache_path=None,variables=None,sketch_size=2000,
+                   block_size=10000):
+    """
+    Summary accumulator of one trip (worker of fleet_summary) - only the accumulator is returned, so no points have
+    to be pickled between processes.
+    The summary values only use NDS columns, so the trip is summarized one block of rows at a time (see iter_wy_nds)
+    without holding the whole trip in memory. The whole trip is imported if a variable is a STAC column (aligned to
+    the trip's time stamps) or if cache_path is given (the cached trip is memory mapped).
+    :param nds_file_name: NDS time series file name
+    :param nds_path: Location of the NDS file
+    :param stac_file_name: STAC file of the trip
+    :param stac_path: Location of the STAC file
+    :param cache_path: (optional) Folder for the on-disk cache of parsed files (see load_cached_array)
+    :param variables: see SummaryAccumulator
+    :param sketch_size: see StreamingStatistics
+    :param block_size: Number of rows summarized at a time
+    :return: SummaryAccumulator
+    """
+    summary = SummaryAccumulator(variables,sketch_size)
+    columns = CF_PIPELINE_COLUMNS + list(summary.variables)
+    stac_variables = [variable for variable in summary.variables if variable in STAC_COLUMN_NAMES]
+    if cache_path is not None or len(stac_variables) > 0:
+        summary.update(import_wy_nds_stac(nds_file_name,nds_path,stac_file_name,stac_path,cache_path,columns))
+        return summary
+    for block in iter_wy_nds(nds_file_name,nds_path,block_size,columns):
+        summary.update(block)
+    return summary
+
+
+def fleet_summary(trip_numbers,nds_path,stac_path=None,variables=None,processes=None,max_in_flight=None,
+                  cache_path=None,sketch_size=2000):
+    """
+    Summary of a list of trips - each trip is summarized by a worker process (see summarize_trip) and the trip
+    accumulators are merged, so the trips are never concatenated.
+    :param trip_numbers: Trips as returned by import_trip_ids (see trip_jobs)
+    :param nds_path: Location of the NDS files
+    :param stac_path: Location of the STAC files (default: nds_path)
+    :param variables: see SummaryAccumulator
+    :param processes: see map_jobs
+    :param max_in_flight: see map_jobs
+    :param cache_path: (optional) Folder for the on-disk cache of parsed files, shared by the workers
+    :param sketch_size: see StreamingStatistics
+    :return: SummaryAccumulator of all trips
+    """
+    if stac_path is None:
+        stac_path = nds_path
+    summary = SummaryAccumulator(variables,sketch_size)
+    jobs = trip_jobs(trip_numbers,nds_path,stac_path,cache_path,summary.variables,sketch_size)
+    for event_id, trip_summary in map_jobs(summarize_trip,jobs,processes,max_in_flight):
+        summary.merge(trip_summary)
+    return summary
+
+
+def smooth_with_kalman_filter(processed_data_list, export_save_path = None, event_id = None, log_file = 'runtime_log.csv',
+                              process_variance = .0001, estimated_measurement_variance = .01, figures = None):
     # todo - generate plots, .csv file with dV dX updated
+    # figures: (optional) list collecting the figures for later rendering instead of saving them now (see save_figures)
+    # All datasets filtered in one batch (see kalman_smooth) - relative velocity values after the first of each dataset
+    dV = [np.asarray(processed_data_list[i].dV,dtype=float)[1:] for i in range(len(processed_data_list))]
+    offsets = np.concatenate(([0],np.cumsum([len(values) for values in dV]))).astype(int)
+    dV_update = kalman_smooth(np.concatenate(dV+[np.empty(0)]),offsets,process_variance,estimated_measurement_variance)
+
     kalman_processed_data_list = list()
-    for i in range(len(processed_data_list)):
-        dataset = processed_data_list[i]
-        dataset.kalman_filter(process_variance=.0001, estimated_measurement_variance=.01)
-        if export_save_path is not None and event_id is not None:
-            # Save Updated Data Output
-            dataset.update_export('{}_{}_updated_output.csv'.format(event_id,i+1),export_save_path)
-            # Save Plots
-            temp = dataset.plot_t_v_target_kalman()
-            temp.savefig(os.path.join(export_save_path,'{}_{}_plot_t_target_v_kalman'.format(event_id,i+1)))
-            temp = dataset.plot_dV_X_kalman()
-            temp.savefig(os.path.join(export_save_path,'{}_{}_plot_dV_X_kalman'.format(event_id,i+1)))
-            temp = dataset.plot_t_dV_kalman()
-            temp.savefig(os.path.join(export_save_path,'{}_{}_plot_t_dV_kalman'.format(event_id,i+1)))
-
-        kalman_processed_data_list.append(dataset)
+    plots = list()
+    combined = None
+    if export_save_path is not None and event_id is not None:
+        # Rows of all datasets appended to the combined export in large blocks (see AppendFile)
+        combined = AppendFile(os.path.join(export_save_path,'00-updated_exports_combined.csv'))
+    try:
+        for i in range(len(processed_data_list)):
+            dataset = processed_data_list[i]
+            dataset.kalman_update(dV_update[offsets[i]:offsets[i+1]])
+            if export_save_path is not None and event_id is not None:
+                # Save Updated Data Output
+                dataset.update_export('{}_{}_updated_output.csv'.format(event_id,i+1),export_save_path,combined)
+                # Save Plots
+                plots.append([dataset.plot_t_v_target_kalman_spec(),
+                              os.path.join(export_save_path,'{}_{}_plot_t_target_v_kalman'.format(event_id,i+1))])
+                plots.append([dataset.plot_dV_X_kalman_spec(),
+                              os.path.join(export_save_path,'{}_{}_plot_dV_X_kalman'.format(event_id,i+1))])
+                plots.append([dataset.plot_t_dV_kalman_spec(),
+                              os.path.join(export_save_path,'{}_{}_plot_t_dV_kalman'.format(event_id,i+1))])
+
+            kalman_processed_data_list.append(dataset)
+    finally:
+        if combined is not None:
+            combined.close()  # Buffered rows also written if a dataset fails
+    save_figures(plots,figures)
     return kalman_processed_data_list
 
 
+def save_figures(plots,figures=None):
+    """
+    :param plots: List of [figure specification (see plot_spec), file path]
+    :param figures: (optional) List collecting figures for render_figures - the plots are added instead of saved
+    """
+    if figures is not None:
+        figures.extend(plots)
+        return
+    for i in range(len(plots)):
+        save_plot(plots[i][0],plots[i][1])
+
+
+def render_figure(spec,file_path):
+    # Worker of render_figures
+    save_plot(spec,file_path)
+    return file_path
+
+
+def render_figures(figures,processes=None,max_in_flight=None):
+    """
+    Renders figures collected during processing (see save_figures) on a pool of worker processes - not calling this
+    function skips rendering altogether.
+    :param figures: List of [figure specification, file path]
+    :param processes: see map_jobs - 1 renders in this process
+    :param max_in_flight: see map_jobs
+    :return: List of the saved file paths
+    """
+    jobs = [[figures[i][1],(figures[i][0],figures[i][1])] for i in range(len(figures))]
+    return [file_path for file_path, result in map_jobs(render_figure,jobs,processes,max_in_flight)]
+
+
 """
 FHWA Driver (CF) Model Genetic Algorithm
 """
@@ -0,0 +1,625 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import warnings
+import multiprocessing
+import numpy as np
+from classes import *
+
+"""
+Regression tests of the class definitions.
+Run with: python -m unittest discover
+"""
+
+
+def append_rows(arguments):
+    # Worker of AppendFileTest - appends numbered rows in small blocks
+    file_path, writer = arguments
+    target = AppendFile(file_path,header='header\n',block_size=500)
+    for i in range(500):
+        target.write('{},{},{}\n'.format(writer,i,'x'*20))
+    target.close()
+
+
+class AppendFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.path,'combined.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_concurrent_writers(self):
+        pool = multiprocessing.Pool(4)
+        pool.map(append_rows,[(self.file_path,writer) for writer in range(8)])
+        pool.close()
+        pool.join()
+        lines = open(self.file_path).read().splitlines()
+        self.assertEqual(lines[0],'header')
+        self.assertEqual(lines.count('header'),1)
+        rows = sorted([tuple(map(int,line.split(',')[:2])) for line in lines[1:]])
+        self.assertEqual(rows,[(writer,i) for writer in range(8) for i in range(500)])
+        self.assertFalse(os.path.exists(self.file_path + '.lock'))
+
+    def test_rows_written_on_exception(self):
+        try:
+            with AppendFile(self.file_path) as target:
+                target.write('1,2\n')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(open(self.file_path).read(),'1,2\n')
+
+    def test_stale_lock_broken(self):
+        lock_path = self.file_path + '.lock'
+        open(lock_path,'w').write('0 stale')
+        os.utime(lock_path,(time.time()-120,time.time()-120))
+        append_to_file(self.file_path,'row\n')
+        self.assertEqual(open(self.file_path).read(),'row\n')
+        self.assertFalse(os.path.exists(lock_path))
+
+    def test_release_keeps_lock_of_other_owner(self):
+        lock = FileLock(self.file_path + '.lock')
+        lock.acquire()
+        open(lock.lock_path,'w').write('1 other')  # Lock taken over by another process
+        lock.release()
+        self.assertEqual(open(lock.lock_path).read(),'1 other')
+
+    def test_break_puts_back_lock_of_other_owner(self):
+        lock = FileLock(self.file_path + '.lock')
+        open(lock.lock_path,'w').write('1 fresh')  # Taken over since it was found stale with token '0 stale'
+        lock._break('0 stale','2 waiter')
+        self.assertEqual(open(lock.lock_path).read(),'1 fresh')
+        self.assertEqual(os.listdir(self.path),['combined.csv.lock'])
+
+    def test_break_keeps_lock_created_meanwhile(self):
+        lock = FileLock(self.file_path + '.lock')
+        read_token = lock._read_token
+        def create_lock(path):
+            open(lock.lock_path,'w').write('3 new')  # Created by a third process once the lock was moved aside
+            return read_token(path)
+        lock._read_token = create_lock
+        open(lock.lock_path,'w').write('1 fresh')
+        lock._break('0 stale','2 waiter')
+        self.assertEqual(open(lock.lock_path).read(),'3 new')
+        self.assertEqual(os.listdir(self.path),['combined.csv.lock'])
+
+
+def nds_collection(point_count,seed=0):
+    # Synthetic trip - columnar collection of random NDS rows and STAC velocities with 'nan' target ids
+    random = np.random.RandomState(seed)
+    rows = random.rand(point_count,len(NDS_COLUMN_NAMES))*50
+    rows[:,NDS_COLUMN_INDEX['system_time_stamp']] = np.arange(point_count)  # Row number
+    rows[:,NDS_COLUMN_INDEX['vtti_time_stamp']] = np.arange(point_count)*100
+    for track in range(1,9):
+        target_ids = random.randint(1,6,point_count).astype(float)
+        target_ids[random.rand(point_count) < 0.4] = np.nan
+        rows[:,NDS_COLUMN_INDEX['track{}_target_id'.format(track)]] = target_ids
+        rows[:,NDS_COLUMN_INDEX['track{}_is_lead_vehicle'.format(track)]] = random.rand(point_count) < 0.2
+    collection = PointCollection(rows)
+    for name in STAC_COLUMN_NAMES:
+        velocities = random.randn(point_count)
+        velocities[random.rand(point_count) < 0.1] = np.nan
+        collection.set_column(name,velocities)
+    return collection
+
+
+class LeadTargetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.columnar = nds_collection(300)
+        self.points = [self.columnar[i] for i in range(300)]
+
+    def assert_matches_points(self,collection):
+        points = self.points
+        lead_tracks = [points[i].lead_track() for i in range(len(points))]
+        np.testing.assert_array_equal(collection.lead_track_index(),
+                                      [-1 if track is None else track-1 for track in lead_tracks])
+        np.testing.assert_array_equal(collection.lead_target_ids(),
+                                      [np.nan if point.lead_target_id() is None else point.lead_target_id()
+                                       for point in points])
+        np.testing.assert_array_equal(collection.lead_target_dists(),[point.lead_target_dist() for point in points])
+        np.testing.assert_array_equal(collection.series('dV'),
+                                      [points[i].lead_relative_velocity() for i in range(1,len(points))])
+
+    def test_vectorized_matches_data_points(self):
+        self.assert_matches_points(self.columnar)
+        self.assert_matches_points(PointCollection(self.points))
+        self.assert_matches_points(self.columnar.select(np.arange(300)[::-1][::-1]))  # Index view
+
+    def test_relative_velocity_of_first_lead_flag(self):
+        # Track 1 is flagged as lead with a 'nan' target id - the relative velocity is still read from it, while the
+        # lead target (distance, id) is track 3
+        collection = nds_collection(3)
+        for track in range(1,9):
+            collection.set_column('track{}_is_lead_vehicle'.format(track),0)
+            collection.set_column('track{}_x_vel_processed'.format(track),track)
+        collection.set_column('track1_target_id',[np.nan,np.nan,np.nan])
+        collection.set_column('track1_is_lead_vehicle',[1,1,1])
+        collection.set_column('track3_target_id',[4,4,np.nan])
+        collection.set_column('track3_is_lead_vehicle',[1,1,1])
+        self.assertEqual(collection[1].lead_track(),3)
+        self.assertEqual(collection[1].lead_relative_velocity(),1)
+        self.assertEqual(collection[2].lead_relative_velocity(),np.NINF)  # No lead vehicle
+        np.testing.assert_array_equal(collection.lead_track_index(),[2,2,-1])
+        np.testing.assert_array_equal(collection.series('dV'),[1,np.NINF])
+
+
+class TargetOccurrencesTest(unittest.TestCase):
+
+    def assert_occurrences(self,collection):
+        # Reference - the original per point scans (targets in order of first appearance) and loop counts
+        points = [collection[i] for i in range(collection.point_count())]
+        for lead in [False,True]:
+            detections = list()  # (row, target id) in point and track order
+            for i in range(len(points)):
+                if lead is True:
+                    if points[i].lead_target_id() is not None:
+                        detections.append((i,points[i].lead_target_id()))
+                else:
+                    detections.extend([(i,target) for target in points[i].current_targets()])
+            ids = list()
+            for row, target in detections:
+                if target not in ids:
+                    ids.append(target)
+            occurrences = collection.target_occurrences(lead)
+            self.assertEqual(occurrences[0].tolist(),ids)
+            detected_ids = [detected_id for row, detected_id in detections]
+            self.assertEqual(occurrences[1].tolist(),[detected_ids.count(target) for target in ids])
+            self.assertEqual(occurrences[2].tolist(),[min([row for row, t in detections if t == target])
+                                                      for target in ids])
+            self.assertEqual(occurrences[3].tolist(),[max([row for row, t in detections if t == target])
+                                                      for target in ids])
+            target_index = occurrences[4]
+            if lead is True:
+                indexed = [(i,ids[target_index[i]]) for i in np.flatnonzero(target_index >= 0)]
+            else:
+                indexed = [(i,ids[target_index[i,j]]) for i, j in zip(*np.nonzero(target_index >= 0))]
+            self.assertEqual(indexed,detections)
+        self.assertEqual(collection.list_of_target_ids(),collection.target_occurrences()[0].tolist())
+        self.assertEqual(collection.list_of_lead_targets(),collection.target_occurrences(True)[0].tolist())
+
+    def test_matches_point_scan(self):
+        trip = nds_collection(300)
+        self.assert_occurrences(trip)
+        self.assert_occurrences(PointCollection([trip[i] for i in range(300)]))
+        self.assert_occurrences(trip.select(np.arange(299,-1,-2)))
+
+    def test_fractional_ids(self):
+        # Target ids are truncated to integers, as int() in the point methods
+        trip = nds_collection(50)
+        trip.set_column('track1_target_id',np.arange(50)/10.+2)
+        self.assert_occurrences(trip)
+        self.assertTrue(set(range(2,7)) <= set(trip.list_of_target_ids()))
+
+    def test_no_targets(self):
+        trip = nds_collection(20)
+        for track in range(1,9):
+            trip.set_column('track{}_target_id'.format(track),np.nan)
+        self.assert_occurrences(trip)
+        self.assertEqual(trip.list_of_target_ids(),[])
+        self.assertEqual(trip.list_of_lead_targets(),[])
+
+
+class TimestampRangesTest(unittest.TestCase):
+
+    def assert_ranges(self,collection,starts,stops):
+        # Reference - the points of each range in collection order, as the original point by point scan
+        time_stamps = collection.column('vtti_time_stamp')
+        row_numbers = collection.column('system_time_stamp')
+        ranges = collection.timestamp_ranges(starts,stops)
+        self.assertEqual(len(ranges),len(starts))
+        for i in range(len(starts)):
+            with np.errstate(invalid='ignore'):
+                expected = row_numbers[(time_stamps >= starts[i]) & (time_stamps <= stops[i])]
+            np.testing.assert_array_equal(ranges[i].column('system_time_stamp'),expected)
+            np.testing.assert_array_equal(collection.timestamp_range(starts[i],stops[i]).column('system_time_stamp'),
+                                          expected)
+
+    def setUp(self):
+        random = np.random.RandomState(5)
+        self.starts = np.concatenate(([-100,0,150,19900,20000,500],random.randint(-500,20500,30)))
+        self.stops = np.concatenate(([-1,0,1500,19900,30000,400],self.starts[6:]+random.randint(0,3000,30)))
+
+    def test_time_order(self):
+        collection = nds_collection(200)
+        self.assert_ranges(collection,self.starts,self.stops)
+        view = collection.timestamp_range(1000,2000)
+        self.assertTrue(view.data_matrix.base is collection.data_matrix.base)  # Slice of the trip - no copy
+        self.assertEqual(collection.timestamp_ranges([],[]),[])
+
+    def test_out_of_order_and_nan(self):
+        random = np.random.RandomState(6)
+        collection = nds_collection(200).select(random.permutation(200))
+        time_stamps = collection.column('vtti_time_stamp')
+        time_stamps[random.rand(200) < 0.1] = np.nan
+        time_stamps[10:20] = 1500  # Repeated time stamps
+        collection.set_column('vtti_time_stamp',time_stamps)
+        self.assert_ranges(collection,self.starts,self.stops)
+        self.assert_ranges(PointCollection([collection[i] for i in range(200)]),self.starts,self.stops)
+
+    def test_rebuilt_after_append(self):
+        collection = nds_collection(200)
+        self.assert_ranges(collection,self.starts,self.stops)
+        collection.block_append(collection.data_matrix[:50,:len(NDS_COLUMN_NAMES)])  # Time stamps 0-4900 again
+        self.assertEqual(collection.point_count(),250)
+        self.assert_ranges(collection,self.starts,self.stops)
+
+
+class DerivedValuesCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trip = nds_collection(120)
+        self.points = [self.trip[i] for i in range(120)]
+
+    def assert_current(self,collection,points):
+        # Derived values equal those of a new collection of the same points
+        fresh = PointCollection(list(points))
+        for name in ['v_following','dV','v_target','dX','dT','dT_vtti','a_target','a_following']:
+            np.testing.assert_array_equal(collection.series(name),fresh.series(name))
+        np.testing.assert_array_equal(collection.lead_track_index(),fresh.lead_track_index())
+        np.testing.assert_array_equal(collection.timestamp_index()[0],fresh.timestamp_index()[0])
+        self.assertEqual(collection.summary_record(),fresh.summary_record())
+
+    def test_cached_until_changed(self):
+        dV = self.trip.series('dV')
+        self.assertTrue(self.trip.series('dV') is dV)
+        self.assertFalse(dV.flags.writeable)
+        np.testing.assert_array_equal(self.trip.dV(),dV)
+        self.trip.set_column('track1_x_vel_processed',np.zeros(120))
+        self.assertFalse(self.trip.series('dV') is dV)
+        self.assert_current(self.trip,[self.trip[i] for i in range(120)])
+
+    def test_point_append(self):
+        columnar = PointCollection()
+        columnar.adopt_matrix(np.array(self.trip.data_matrix[:60]))
+        for collection in [PointCollection(self.points[:60]),columnar]:
+            self.assert_current(collection,self.points[:60])
+            collection.point_append(self.points[60])
+            self.assert_current(collection,self.points[:61])
+            collection.point_append(self.points[61:100])
+            self.assert_current(collection,self.points[:100])
+
+    def test_block_append(self):
+        collection = PointCollection()
+        collection.block_append(self.trip.data_matrix[:60,:len(NDS_COLUMN_NAMES)])
+        self.assert_current(collection,[collection[i] for i in range(60)])
+        collection.block_append(self.trip.data_matrix[60:,:len(NDS_COLUMN_NAMES)])
+        self.assertEqual(collection.point_count(),120)
+        self.assert_current(collection,[collection[i] for i in range(120)])
+
+    def test_shared_rows(self):
+        # A change through a view of the trip drops the cached values of the trip, and the reverse
+        view = self.trip.select(np.arange(0,120,3))
+        dV = self.trip.series('dV')
+        view_dV = view.series('dV')
+        view.set_column('track2_x_vel_processed',np.arange(40.))
+        self.assertFalse(self.trip.series('dV') is dV)
+        self.assert_current(self.trip,[self.trip[i] for i in range(120)])
+        self.trip.set_column('track3_x_vel_processed',np.arange(120.))
+        self.assertFalse(view.series('dV') is view_dV)
+        self.assert_current(view,[view[i] for i in range(40)])
+
+        # Once appended to, the view has its own rows - the trip's cached values are kept
+        dV = self.trip.series('dV')
+        view.point_append(self.points[0])
+        view.set_column('track2_x_vel_processed',np.zeros(41))
+        self.assertTrue(self.trip.series('dV') is dV)
+        self.assert_current(view,[view[i] for i in range(41)])
+
+
+class SummaryRecordTest(unittest.TestCase):
+
+    def assert_record(self,collection):
+        # The record equals the values of the separate summary methods
+        expected = {'point_count': collection.point_count(), 'time_elapsed': collection.time_elapsed(),
+                    'dist_traveled': collection.dist_traveled(),
+                    'start_stop_vtti_timestamp': collection.start_stop_vtti_timestamp(),
+                    'percent_car_following': collection.percent_car_following(),
+                    'target_count': len(collection.list_of_target_ids()),
+                    'lead_target_count': len(collection.list_of_lead_targets()),
+                    'mean_speed': collection.mean_speed(), 'max_deceleration': collection.max_deceleration(),
+                    'percent_wipers_active': collection.percent_wipers_active(),
+                    'mean_dist_lead_target': collection.mean_dist_lead_target(),
+                    'mean_headway_lead_target': collection.mean_headway_lead_target(),
+                    'cf_instance_lead_target_id': collection.cf_instance_lead_target_id()}
+        record = collection.summary_record()
+        self.assertEqual(sorted(record.keys()),sorted(expected.keys()))
+        for key in expected:
+            if isinstance(expected[key],float) and np.isnan(expected[key]):
+                self.assertTrue(np.isnan(record[key]),key)
+            else:
+                self.assertEqual(record[key],expected[key],key)
+        return record
+
+    def setUp(self):
+        self.trip = nds_collection(300)
+        random = np.random.RandomState(7)
+        self.trip.set_column('vtti_wiper',random.randint(0,5,300))
+        speed = self.trip.column('vtti_speed_network')
+        speed[::13] = np.nan
+        self.trip.set_column('vtti_speed_network',speed)
+
+    def set_single_lead(self,collection,target_id):
+        for track in range(1,9):
+            collection.set_column('track{}_is_lead_vehicle'.format(track),0)
+        collection.set_column('track2_target_id',target_id)
+        collection.set_column('track2_is_lead_vehicle',1)
+
+    def test_trip(self):
+        record = self.assert_record(self.trip)
+        self.assertEqual(record['cf_instance_lead_target_id'],False)
+        self.assert_record(PointCollection([self.trip[i] for i in range(300)]))
+
+    def test_instances(self):
+        instance = self.trip.select(np.arange(40,100))
+        self.set_single_lead(instance,np.ones(60)*7)
+        self.assertEqual(self.assert_record(instance)['cf_instance_lead_target_id'],7)
+        ids = np.ones(60)*7
+        ids[30] = np.nan  # One point without a lead vehicle
+        self.set_single_lead(instance,ids)
+        self.assertEqual(self.assert_record(instance)['cf_instance_lead_target_id'],False)
+        self.set_single_lead(instance,np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # Headway of no lead target - 'nan'
+            record = self.assert_record(instance)
+        self.assertEqual(record['cf_instance_lead_target_id'],None)
+        self.assertEqual(record['mean_dist_lead_target'],np.inf)
+
+    def test_returns_a_copy(self):
+        record = self.trip.summary_record()
+        record['point_count'] = 0
+        self.assertEqual(self.trip.summary_record()['point_count'],300)
+
+
+def baseline_mad_outliers(values,window,mad_count,rolling):
+    # Reference of mad_outliers - one window at a time
+    from statsmodels import robust
+    values = np.asarray(values,dtype=float)
+    window = max(1,min(window,len(values)))
+    outliers = np.zeros(len(values),dtype=bool)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with np.errstate(invalid='ignore'):
+            for i in range(len(values)):
+                if rolling is False:
+                    start = i//window*window
+                else:
+                    start = min(max(i-window//2,0),len(values)-window)
+                values_window = values[start:start+window]
+                median = np.median(values_window)
+                outliers[i] = abs(values[i]-median) >= mad_count*robust.mad(values_window)
+    return outliers
+
+
+class MadOutliersTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.values = random.randn(1003)
+        self.values[random.rand(1003) < 0.03] *= 20
+        self.values[[7,500]] = np.nan
+
+    def assert_matches_baseline(self,values,window,mad_count=3):
+        for rolling in [False,True]:
+            np.testing.assert_array_equal(mad_outliers(values,window,mad_count,rolling,chunk_size=64),
+                                          baseline_mad_outliers(values,window,mad_count,rolling))
+
+    def test_matches_baseline(self):
+        for window in [1,2,10,33,200]:
+            self.assert_matches_baseline(self.values[100:400],window)  # No 'nan' values
+            self.assert_matches_baseline(self.values,window)  # Ragged last window, 'nan' windows
+
+    def test_window_longer_than_values(self):
+        self.assert_matches_baseline(self.values[10:60],200)
+        self.assertEqual(len(mad_outliers([],200)),0)
+        self.assertEqual(len(mad_outliers([],200,rolling=True)),0)
+
+    def test_flags_outliers(self):
+        values = np.sin(np.arange(400)/10.)
+        values[[50,300]] = 100
+        for rolling in [False,True]:
+            np.testing.assert_array_equal(np.flatnonzero(mad_outliers(values,100,5,rolling)),[50,300])
+
+    def test_outlier_separation_layers(self):
+        collection = nds_collection(500)
+        with np.errstate(invalid='ignore'):
+            spec = collection.outlier_separation_spec(3,5)
+        kept, outliers = spec['layers']
+        self.assertEqual(spec['title'],'Lead Vehicle Velocity Outliers')
+        self.assertEqual([kept[3],outliers[3]],['b','r'])
+        self.assertEqual(len(kept[1])+len(outliers[1]),499)
+
+
+def baseline_kalman(measurements,process_variance=.0001,measurement_variance=.01):
+    # Reference of kalman_smooth - step by step scalar recursion of one series
+    posteri_estimate = 0.0
+    posteri_error_estimate = 1.0
+    estimates = list()
+    for measurement in measurements:
+        priori_estimate = posteri_estimate
+        priori_error_estimate = posteri_error_estimate + process_variance
+        blending_factor = priori_error_estimate / (priori_error_estimate + measurement_variance)
+        posteri_estimate = priori_estimate + blending_factor * (measurement - priori_estimate)
+        posteri_error_estimate = (1 - blending_factor) * priori_error_estimate
+        estimates.append(posteri_estimate)
+    return estimates
+
+
+class KalmanSmoothTest(unittest.TestCase):
+
+    def assert_matches_baseline(self,values,offsets,process_variance=.0001,measurement_variance=.01):
+        with np.errstate(invalid='ignore'):
+            estimates = kalman_smooth(values,offsets,process_variance,measurement_variance)
+            for i in range(len(offsets)-1):
+                series = values[offsets[i]:offsets[i+1]]
+                np.testing.assert_allclose(estimates[offsets[i]:offsets[i+1]],
+                                           baseline_kalman(series,process_variance,measurement_variance),
+                                           rtol=1e-10,atol=1e-10)
+
+    def test_ragged_series(self):
+        random = np.random.RandomState(0)
+        gain_count = len(kalman_gains(10**6,.0001,.01)[0])  # Transient steps
+        lengths = [0,1,2,gain_count-1,gain_count,gain_count+1,3*gain_count,0,1000,5]
+        values = random.randn(sum(lengths))*5+20
+        offsets = np.concatenate(([0],np.cumsum(lengths)))
+        self.assert_matches_baseline(values,offsets)
+        self.assert_matches_baseline(values,offsets,.01,.5)  # Short transient
+        self.assert_matches_baseline(values,[0,len(values)])
+
+    def test_non_finite_values(self):
+        random = np.random.RandomState(1)
+        gain_count = len(kalman_gains(10**6,.0001,.01)[0])
+        lengths = [50,gain_count+50,gain_count+50,gain_count+50,300]
+        values = random.randn(sum(lengths))
+        offsets = np.concatenate(([0],np.cumsum(lengths)))
+        values[offsets[0]+10] = np.nan  # Transient step
+        values[offsets[1]+gain_count+5] = np.inf  # Steady state
+        values[offsets[2]+gain_count+5] = -np.inf
+        values[offsets[3]+gain_count] = np.nan  # First steady state step
+        self.assert_matches_baseline(values,offsets)
+        self.assertTrue(np.isnan(kalman_smooth(values,offsets)[offsets[1]+gain_count+6:offsets[2]]).all())
+
+    def test_empty(self):
+        self.assertEqual(len(kalman_smooth([],[0])),0)
+        self.assertEqual(len(kalman_smooth([],[0,0,0])),0)
+
+
+def baseline_moving_average(values,window,mode):
+    # Reference of moving_average - window sums one point at a time
+    half = window//2
+    average = list()
+    for i in range(len(values)):
+        if mode == 'trailing':
+            low, high = i-window+1, i+1
+        else:
+            low, high = i-half+1, i+window-half+1
+        if mode == 'edge':
+            low, high = max(low,0), min(high,len(values))
+        elif low < 0 or high > len(values) or (mode == 'centered' and i < half):
+            average.append(np.nan)
+            continue
+        window_values = [value for value in values[low:high] if np.isnan(value) == False]
+        with np.errstate(invalid='ignore'):
+            total = np.sum(window_values)
+        if len(window_values) == 0 or np.isnan(total):
+            average.append(average[-1] if len(average) > 0 else np.nan)  # Previous average
+        else:
+            average.append(total/len(window_values))
+    return average
+
+
+def baseline_centered_average(X,resolution):
+    # Reference of ProcessedData.moving_average - the replaced loop (windows with values only)
+    Y = [np.nan for i in range(len(X)-resolution/2)]
+    for i in range(resolution/2, len(X)-resolution/2):
+        Y[i] = 0
+        counter = 0
+        for j in range(-resolution/2,resolution/2):
+            if np.isnan(X[i-j]) == False:
+                Y[i] = Y[i]+X[i-j]
+                counter += 1
+        Y[i] = Y[i]/counter
+    return Y
+
+
+class MovingAverageTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.values = random.randn(300)*3+10
+        self.values[random.rand(300) < 0.1] = np.nan
+        self.values[100:110] = np.nan  # Windows without values
+        self.values[[150,200,203]] = [np.inf,np.inf,-np.inf]
+
+    def test_matches_baseline(self):
+        for mode in ['centered','trailing','edge']:
+            for window in [1,2,5,8,31]:
+                for values in [self.values,self.values[:20],self.values[:3],self.values[:0]]:
+                    np.testing.assert_allclose(moving_average(values,window,mode),
+                                               baseline_moving_average(values,window,mode),rtol=1e-10,atol=1e-10)
+
+    def test_window_longer_than_values(self):
+        values = self.values[:20]
+        self.assertTrue(np.isnan(moving_average(values,50)).all())
+        self.assertTrue(np.isnan(moving_average(values,50,'trailing')).all())
+        np.testing.assert_allclose(moving_average(values,50,'edge'),baseline_moving_average(values,50,'edge'))
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError,moving_average,self.values,5,'leading')
+
+    def test_processed_data_matches_loop(self):
+        values = self.values[:100]
+        for resolution in [4,10]:
+            columns = np.tile(values,(len(PROCESSED_DATA_VARIABLES),1))
+            processed = ProcessedData('columns',[columns,[0,100]])
+            processed.moving_average(resolution)
+            np.testing.assert_allclose(processed.dV_update,baseline_centered_average(list(values),resolution),
+                                       rtol=1e-10)
+            self.assertEqual(len(processed.dX_graph),100-resolution/2)
+
+
+class ProcessedDataTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.columns = np.random.randn(len(PROCESSED_DATA_VARIABLES),50)
+        self.processed = ProcessedData('columns',[self.columns,[0,20,50]])
+
+    def test_replace_and_restore_original(self):
+        processed = self.processed
+        original_dV = processed.dV
+        processed.moving_average(10)
+        processed.replace_original()
+        self.assertEqual(processed.index,45)
+        np.testing.assert_array_equal(processed.offsets,[0,20,45])
+        processed.restore_original()
+        self.assertEqual(processed.index,50)
+        np.testing.assert_array_equal(processed.offsets,[0,20,50])
+        np.testing.assert_array_equal(processed.dV,self.columns[0])
+        np.testing.assert_array_equal(original_dV,self.columns[0])  # Arrays handed out are not overwritten
+
+    def test_remove_outliers_offsets(self):
+        self.columns[0,[5,30]] = 1e6
+        processed = ProcessedData('columns',[self.columns,[0,20,50]])
+        processed.remove_outliers(5,10)
+        processed.replace_original()
+        np.testing.assert_array_equal(processed.offsets,[0,19,48])
+        self.assertEqual(processed.columns().shape,(len(PROCESSED_DATA_VARIABLES),48))
+
+
+class CsvRowsTest(unittest.TestCase):
+
+    def test_matches_row_writes(self):
+        random = np.random.RandomState(0)
+        matrix = random.randn(500,9)*10.**random.randint(-20,20,(500,9))
+        matrix[::7,0] = np.round(matrix[::7,0])
+        matrix[::5,1] = 0.9999999999999  # Rounded to an integer by 12 significant digits
+        matrix[::3,2] = 1e12
+        matrix[1::3,2] = 123456789012.
+        matrix[::11,3] = np.nan
+        matrix[::13,4] = np.inf
+        matrix[::17,5] = -np.inf
+        matrix[::19,6] = 1e-5
+        row_writes = ''.join([','.join(["{}".format(value) for value in row]) + '\n' for row in matrix.tolist()])
+        self.assertEqual(csv_rows(matrix),row_writes)
+        self.assertEqual(csv_rows(matrix[:0]),'')
+        self.assertEqual(csv_rows([[-0.0,2]]),'-0.0,2.0\n')
+
+
+class SummaryAccumulatorTest(unittest.TestCase):
+
+    def test_empty(self):
+        summary = SummaryAccumulator()
+        summary.merge(SummaryAccumulator())
+        self.assertTrue(np.isnan(summary.mean_speed()))
+        self.assertTrue(np.isnan(summary.max_deceleration()))
+        self.assertTrue(np.isnan(summary.percent_wipers_active()))
+        self.assertTrue(np.isnan(summary.percent_car_following()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,460 @@
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import warnings
+import numpy as np
+from functions import *
+
+"""
+Regression tests of the importers, the parsed file cache and the processed data exports.
+Run with: python -m unittest discover
+"""
+
+
+class ParseNumericLinesTest(unittest.TestCase):
+
+    def assert_parsed(self,lines,expected):
+        values = parse_numeric_lines(lines)
+        np.testing.assert_array_equal(values,np.array(expected,dtype=float))
+
+    def test_numeric_block(self):
+        self.assert_parsed(['1,2\n','3,4.5\n'],[[1,2],[3,4.5]])
+        self.assert_parsed(['1, 2,nan\n','-inf,1e5,0\n'],[[1,2,np.nan],[-np.inf,1e5,0]])
+
+    def test_malformed_last_cell(self):
+        # Text entries are 'nan' wherever they are in the block
+        self.assert_parsed(['1,2\n','3,2017-06-12\n'],[[1,2],[3,np.nan]])
+        self.assert_parsed(['1,2017-06-12\n','3,4\n'],[[1,np.nan],[3,4]])
+        for cell in ['12abc','0x10','1.2.3']:
+            self.assert_parsed(['1,2\n','3,{}\n'.format(cell)],[[1,2],[3,np.nan]])
+
+    def test_blank_and_short_rows(self):
+        self.assert_parsed(['1,,3\n','4\n',' ,5, \n'],[[1,np.nan,3],[4,np.nan,np.nan],[np.nan,5,np.nan]])
+        self.assert_parsed(['\n'],[[np.nan]])
+
+
+class CsvBlocksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assert_blocks(self,text,expected):
+        open(os.path.join(self.path,'trip.csv'),'w').write(text)
+        baseline = np.genfromtxt(os.path.join(self.path,'trip.csv'),delimiter=',',skip_header=1,missing_values=np.nan)
+        np.testing.assert_array_equal(baseline.reshape(np.shape(expected)),expected)
+        for block_size in [1,2,3,10]:
+            blocks = list(iter_csv_blocks('trip.csv',self.path,block_size))
+            self.assertTrue(all([len(block) > 0 for block in blocks]))
+            np.testing.assert_array_equal(np.concatenate(blocks),expected)
+
+    def test_trailing_blank_lines(self):
+        self.assert_blocks('a,b\n1,2\n3,4\n\n',[[1,2],[3,4]])
+        self.assert_blocks('a,b\n1,2\n3,4\n\n\n \n',[[1,2],[3,4]])
+
+    def test_blank_lines_within_file(self):
+        self.assert_blocks('a,b\n1,2\n\n\n3,\n5,6',[[1,2],[3,np.nan],[5,6]])
+
+    def test_single_column(self):
+        self.assert_blocks('a\n1\n2\n\n',[[1],[2]])
+
+    def test_importers(self):
+        open(os.path.join(self.path,'stac.csv'),'w').write('a,b\n1,2\n3,4\n\n')
+        np.testing.assert_array_equal(import_nds_stac('stac.csv',self.path,block_size=2),[[1,2],[3,4]])
+
+
+def baseline_time_interpolation(time,value,nds_time):
+    # Sequential STAC merge of the original import_wy_nds_stac - reference of the array version
+    new_value = [np.nan for i in range(len(nds_time))]
+    j = 0
+    for i in range(len(nds_time)):
+        while time[j]<nds_time[i] and j<len(time)-1:
+            if time[j]<nds_time[i] and time[j+1]>nds_time[i]:
+                new_value[i] = (value[j+1]-value[j])/(time[j+1]-time[j])*(nds_time[i]-time[j])+value[j]
+            j+=1
+    for i in range(len(new_value)-2):
+        if np.isfinite(new_value[i+1]) == False:
+            new_value[i+1] = np.mean([new_value[i],new_value[i+2]])
+    return new_value
+
+
+def write_csv(file_path,header,values):
+    file = open(file_path,'w')
+    file.write(header + '\n')
+    file.write(''.join([','.join(['' if np.isnan(value) else repr(value) for value in row]) + '\n' for row in values]))
+    file.close()
+
+
+class StacAlignmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        random = np.random.RandomState(3)
+        nds = random.rand(120,len(NDS_COLUMN_NAMES))
+        self.nds_time = np.arange(120)*100.+1000
+        self.nds_time[[40,41,90]] = np.nan
+        nds[:,NDS_COLUMN_INDEX['vtti_time_stamp']] = self.nds_time
+        write_csv(os.path.join(self.path,'Event_ID_1.csv'),','.join(NDS_COLUMN_NAMES),nds)
+
+        # STAC rows in time order per track, tracks interleaved - track 4 has no rows, track 7 a single row; sparse
+        # time stamps (gaps of 'nan' after interpolation), 'nan' and infinite velocities
+        stac = list()
+        for time in np.arange(900,13500,70.):
+            for track in [1,2,3,5,8]:
+                if track == 2 and 5000 < time < 8000 or track == 3 and int(time) % 3 == 0:
+                    continue
+                stac.append([time,track] + list(random.rand(8)) + [random.randn()])
+        stac.append([5000,7] + list(random.rand(9)))
+        # Track 6 - gaps next to infinite interpolated values (1100: inf, 1200: gap, 1400: -inf, 1500: gap)
+        for time, value in zip([1000,1150,1250,1350,1500,1650,1800],[0,np.inf,1,2,-np.inf,3,4]):
+            stac.append([time,6] + list(random.rand(8)) + [value])
+        stac = np.array(stac)
+        rows = np.flatnonzero(stac[:,1] == 5)
+        stac[rows[10],10] = np.nan
+        stac[rows[20:35],10] = np.inf
+        stac[rows[35],10] = -np.inf
+        stac[rows[60:75],10] = -np.inf
+        self.stac = stac
+        write_csv(os.path.join(self.path,'stac.csv'),'time,track,' + ','.join(['c{}'.format(i) for i in range(9)]),stac)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_matches_baseline(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # Infinite velocities of the baseline merge
+            for collection in [import_wy_nds_stac('Event_ID_1.csv',self.path,'stac.csv',self.path),
+                               import_wy_nds_stac('Event_ID_1.csv',self.path,'stac.csv',self.path,
+                                                  columns=CF_PIPELINE_COLUMNS)]:
+                for track in range(1,9):
+                    rows = self.stac[:,1] == track
+                    expected = np.empty(len(self.nds_time))
+                    expected[:] = np.nan
+                    if rows.any():
+                        expected = baseline_time_interpolation(self.stac[rows,0],self.stac[rows,10],self.nds_time)
+                    np.testing.assert_array_equal(collection.column('track{}_x_vel_processed'.format(track)),
+                                                  expected)
+
+    def test_single_assignment(self):
+        collection = import_wy_nds('Event_ID_1.csv',self.path)
+        view = collection.select(np.arange(0,120,2))
+        values = np.arange(120.).reshape(60,2)
+        view.set_columns(['track2_x_vel_processed','track5_x_vel_processed'],values)
+        np.testing.assert_array_equal(collection.column('track5_x_vel_processed')[::2],values[:,1])
+        self.assertTrue(np.isnan(collection.column('track5_x_vel_processed')[1::2]).all())
+
+
+def cf_trip(time_stamps,target_ids,distances,speeds):
+    # Trip with one radar track - row numbers in system_time_stamp; 'nan' target id: no lead vehicle
+    rows = np.empty((len(time_stamps),len(NDS_COLUMN_NAMES)))
+    rows[:] = np.nan
+    rows[:,NDS_COLUMN_INDEX['system_time_stamp']] = np.arange(len(time_stamps))
+    rows[:,NDS_COLUMN_INDEX['vtti_time_stamp']] = time_stamps
+    rows[:,NDS_COLUMN_INDEX['track1_target_id']] = target_ids
+    rows[:,NDS_COLUMN_INDEX['track1_is_lead_vehicle']] = 1
+    rows[:,NDS_COLUMN_INDEX['track1_x_pos_processed']] = distances
+    rows[:,NDS_COLUMN_INDEX['vtti_speed_network']] = speeds
+    return PointCollection(rows)
+
+
+def baseline_car_following_instances(collection,min_cf_time,max_cf_dist,min_speed):
+    # Car following passes of the original generate_car_following_collections - reference of the segmentation
+    points = [collection[i] for i in range(collection.point_count())]
+    lead_targets = list()
+    for point in points:
+        if point.lead_target_id() is not None and point.lead_target_id() not in lead_targets:
+            lead_targets.append(point.lead_target_id())
+    groups = [list() for target in lead_targets]
+    for point in points:
+        for j in range(len(lead_targets)):
+            if point.lead_target_id() == lead_targets[j]:
+                if len(groups[j]) == 0 or point.vtti_time_stamp < groups[j][-1].vtti_time_stamp+3000:
+                    groups[j].append(point)
+
+    def split(groups,condition):
+        runs = list()
+        for group in groups:
+            run = list()
+            for point in group:
+                if condition(point):
+                    run.append(point)
+                elif len(run) > 0:
+                    runs.append(run)
+                    run = list()
+            if len(run) > 0:
+                runs.append(run)
+        return runs
+    runs = split(groups,lambda point: point.lead_target_dist() < max_cf_dist)
+    runs = split(runs,lambda point: point.vtti_speed_network > min_speed)
+    return [[point[0] for point in run] for run in runs if len(run)/float(10) >= min_cf_time]
+
+
+class CarFollowingSegmentsTest(unittest.TestCase):
+
+    def instances(self,collection,min_cf_time=2,max_cf_dist=60,min_speed=1):
+        collections = generate_car_following_collections(collection,min_cf_time,max_cf_dist,min_speed)
+        return [collections[i].column('system_time_stamp').tolist() for i in range(len(collections))]
+
+    def test_minimum_time(self):
+        # 20 points (2 s) are an instance, 19 points are not - at the start and the end of the trip
+        trip = cf_trip(np.arange(60)*100,[1]*20+[np.nan]*21+[2]*19,[30]*60,[50]*60)
+        self.assertEqual(self.instances(trip),[range(20)])
+        trip = cf_trip(np.arange(60)*100,[1]*19+[np.nan]*21+[2]*20,[30]*60,[50]*60)
+        self.assertEqual(self.instances(trip),[range(40,60)])
+
+    def test_maximum_distance(self):
+        # A lead distance equal to max_cf_dist ends the instance (rounded to 3 decimals)
+        distances = [30]*25 + [60] + [30]*25 + [60.0004] + [59.9996]*20
+        trip = cf_trip(np.arange(72)*100,[1]*72,distances,[50]*72)
+        self.assertEqual(self.instances(trip),[range(25),range(26,51)])
+        self.assertEqual(self.instances(trip,max_cf_dist=60.001),[range(72)])
+
+    def test_minimum_speed(self):
+        speeds = [50]*25 + [1] + [50]*25 + [1.001] + [50]*5
+        trip = cf_trip(np.arange(57)*100,[1]*57,[30]*57,speeds)
+        self.assertEqual(self.instances(trip),[range(25),range(26,57)])
+
+    def test_time_gap(self):
+        # The points of a target after a gap of 3000 ms or more are dropped; a gap of 2999 ms is bridged
+        time_stamps = np.concatenate((np.arange(20)*100,np.arange(20)*100+4899,np.arange(20)*100+9799))
+        trip = cf_trip(time_stamps,[1]*60,[30]*60,[50]*60)
+        self.assertEqual(self.instances(trip),[range(40)])
+        time_stamps[20:] += 1
+        self.assertEqual(self.instances(cf_trip(time_stamps,[1]*60,[30]*60,[50]*60)),[range(20)])
+
+    def test_lead_change(self):
+        # A new lead target splits the run; the first target's points are grouped with its later reappearance
+        target_ids = [1]*20 + [2]*20 + [1]*10
+        trip = cf_trip(np.arange(50)*100,target_ids,[30]*50,[50]*50)
+        self.assertEqual(self.instances(trip),[range(20)+range(40,50),range(20,40)])
+        target_ids = [1]*20 + [2]*20 + [1]*10
+        trip = cf_trip(np.arange(50)*100+np.array([0]*40+[2000]*10),target_ids,[30]*50,[50]*50)
+        self.assertEqual(self.instances(trip),[range(20),range(20,40)])
+
+    def test_matches_baseline(self):
+        random = np.random.RandomState(4)
+        for trial in range(20):
+            point_count = random.randint(1,1500)
+            time_stamps = np.cumsum(random.choice([100,2999,3000],point_count,p=[.98,.01,.01])).astype(float)
+            time_stamps[random.rand(point_count) < 0.003] = np.nan
+            target_ids = np.repeat(random.randint(1,6,point_count//50+1).astype(float),50)[:point_count]
+            target_ids[random.rand(point_count) < 0.01] = np.nan
+            distances = random.choice([30,59.9996,60,80,np.nan],point_count,p=[.96,.01,.01,.01,.01])
+            speeds = random.choice([50,1,0,np.nan],point_count,p=[.991,.003,.003,.003])
+            trip = cf_trip(time_stamps,target_ids,distances,speeds)
+            for min_cf_time, max_cf_dist in [(1,60),(0.1,80),(3,60)]:
+                self.assertEqual(self.instances(trip,min_cf_time,max_cf_dist),
+                                 baseline_car_following_instances(trip,min_cf_time,max_cf_dist,1))
+
+
+def load_numbered_file(arguments):
+    # Worker of CacheTest - parses its own file into the shared cache
+    path, cache_path, number = arguments
+    data = load_cached_array('{}.csv'.format(number),path,cache_path,'test',
+                             lambda: import_numeric_csv('{}.csv'.format(number),path,skip_header=0))
+    return float(data[0,0])
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.path,'cache')
+        self.parse_count = 0
+        for number in range(8):
+            self.write_file('{}.csv'.format(number),number)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_file(self,file_name,number):
+        file = open(os.path.join(self.path,file_name),'w')
+        file.write(''.join(['{},{}\n'.format(number,i) for i in range(100)]))
+        file.close()
+
+    def load(self,file_name,max_bytes=CACHE_MAX_BYTES):
+        def parse():
+            self.parse_count += 1
+            return import_numeric_csv(file_name,self.path,skip_header=0)
+        return load_cached_array(file_name,self.path,self.cache_path,'test',parse,max_bytes=max_bytes)
+
+    def cached_files(self):
+        return sorted([entry['array_file'] for entry in read_cache_index(self.cache_path).values()])
+
+    def test_parsed_once(self):
+        first = self.load('0.csv')
+        second = self.load('0.csv')
+        self.assertEqual(self.parse_count,1)
+        self.assertTrue(isinstance(second,np.memmap))
+        np.testing.assert_array_equal(first,second)
+
+    def test_edited_file_parsed_again(self):
+        self.load('0.csv')
+        file_path = os.path.join(self.path,'0.csv')
+        mtime = os.path.getmtime(file_path)
+        self.write_file('0.csv',9)  # Same size, new content
+        os.utime(file_path,(mtime+10,mtime+10))
+        np.testing.assert_array_equal(self.load('0.csv')[:,0],9)
+        self.assertEqual(self.parse_count,2)
+        open(file_path,'a').write('9,100\n')  # New size
+        os.utime(file_path,(mtime+10,mtime+10))
+        self.assertEqual(len(self.load('0.csv')),101)
+        self.assertEqual(self.parse_count,3)
+        os.utime(file_path,(mtime+20,mtime+20))  # Touched - same content, not parsed again
+        self.assertEqual(len(self.load('0.csv')),101)
+        self.assertEqual(self.parse_count,3)
+
+    def test_copied_file_reused(self):
+        self.load('0.csv')
+        shutil.copy(os.path.join(self.path,'0.csv'),os.path.join(self.path,'copy.csv'))
+        self.load('copy.csv')
+        self.assertEqual(self.parse_count,1)
+        self.assertEqual(len(read_cache_index(self.cache_path)),2)
+        self.assertEqual(len(set(self.cached_files())),1)
+
+    def test_least_recently_used_evicted(self):
+        for number in range(3):
+            self.load('{}.csv'.format(number))
+        array_bytes = read_cache_index(self.cache_path).values()[0]['bytes']
+        self.load('0.csv')  # Most recently used
+        self.load('3.csv',max_bytes=2*array_bytes)
+        files = [read_cache_index(self.cache_path)[key]['file'] for key in read_cache_index(self.cache_path)]
+        self.assertEqual(sorted([os.path.basename(file) for file in files]),['0.csv','3.csv'])
+        self.assertEqual(sorted(os.listdir(self.cache_path)),sorted(self.cached_files() + ['cache_index.json']))
+        self.assertEqual(evict_cache(self.cache_path,0),0)
+        self.assertEqual(read_cache_index(self.cache_path),dict())
+
+    def test_failed_removal_kept_in_index(self):
+        self.load('0.csv')
+        self.load('1.csv')
+        remove = os.remove
+        def locked_remove(file_path):
+            if file_path.endswith('.npy'):
+                raise OSError('in use')
+            remove(file_path)
+        os.remove = locked_remove
+        try:
+            self.assertTrue(evict_cache(self.cache_path,0) > 0)
+        finally:
+            os.remove = remove
+        self.assertEqual(len(read_cache_index(self.cache_path)),2)
+        self.assertEqual(evict_cache(self.cache_path,0),0)
+
+    def test_concurrent_workers(self):
+        pool = multiprocessing.Pool(4)
+        values = pool.map(load_numbered_file,[(self.path,self.cache_path,number % 8) for number in range(32)])
+        pool.close()
+        pool.join()
+        self.assertEqual(values,[number % 8 for number in range(32)])
+        self.assertEqual(len(read_cache_index(self.cache_path)),8)
+        self.assertEqual(sorted(os.listdir(self.cache_path)),sorted(self.cached_files() + ['cache_index.json']))
+
+
+class ProcessedDataExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        np.random.seed(2)
+        self.processed = ProcessedData('list',[ProcessedData('wy_nds',np.random.randn(count,8)) for count in (30,50)])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assert_same(self,imported,processed):
+        np.testing.assert_array_equal(imported.columns(),processed.columns())
+        np.testing.assert_array_equal(imported.offsets,processed.offsets)
+
+    def test_round_trip(self):
+        self.processed.binary_export('trip.bin',self.path,{'event_id': 7})
+        imported = import_processed_data('trip.bin',self.path)
+        self.assert_same(imported,self.processed)
+        self.assertEqual(imported.metadata,{'event_id': 7})
+        base = imported.columns()
+        while base is not None and isinstance(base,np.memmap) == False:
+            base = base.base
+        self.assertTrue(isinstance(base,np.memmap))  # Memory mapped - not copied
+        self.assertFalse(imported.dV.flags.writeable)
+        self.assert_same(import_processed_data('trip.bin',self.path,mmap_mode=None),self.processed)
+
+    def test_updated_version(self):
+        self.processed.moving_average(6)
+        self.processed.replace_original()
+        self.processed.binary_export('trip.bin',self.path)
+        imported = import_processed_data('trip.bin',self.path)
+        self.assert_same(imported,self.processed)
+        imported.kalman_filter()  # Updates of a read only memory map
+        imported.replace_original()
+        self.assertEqual(imported.index,self.processed.index-1)
+
+    def test_empty(self):
+        ProcessedData('blank',list()).binary_export('empty.bin',self.path)
+        imported = import_processed_data('empty.bin',self.path)
+        self.assertEqual(imported.index,0)
+        np.testing.assert_array_equal(imported.offsets,[0])
+
+    def test_not_an_export(self):
+        open(os.path.join(self.path,'trip.csv'),'w').write('1,2\n')
+        self.assertRaises(ValueError,import_processed_data,'trip.csv',self.path)
+
+
+class MapJobsTest(unittest.TestCase):
+
+    def test_results_in_job_order(self):
+        jobs = [[i,[i,2]] for i in range(20)]
+        expected = [(i,i**2) for i in range(20)]
+        self.assertEqual(list(map_jobs(pow,jobs,processes=1)),expected)
+        self.assertEqual(list(map_jobs(pow,jobs,processes=2,max_in_flight=1)),expected)
+        self.assertEqual(list(map_jobs(pow,[],processes=2)),[])
+
+
+class ProcessedDataFiguresTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_no_car_following_instances(self):
+        figures = list()
+        processed = processed_data([],self.path,'1',figures=figures)
+        self.assertEqual(processed.index,0)
+        self.assertEqual([os.path.basename(file_path) for spec, file_path in figures],['1_0_ALL_Events'])
+
+
+class SummarizeTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        np.random.seed(1)
+        values = np.random.randint(0,4,(2500,len(NDS_COLUMN_NAMES))).astype(float)
+        values[:,NDS_COLUMN_INDEX['vtti_speed_network']] = np.random.rand(2500)*100
+        values[:,NDS_COLUMN_INDEX['vtti_accel_x']] = np.random.randn(2500)
+        values[::7,NDS_COLUMN_INDEX['vtti_accel_x']] = np.nan
+        file = open(os.path.join(self.path,'Event_ID_1.csv'),'w')
+        file.write(','.join(NDS_COLUMN_NAMES) + '\n')
+        file.write(''.join([','.join(['' if np.isnan(value) else repr(value) for value in row]) + '\n'
+                            for row in values]) + '\n')  # Trailing blank line - read as a block of its own
+        file.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_blocks_match_whole_trip(self):
+        variables = ['vtti_speed_gps','vtti_accel_x']
+        blocks = summarize_trip('Event_ID_1.csv',self.path,None,self.path,variables=variables,block_size=500)
+        whole = SummaryAccumulator(variables)
+        whole.update(import_wy_nds('Event_ID_1.csv',self.path,columns=CF_PIPELINE_COLUMNS + variables))
+        self.assertEqual(blocks.point_count,2500)
+        for name in ['mean_speed','max_deceleration','percent_wipers_active','percent_car_following']:
+            self.assertAlmostEqual(getattr(blocks,name)(),getattr(whole,name)(),places=9)
+        np.testing.assert_allclose(np.array(blocks.variable_statistics.statistics(),dtype=float),
+                                   np.array(whole.variable_statistics.statistics(),dtype=float),rtol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()